@@ -0,0 +1,51 @@
+"""
+Measure the time needed to `import grizzly` in a fresh interpreter.
+
+Every run starts a new Python process so that nothing is cached in
+sys.modules. Besides the wall clock time, we report which of the heavy
+optional dependencies were loaded as a side effect of the import.
+
+Usage: python benchmarks/importtime.py [runs] [module]
+"""
+import json
+import statistics
+import subprocess
+import sys
+
+# modules that must not be loaded by a plain `import grizzly`
+HEAVY_MODULES = ["antlr4", "cx_Oracle", "psycopg2", "pandas", "numpy", "yaml", "beautifultable"]
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import {module}
+end = time.perf_counter()
+loaded = [m for m in {heavy} if m in sys.modules]
+print(json.dumps({{"secs": end - start, "loaded": loaded}}))
+"""
+
+def measure(module="grizzly", runs=20):
+  code = PROBE.format(module=module, heavy=HEAVY_MODULES)
+
+  times = []
+  loaded = set()
+  for _ in range(runs):
+    out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    res = json.loads(out.strip().splitlines()[-1])
+    times.append(res["secs"])
+    loaded.update(res["loaded"])
+
+  return {
+    "module": module,
+    "runs": runs,
+    "min_ms": min(times) * 1000,
+    "median_ms": statistics.median(times) * 1000,
+    "max_ms": max(times) * 1000,
+    "heavy_modules_loaded": sorted(loaded)
+  }
+
+if __name__ == "__main__":
+  runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+  module = sys.argv[2] if len(sys.argv) > 2 else "grizzly"
+
+  print(json.dumps(measure(module, runs), indent=2))
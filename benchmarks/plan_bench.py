@@ -0,0 +1,179 @@
+"""
+Micro-benchmarks for the client side overhead of grizzly: building the
+operator tree (Schema.check/infer, _updateRef, ...) and generating the SQL
+string from it. No query is executed.
+
+The benchmarks use pytest-benchmark. As the file does not match the test
+file pattern, it is not run with the normal tests and has to be given
+explicitly:
+
+  pytest benchmarks/plan_bench.py --benchmark-only
+  pytest benchmarks/plan_bench.py --benchmark-autosave            # store a result
+  pytest benchmarks/plan_bench.py --benchmark-compare --benchmark-compare-fail=median:20%
+
+Besides the timings, every benchmark records the number of plan nodes
+(operators plus expression nodes) and the memory allocated per node while
+building the plan in benchmark.extra_info, which ends up in the JSON output
+of pytest-benchmark.
+"""
+import sqlite3
+import tracemalloc
+
+import pytest
+
+import grizzly
+from grizzly.dataframes.frame import Join, Union
+from grizzly.expression import BinaryExpression, ComputedCol, ExprTraverser, FuncCall
+from grizzly.generator import GrizzlyGenerator
+from grizzly.relationaldbexecutor import RelationalExecutor
+
+@pytest.fixture(autouse=True, scope="module")
+def backend():
+  # SQL generation needs a profile, but no data
+  con = sqlite3.connect(":memory:")
+  oldBackend = GrizzlyGenerator._backend
+  grizzly.use(RelationalExecutor(con))
+  yield
+  GrizzlyGenerator._backend = oldBackend
+  con.close()
+
+def wideTable(numCols, name="wide"):
+  schema = {f"c{i}": int for i in range(numCols)}
+  return grizzly.read_table(name, schema=schema)
+
+###########################################################################
+# helpers
+
+def _exprNodes(e):
+  cnt = [0]
+  def visitor(x):
+    cnt[0] += 1
+    if isinstance(x, ComputedCol):
+      cnt[0] += _exprNodes(x.value)
+    elif isinstance(x, FuncCall):
+      cnt[0] += sum(_exprNodes(c) for c in x.inputCols)
+  ExprTraverser.df(e, visitor)
+  return cnt[0]
+
+def countNodes(df):
+  '''number of operators and expression nodes in the plan of df'''
+  cnt = 0
+  todo = [df]
+  while todo:
+    current = todo.pop()
+    cnt += 1
+
+    exprs = list(current.computedCols)
+    for attr in ["expr", "columns", "groupCols", "aggFunc", "by", "having"]:
+      value = current.__dict__.get(attr)
+      if isinstance(value, list):
+        exprs += value
+      elif value is not None:
+        exprs.append(value)
+
+    for e in exprs:
+      if isinstance(e, list):
+        cnt += len(e)
+      elif isinstance(e, BinaryExpression) and isinstance(e.right, list):
+        cnt += 1 + _exprNodes(e.left) + len(e.right)
+      else:
+        cnt += _exprNodes(e)
+
+    if current.parents:
+      todo += current.parents
+    if isinstance(current, Join) or isinstance(current, Union):
+      todo.append(current.rightParent())
+
+  return cnt
+
+def recordMemory(benchmark, build):
+  '''build the plan once more with tracemalloc and store the memory per plan node'''
+  tracemalloc.start()
+  try:
+    df = build()
+    (current, peak) = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+
+  nodes = countNodes(df)
+  benchmark.extra_info["nodes"] = nodes
+  benchmark.extra_info["bytes"] = current
+  benchmark.extra_info["peak_bytes"] = peak
+  benchmark.extra_info["bytes_per_node"] = current / nodes
+  return df
+
+###########################################################################
+# plan builders
+
+def wideProjection(numCols):
+  t = wideTable(numCols)
+  return t[[f"c{i}" for i in range(numCols)]]
+
+def wideFilterProject(numCols):
+  t = wideTable(numCols)
+  t = t[(t.c0 > 10) & (t[f"c{numCols - 1}"] < 100)]
+  return t[[f"c{i}" for i in range(0, numCols, 2)]]
+
+def deepChain(depth):
+  df = wideTable(10)
+  for i in range(depth):
+    if i % 3 == 0:
+      df = df[df.c1 > i + 1]
+    elif i % 3 == 1:
+      df = df[["c0", "c1", "c2", "c3"]]
+    else:
+      df = df.sort_values("c2")
+  return df
+
+def largeInList(size):
+  t = grizzly.read_table("t", index="c0", schema={"c0": int, "c1": str})
+  return t.loc[list(range(1, size + 1))]
+
+def orChain(size):
+  t = wideTable(2)
+  expr = t.c0 == 1
+  for i in range(2, size + 1):
+    expr = expr | (t.c0 == i)
+  return t[expr]
+
+def manyComputedCols(numCols):
+  t = wideTable(10)
+  for i in range(numCols):
+    t[f"x{i}"] = (t.c1 * (i + 1) + t.c2) / (t.c3 + 1)
+  return t
+
+def wideJoin(numCols):
+  l = wideTable(numCols, "l")
+  r = grizzly.read_table("r", schema={f"r{i}": int for i in range(numCols)})
+  j = l.join(r, on=["c0", "r0"])
+  return j.groupby(["c1", "r1"]).sum("c2", "s")
+
+###########################################################################
+# benchmarks
+
+CASES = [
+  ("wide_projection_500", wideProjection, 500),
+  ("wide_projection_2000", wideProjection, 2000),
+  ("wide_filter_project_1000", wideFilterProject, 1000),
+  ("deep_chain_100", deepChain, 100),
+  ("deep_chain_300", deepChain, 300),
+  ("in_list_1000", largeInList, 1000),
+  ("in_list_10000", largeInList, 10000),
+  ("or_chain_200", orChain, 200),
+  ("computed_cols_100", manyComputedCols, 100),
+  ("computed_cols_500", manyComputedCols, 500),
+  ("wide_join_500", wideJoin, 500)
+]
+
+@pytest.mark.parametrize("name,builder,size", CASES, ids=[c[0] for c in CASES])
+def test_build(benchmark, name, builder, size):
+  benchmark.group = "build"
+  recordMemory(benchmark, lambda: builder(size))
+  benchmark(builder, size)
+
+@pytest.mark.parametrize("name,builder,size", CASES, ids=[c[0] for c in CASES])
+def test_generate(benchmark, name, builder, size):
+  benchmark.group = "generate"
+  df = recordMemory(benchmark, lambda: builder(size))
+  (_, sql) = benchmark(df.generate)
+  benchmark.extra_info["sql_length"] = len(sql)
@@ -0,0 +1,177 @@
+"""
+Self-contained TPC-H benchmark on SQLite.
+
+Loads the TPC-H data bundled with the integration tests
+(grizzly/it/resources) into a SQLite database and runs the grizzly versions
+of the TPC-H queries from benchmarks/tpchqueries.py. For every query we
+report the time to build the DataFrame, to generate the SQL, to execute the
+query and to fetch the result, plus the peak Python memory allocated
+during one complete run (measured in an extra, untimed run, as tracemalloc
+slows everything down).
+
+The result is written as JSON so that it can be stored and compared with a
+later run to track regressions:
+
+  python benchmarks/tpch.py --runs 10 --output base.json
+  python benchmarks/tpch.py --runs 10 --compare base.json
+
+Run it from the repository root.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import grizzly
+from grizzly.generator import GrizzlyGenerator
+from grizzly.instrumentation import StatsCollector
+from grizzly.relationaldbexecutor import RelationalExecutor
+
+from tpchqueries import QUERIES
+
+RESOURCES = os.path.join(os.path.dirname(os.path.abspath(grizzly.__file__)), "it", "resources")
+TABLES = ["region", "nation", "supplier", "customer", "part", "partsupp", "orders", "lineitem"]
+
+PHASES = ["build", "generate", "execute", "fetch", "total"]
+
+def _runScript(con, path):
+  with open(path, "r") as f:
+    con.executescript(f.read())
+
+def load(con):
+  '''create the TPC-H tables and indexes in the given SQLite connection and load the bundled data'''
+  _runScript(con, os.path.join(RESOURCES, "tpch-scripts", "create_tables.sql"))
+  for t in TABLES:
+    _runScript(con, os.path.join(RESOURCES, "tpch", f"{t}.sql"))
+  # primary and foreign keys are created with ALTER TABLE, which SQLite does not support
+  _runScript(con, os.path.join(RESOURCES, "tpch-scripts", "create_indexes.sql"))
+  con.commit()
+
+def _runOnce(builder, collector):
+  start = time.perf_counter()
+  df = builder()
+  buildSecs = time.perf_counter() - start
+
+  collector.clear()
+  rows = df.collect()
+  stats = collector.finished[-1]
+
+  return {
+    "build": buildSecs,
+    "generate": stats.generateSecs,
+    "execute": stats.executeSecs,
+    "fetch": stats.fetchSecs,
+    "total": buildSecs + stats.totalSecs,
+    "rows": len(rows),
+    "sql": stats.sql
+  }
+
+def _peakMemory(builder):
+  tracemalloc.start()
+  try:
+    builder().collect()
+    (_, peak) = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return peak
+
+def run(queries, runs=5, warmup=1, db=":memory:"):
+  con = sqlite3.connect(db)
+  if db == ":memory:" or not con.execute("SELECT name FROM sqlite_master WHERE name = 'lineitem'").fetchone():
+    load(con)
+
+  executor = RelationalExecutor(con)
+  collector = executor.addHook(StatsCollector(keep=1))
+
+  oldBackend = GrizzlyGenerator._backend
+  grizzly.use(executor)
+  try:
+    results = {}
+    for name in queries:
+      builder = QUERIES[name]
+      for _ in range(warmup):
+        _runOnce(builder, collector)
+
+      measurements = [_runOnce(builder, collector) for _ in range(runs)]
+
+      res = {"runs": runs, "rows": measurements[0]["rows"]}
+      for phase in PHASES:
+        values = [m[phase] for m in measurements]
+        res[f"{phase}_min_ms"] = min(values) * 1000
+        res[f"{phase}_median_ms"] = statistics.median(values) * 1000
+      res["peak_memory_bytes"] = _peakMemory(builder)
+      res["sql"] = measurements[0]["sql"]
+      results[name] = res
+  finally:
+    GrizzlyGenerator._backend = oldBackend
+    con.close()
+
+  return {
+    "python": platform.python_version(),
+    "sqlite": sqlite3.sqlite_version,
+    "platform": platform.platform(),
+    "queries": results
+  }
+
+def compare(result, baseline, threshold=1.2):
+  '''
+  Compare the median total times with a previous result. Returns a list of
+  (query, baseline ms, current ms) for all queries that got slower than
+  baseline * threshold
+  '''
+  slower = []
+  for (name, res) in result["queries"].items():
+    base = baseline["queries"].get(name)
+    if base is None:
+      continue
+    if res["total_median_ms"] > base["total_median_ms"] * threshold:
+      slower.append((name, base["total_median_ms"], res["total_median_ms"]))
+  return slower
+
+def _summary(result):
+  lines = [f"{'query':<6} {'rows':>6} " + " ".join(f"{p + ' ms':>12}" for p in PHASES) + f" {'peak KiB':>10}"]
+  for (name, res) in result["queries"].items():
+    times = " ".join(f"{res[p + '_median_ms']:>12.3f}" for p in PHASES)
+    lines.append(f"{name:<6} {res['rows']:>6} {times} {res['peak_memory_bytes'] / 1024:>10.1f}")
+  return "\n".join(lines)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Run grizzly TPC-H queries on SQLite")
+  parser.add_argument("--queries", default=",".join(QUERIES.keys()), help="comma separated list of queries (default: all)")
+  parser.add_argument("--runs", type=int, default=5, help="measured runs per query")
+  parser.add_argument("--warmup", type=int, default=1, help="unmeasured runs per query")
+  parser.add_argument("--db", default=":memory:", help="SQLite database file. Data is loaded if it does not exist yet")
+  parser.add_argument("--output", help="write the JSON result to this file instead of stdout")
+  parser.add_argument("--compare", help="JSON result of a previous run to compare with")
+  parser.add_argument("--threshold", type=float, default=1.2, help="report queries slower than baseline * threshold")
+  args = parser.parse_args()
+
+  queries = [q.strip() for q in args.queries.split(",") if q.strip()]
+  unknown = [q for q in queries if q not in QUERIES]
+  if unknown:
+    parser.error(f"unknown queries: {unknown}. Available: {list(QUERIES.keys())}")
+
+  result = run(queries, args.runs, args.warmup, args.db)
+
+  if args.output:
+    with open(args.output, "w") as f:
+      json.dump(result, f, indent=2)
+    print(_summary(result), file=sys.stderr)
+  else:
+    print(json.dumps(result, indent=2))
+
+  if args.compare:
+    with open(args.compare, "r") as f:
+      baseline = json.load(f)
+    slower = compare(result, baseline, args.threshold)
+    for (name, base, current) in slower:
+      print(f"{name} got slower: {base:.3f} ms -> {current:.3f} ms", file=sys.stderr)
+    if slower:
+      sys.exit(1)
@@ -0,0 +1,147 @@
+"""
+Grizzly versions of TPC-H queries, used by benchmarks/tpch.py.
+
+The queries follow the TPC-H specification with the default substitution
+parameters, like grizzly/it/resources/scripts/grizzly_tpch3.py does for Q3.
+Where grizzly cannot (yet) express a construct, the query is simplified and
+the deviation is noted in the docstring. Each function builds and returns
+the DataFrame without executing it.
+"""
+import grizzly
+from grizzly.aggregates import AggregateType
+
+def q1():
+  """Pricing summary report"""
+  l = grizzly.read_table("lineitem")
+  l = l[l.l_shipdate <= "1998-09-02"]
+  l["disc_price"] = l.l_extendedprice * ((l.l_discount * -1) + 1)
+  l["charge"] = l.l_extendedprice * ((l.l_discount * -1) + 1) * (l.l_tax + 1)
+
+  g = l.groupby(["l_returnflag", "l_linestatus"])
+  g = g.sum("l_quantity", "sum_qty")
+  g = g.sum("l_extendedprice", "sum_base_price")
+  g = g.sum("disc_price", "sum_disc_price")
+  g = g.sum("charge", "sum_charge")
+  g = g.mean("l_quantity", "avg_qty")
+  g = g.mean("l_extendedprice", "avg_price")
+  g = g.mean("l_discount", "avg_disc")
+  g = g.count("l_orderkey", "count_order")
+  return g.sort_values(["l_returnflag", "l_linestatus"])
+
+def q3():
+  """Shipping priority"""
+  c = grizzly.read_table("customer")
+  o = grizzly.read_table("orders")
+  l = grizzly.read_table("lineitem")
+
+  c = c[c.c_mktsegment == "BUILDING"]
+  o = o[o.o_orderdate < "1995-03-15"]
+  l = l[l.l_shipdate > "1995-03-15"]
+  l["volume"] = l.l_extendedprice * ((l.l_discount * -1) + 1)
+
+  j = c.join(o, on=["c_custkey", "o_custkey"])
+  j = j.join(l, on=["o_orderkey", "l_orderkey"])
+
+  g = j.groupby(["l_orderkey", "o_orderdate", "o_shippriority"])
+  g = g.sum("volume", "revenue")
+  g = g[["l_orderkey", "revenue", "o_orderdate", "o_shippriority"]]
+  g = g.sort_values(["revenue", "o_orderdate"], ascending=[False, True])
+  return g.limit(10)
+
+def q5():
+  """Local supplier volume"""
+  c = grizzly.read_table("customer")
+  o = grizzly.read_table("orders")
+  l = grizzly.read_table("lineitem")
+  s = grizzly.read_table("supplier")
+  n = grizzly.read_table("nation")
+  r = grizzly.read_table("region")
+
+  r = r[r.r_name == "ASIA"]
+  o = o[(o.o_orderdate >= "1994-01-01") & (o.o_orderdate < "1995-01-01")]
+  l["volume"] = l.l_extendedprice * ((l.l_discount * -1) + 1)
+
+  j = c.join(o, on=["c_custkey", "o_custkey"])
+  j = j.join(l, on=["o_orderkey", "l_orderkey"])
+  j = j.join(s, on=(j.l_suppkey == s.s_suppkey) & (j.c_nationkey == s.s_nationkey))
+  j = j.join(n, on=["s_nationkey", "n_nationkey"])
+  j = j.join(r, on=["n_regionkey", "r_regionkey"])
+
+  g = j.groupby("n_name")
+  g = g.sum("volume", "revenue")
+  return g.sort_values("revenue", ascending=False)
+
+def q6():
+  """Forecasting revenue change"""
+  l = grizzly.read_table("lineitem")
+  l = l[(l.l_shipdate >= "1994-01-01") & (l.l_shipdate < "1995-01-01")]
+  l = l[(l.l_discount >= 0.05) & (l.l_discount <= 0.07) & (l.l_quantity < 24)]
+  l["volume"] = l.l_extendedprice * l.l_discount
+  return l.agg(AggregateType.SUM, "volume", "revenue")
+
+def q10():
+  """Returned item reporting"""
+  c = grizzly.read_table("customer")
+  o = grizzly.read_table("orders")
+  l = grizzly.read_table("lineitem")
+  n = grizzly.read_table("nation")
+
+  o = o[(o.o_orderdate >= "1993-10-01") & (o.o_orderdate < "1994-01-01")]
+  l = l[l.l_returnflag == "R"]
+  l["volume"] = l.l_extendedprice * ((l.l_discount * -1) + 1)
+
+  j = c.join(o, on=["c_custkey", "o_custkey"])
+  j = j.join(l, on=["o_orderkey", "l_orderkey"])
+  j = j.join(n, on=["c_nationkey", "n_nationkey"])
+
+  g = j.groupby(["c_custkey", "c_name", "c_acctbal", "c_phone", "n_name", "c_address", "c_comment"])
+  g = g.sum("volume", "revenue")
+  g = g.sort_values("revenue", ascending=False)
+  return g.limit(20)
+
+def q12():
+  """
+  Shipping modes and order priority.
+  Simplified: counts all lines per ship mode instead of the CASE based
+  split into high and low priority orders
+  """
+  o = grizzly.read_table("orders")
+  l = grizzly.read_table("lineitem")
+
+  l = l[(l.l_shipmode == "MAIL") | (l.l_shipmode == "SHIP")]
+  l = l[(l.l_commitdate < l.l_receiptdate) & (l.l_shipdate < l.l_commitdate)]
+  l = l[(l.l_receiptdate >= "1994-01-01") & (l.l_receiptdate < "1995-01-01")]
+
+  j = o.join(l, on=["o_orderkey", "l_orderkey"])
+  g = j.groupby("l_shipmode")
+  g = g.count("o_orderkey", "line_count")
+  return g.sort_values("l_shipmode")
+
+def q18():
+  """
+  Large volume customer.
+  The IN subquery is expressed as a join with the grouped lineitems
+  """
+  c = grizzly.read_table("customer")
+  o = grizzly.read_table("orders")
+  l = grizzly.read_table("lineitem")
+
+  big = l.groupby("l_orderkey")
+  big = big.sum("l_quantity", "sum_qty")
+  big = big[big.sum_qty > 300]
+
+  j = c.join(o, on=["c_custkey", "o_custkey"])
+  j = j.join(big, on=["o_orderkey", "l_orderkey"])
+  j = j[["c_name", "c_custkey", "o_orderkey", "o_orderdate", "o_totalprice", "sum_qty"]]
+  j = j.sort_values(["o_totalprice", "o_orderdate"], ascending=[False, True])
+  return j.limit(100)
+
+QUERIES = {
+  "q1": q1,
+  "q3": q3,
+  "q5": q5,
+  "q6": q6,
+  "q10": q10,
+  "q12": q12,
+  "q18": q18
+}
@@ -1,13 +1,15 @@
-from grizzly.dataframes.schema import ColType, SchemaError
-from grizzly.expression import ExpressionException
+from grizzly.dataframes.schema import ColType, Schema, SchemaError
+from grizzly.expression import Constant, ExpressionException
 import unittest
 import sqlite3
 import re
+import tempfile
 
 from matcher import CodeMatcher
 
 
 import grizzly
+import grizzly.udfcompiler as udfcompiler
 from grizzly.aggregates import AggregateType
 from grizzly.sqlgenerator import SQLGenerator
 from grizzly.relationaldbexecutor import RelationalExecutor
@@ -20,8 +22,15 @@ class DataFrameTest(CodeMatcher):
     executor = RelationalExecutor(c, gen)
     grizzly.use(executor)
 
+    # compiled UDFs are cached in a directory of the test, not in the user's home
+    self.cacheDir = tempfile.TemporaryDirectory()
+    self.oldCacheDir = udfcompiler.cacheDir
+    udfcompiler.cacheDir = self.cacheDir.name
+
   def tearDown(self):
     grizzly.close()
+    udfcompiler.cacheDir = self.oldCacheDir
+    self.cacheDir.cleanup()
 
   def test_loadWithSchemaInferSQLite(self):
     df = grizzly.read_table("events", inferSchema=True)
@@ -39,6 +48,121 @@ class DataFrameTest(CodeMatcher):
 
     self.assertDictEqual(expected, df.schema.typeDict)
 
+  def test_detectProfileSQLite(self):
+    c = sqlite3.connect(":memory:")
+    executor = RelationalExecutor(c)
+    self.assertEqual(executor.queryGenerator.profile, "sqlite")
+    c.close()
+
+  def test_detectProfileUnknown(self):
+    self.assertIsNone(RelationalExecutor._detectProfile(object()))
+
+  def test_importIsLazy(self):
+    import subprocess, sys
+    code = "import sys, grizzly, grizzly.relationaldbexecutor; print(','.join(m for m in ('antlr4','cx_Oracle','psycopg2') if m in sys.modules))"
+    loaded = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout.strip()
+    self.assertEqual(loaded, "")
+
+  def test_profileCached(self):
+    from grizzly.config import Config
+    c1 = Config.loadProfile("sqlite")
+    c2 = Config.loadProfile("sqlite")
+    self.assertIs(c1.config, c2.config)
+
+  def test_profileReloadOnChange(self):
+    import os, tempfile
+    from grizzly.config import Config
+
+    oldCwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as d:
+      os.chdir(d)
+      try:
+        with open("grizzly.yml", "w") as f:
+          f.write("sqlite:\n  limit: limit\n")
+        self.assertEqual(Config.loadProfile("sqlite")["limit"], "limit")
+
+        with open("grizzly.yml", "w") as f:
+          f.write("sqlite:\n  limit: top\n")
+        os.utime("grizzly.yml", ns=(0, 42))
+        self.assertEqual(Config.loadProfile("sqlite")["limit"], "top")
+      finally:
+        os.chdir(oldCwd)
+
+  def test_instrumentationHooks(self):
+    from grizzly.generator import GrizzlyGenerator
+    from grizzly.instrumentation import StatsCollector, HistogramExporter
+
+    c = sqlite3.connect(":memory:")
+    c.execute("create table hooktest(a int, b text)")
+    c.executemany("insert into hooktest values (?,?)", [(i, str(i)) for i in range(25)])
+
+    executor = RelationalExecutor(c)
+    executor.fetchBatchSize = 10
+    hist = HistogramExporter()
+    collector = executor.addHook(StatsCollector([hist]))
+
+    oldBackend = GrizzlyGenerator._backend
+    grizzly.use(executor)
+    try:
+      df = grizzly.read_table("hooktest")
+      self.assertEqual(len(df.collect()), 25)
+      self.assertEqual(df.count("a"), 25)
+    finally:
+      grizzly.use(oldBackend)
+      c.close()
+
+    self.assertEqual([s.action.name for s in collector.finished], ["collect", "fetchone"])
+
+    collectStats = collector.finished[0]
+    self.assertEqual(collectStats.rows, 25)
+    self.assertEqual(collectStats.batches, 3)
+    self.assertEqual(collectStats.bytes, 25 * 8 + 10 + 15 * 2)
+    self.assertTrue(collectStats.sql.lower().startswith("select * from hooktest"))
+
+    self.assertEqual(collector.finished[1].rows, 1)
+    self.assertEqual(sum(c for (_, c) in hist.buckets("collect")), 1)
+
+  def test_explainSQLite(self):
+    from grizzly.generator import GrizzlyGenerator
+
+    c = sqlite3.connect(":memory:")
+    c.execute("create table explaintest(a int, b text)")
+
+    oldBackend = GrizzlyGenerator._backend
+    grizzly.use(RelationalExecutor(c))
+    try:
+      df = grizzly.read_table("explaintest")
+      df = df[df.a > 3]
+      df = df.sort_values("b")
+      plan = df.explain()
+    finally:
+      grizzly.use(oldBackend)
+      c.close()
+
+    self.assertTrue(plan.sql.startswith("EXPLAIN QUERY PLAN SELECT"))
+    scans = plan.find("scan")
+    self.assertEqual(len(scans), 1)
+    self.assertEqual(scans[0].operators[0].table, "explaintest")
+    self.assertEqual(scans[0].operators[0].origin[0], __file__)
+
+  def test_explainPostgresJSON(self):
+    from grizzly.explain import Plan
+    gen = SQLGenerator("postgresql")
+    df = grizzly.read_table("events")
+    df = df[df.globaleventid > 3]
+
+    (pre, sql, fmt) = gen.generateExplain(df, analyze=True)
+    self.assertEqual(pre, [])
+    self.assertTrue(sql.startswith("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT"))
+
+    rows = [("""[{"Plan": {"Node Type": "Seq Scan", "Relation Name": "events", "Alias": "%s", "Filter": "(globaleventid > 3)", "Actual Total Time": 1.5}, "Execution Time": 1.7}]""" % df.parents[0].alias,)]
+    plan = Plan.fromRows(fmt, rows, sql, df, True)
+
+    self.assertEqual(plan.root.operation, "Seq Scan")
+    self.assertEqual(plan.root.properties["Actual Total Time"], 1.5)
+    self.assertEqual(plan.properties["Execution Time"], 1.7)
+    self.assertIs(plan.nodesFor(df.parents[0].alias)[0], plan.root)
+
   def test_aggNoGroupOnProjCol(self):
     df = grizzly.read_table('events')
     res = df[['globaleventid', 'actor2name', 'nummentions', 'numarticles']]
@@ -173,6 +297,49 @@ class DataFrameTest(CodeMatcher):
     self.assertEqual(res[0][0], theYear + monthYear)
 
 
+  def test_simplifyOrToIn(self):
+    df = grizzly.read_table("events")
+    df = df[(df.theyear == 2015) | (df.theyear == 2016) | (df.actor1name == "x") | (df.theyear == 2015)]
+
+    actual = df.generateQuery()
+    expected = "select * from (select * from events $t0) $t1 where $t1.theyear in (2015,2016) or $t1.actor1name = 'x'"
+    self.matchSnipped(actual, expected)
+
+  def test_simplifyFlattenAndDedup(self):
+    df = grizzly.read_table("events")
+    df = df[((df.theyear > 2000) & (df.monthyear < 201512)) & ((df.theyear > 2000) & (df.actor1name == None))]
+
+    actual = df.generateQuery()
+    expected = "select * from (select * from events $t0) $t1 where $t1.theyear > 2000 and $t1.monthyear < 201512 and $t1.actor1name is NULL"
+    self.matchSnipped(actual, expected)
+
+  def test_simplifyNot(self):
+    df = grizzly.read_table("events")
+    df = df[~((df.theyear > 2000) | ~(df.actor1name == "x"))]
+
+    actual = df.generateQuery()
+    expected = "select * from (select * from events $t0) $t1 where $t1.theyear <= 2000 and $t1.actor1name = 'x'"
+    self.matchSnipped(actual, expected)
+
+  def test_simplifyConstantFolding(self):
+    df = grizzly.read_table("events")
+    df = df[df.theyear > 2000 + 3 * 5]
+    df["x"] = df.theyear * ((df.monthyear * -1) + 1) + (Constant(2) * 3)
+
+    actual = df.generateQuery()
+    expected = "select *, (($t1.theyear * (1 - $t1.monthyear)) + 6) as x from (select * from events $t0) $t1 where $t1.theyear > 2015"
+    self.matchSnipped(actual, expected)
+
+  def test_simplifyDisabled(self):
+    from grizzly.generator import GrizzlyGenerator
+    GrizzlyGenerator._backend.queryGenerator.simplifyExpressions = False
+    df = grizzly.read_table("events")
+    df = df[(df.theyear == 2015) | (df.theyear == 2016)]
+
+    actual = df.generateQuery()
+    expected = "select * from (select * from events $t0) $t1 where $t1.theyear = 2015 or $t1.theyear = 2016"
+    self.matchSnipped(actual, expected)
+
   def test_New(self):
     df = grizzly.read_table("events")
     df = df["a"]
@@ -416,7 +583,7 @@ class DataFrameTest(CodeMatcher):
     
     sql = "select computed, count($t1.*) from (select *,mymod($t0.n_name) as computed from nation $t0) $t1 group by computed"
 
-    expected = f"""create or replace function mymod(s text) returns integer as $$return len(s) % 2$$ language plpython3u;{sql}"""
+    expected = f"""create or replace function mymod(s text) returns integer as $$return len(s) % 2$$ language plpython3u immutable parallel safe;{sql}"""
 
     GrizzlyGenerator._backend.queryGenerator = oldGen
 
@@ -552,6 +719,390 @@ class DataFrameTest(CodeMatcher):
     expected = "select * from (select $t2.m, $t2.x from (select * from (select * from b1 $t0) $t0 left outer join (select * from b2 $t1) $t1 on $t0.a = $t1.b and $t0.c <= $t1.d) $t2) $t2 inner join (select $t6.b, $t6.d from (select * from b3 $t4) $t6) $t6 on $t3.m = $t6.b and $t3.x <= $t6.d"
     self.matchSnipped(actual, expected)
 
+  def test_semiJoin(self):
+    df1 = grizzly.read_table("b1")
+    df2 = grizzly.read_table("b2")
+    df2 = df2[df2.x > 3]
+
+    j = df1.semi_join(df2, on=["a", "b"])
+    expected = "select * from (select * from b1 $t0) $t0 where exists (select 1 from (select * from (select * from b2 $t1) $t2 where $t2.x > 3) $t2 where $t0.a = $t2.b)"
+    self.matchSnipped(j.generateQuery(), expected)
+
+    j = df1.semi_join(df2, on=["a", "b"], method="in")
+    expected = "select * from (select * from b1 $t0) $t0 where $t0.a in (select $t2.b from (select * from (select * from b2 $t1) $t2 where $t2.x > 3) $t2)"
+    self.matchSnipped(j.generateQuery(), expected)
+
+  def test_antiJoin(self):
+    df1 = grizzly.read_table("b1")
+    df2 = grizzly.read_table("b2")
+
+    j = df1.anti_join(df2, on=(df1.a == df2.b) & (df1.c <= df2.d))
+    j = j[["a", "c"]]
+    expected = "select $t3.a, $t3.c from (select * from (select * from b1 $t0) $t0 where not exists (select 1 from (select * from b2 $t1) $t1 where $t0.a = $t1.b and $t0.c <= $t1.d)) $t3"
+    self.matchSnipped(j.generateQuery(), expected)
+
+    with self.assertRaises(ValueError):
+      df1.semi_join(df2, on=(df1.a == df2.b), method="in")
+
+    with self.assertRaises(ValueError):
+      df1.anti_join(df1, on=["a", "b"])
+
+  def test_semiJoinComputed(self):
+    df1 = grizzly.read_table("b1")
+    df2 = grizzly.read_table("b2")
+
+    j = df1.semi_join(df2, on=["a", "b"])
+    j["y"] = j.a + 1
+    expected = "select *,($t2.a + 1) as y from (select * from (select * from b1 $t0) $t0 where exists (select 1 from (select * from b2 $t1) $t1 where $t0.a = $t1.b)) $t2"
+    self.matchSnipped(j.generateQuery(), expected)
+
+  def test_semiJoinExec(self):
+    df = grizzly.read_table("events")
+    ids = df[df.globaleventid < 470000000]
+
+    semi = df.semi_join(ids, on=["globaleventid", "globaleventid"])
+    anti = df.anti_join(ids, on=["globaleventid", "globaleventid"])
+
+    self.assertEqual(len(semi.collect()), len(ids.collect()))
+    self.assertEqual(len(semi.collect()) + len(anti.collect()), len(df.collect()))
+
+    semi["next"] = semi.globaleventid + 1
+    self.assertTrue(all(r[-1] == r[0] + 1 for r in semi.collect()))
+
+  def test_rowNumber(self):
+    df = grizzly.read_table("events")
+    w = df.row_number(partition_by="actor1countrycode", order_by="globaleventid")
+    expected = "select *,row_number() over (partition by $t1.actor1countrycode order by $t1.globaleventid asc) as row_number_globaleventid from (select * from events $t0) $t1"
+    self.matchSnipped(w.generateQuery(), expected)
+
+    # top-3 per group
+    w = df.row_number(partition_by="actor1countrycode", order_by="globaleventid", alias="rn")
+    top = w[w.rn <= 3]
+    expected = "select * from (select *,row_number() over (partition by $t2.actor1countrycode order by $t2.globaleventid asc) as rn from (select * from events $t0) $t2) $t3 where $t3.rn <= 3"
+    self.matchSnipped(top.generateQuery(), expected)
+
+  def test_rank(self):
+    df = grizzly.read_table("events")
+    w = df.rank(order_by=["avgtone", "globaleventid"], ascending=[False, True], method="dense", alias="r")
+    expected = "select *,dense_rank() over (order by $t1.avgtone desc,$t1.globaleventid asc) as r from (select * from events $t0) $t1"
+    self.matchSnipped(w.generateQuery(), expected)
+
+    # a single direction applies to all order columns of the window
+    w = df.rank(order_by=["avgtone", "globaleventid"], ascending=False, alias="r")
+    expected = "select *,rank() over (order by $t1.avgtone desc,$t1.globaleventid desc) as r from (select * from events $t0) $t1"
+    self.matchSnipped(w.generateQuery(), expected)
+
+    # rank is a reserved word e.g. in MySQL, the default name has the order column
+    w = df.rank(order_by="avgtone", method="first")
+    expected = "select *,row_number() over (order by $t1.avgtone asc) as rank_avgtone from (select * from events $t0) $t1"
+    self.matchSnipped(w.generateQuery(), expected)
+
+    with self.assertRaises(ValueError):
+      df.rank(order_by="avgtone", method="average")
+
+    # ranking requires an order, there is no index to fall back to
+    with self.assertRaises(ValueError):
+      df.row_number()
+
+  def test_cumsumRolling(self):
+    df = grizzly.read_table("events", index="globaleventid")
+    w = df.cumsum("nummentions")
+    expected = "select *,sum($t1.nummentions) over (order by $t1.globaleventid asc rows between unbounded preceding and current row) as cumsum_nummentions from (select * from events $t0) $t1"
+    self.matchSnipped(w.generateQuery(), expected)
+
+    w = df.rolling(3, partition_by="actor1countrycode").mean("avgtone", "avg3")
+    expected = "select *,avg($t2.avgtone) over (partition by $t2.actor1countrycode order by $t2.globaleventid asc rows between 2 preceding and current row) as avg3 from (select * from events $t0) $t2"
+    self.matchSnipped(w.generateQuery(), expected)
+
+  def test_windowExec(self):
+    df = grizzly.read_table("events")
+    df = df[df.globaleventid < 470000000]
+    w = df.row_number(partition_by="actor1countrycode", order_by="globaleventid")
+    w = w.cumsum("nummentions", order_by="globaleventid", partition_by="actor1countrycode", alias="cs")
+    rows = w[["actor1countrycode", "globaleventid", "nummentions", "row_number_globaleventid", "cs"]].collect()
+
+    expected = {}
+    for (country, _, mentions, rowNumber, cs) in sorted(rows, key=lambda r: (str(r[0]), r[1])):
+      (n, s) = expected.get(country, (0, 0))
+      (n, s) = (n + 1, s + mentions)
+      expected[country] = (n, s)
+      self.assertEqual(rowNumber, n)
+      self.assertEqual(cs, s)
+
+  def test_windowComputed(self):
+    from grizzly.generator import GrizzlyGenerator
+    executor = GrizzlyGenerator._backend
+    executor.connection.execute("CREATE TEMP TABLE window_t(a INTEGER, n INTEGER)")
+    executor.connection.executemany("INSERT INTO window_t VALUES (?, ?)", [(i, i * 10) for i in range(5)])
+
+    # the computed column uses the window column
+    w = grizzly.read_table("window_t").cumsum("n", order_by="a")
+    w["y"] = w.cumsum_n * 2
+    expected = "select *,($t1.cumsum_n * 2) as y from (select *,sum($t1.n) over (order by $t1.a asc rows between unbounded preceding and current row) as cumsum_n from (select * from window_t $t0) $t1) $t1"
+    self.matchSnipped(w.generateQuery(), expected)
+
+    rows = sorted(w.collect())
+    self.assertEqual([r[3] for r in rows], [0, 20, 60, 120, 200])
+
+  def test_windowUnsupported(self):
+    from grizzly.config import Config
+    from grizzly.generator import GrizzlyGenerator
+    gen = GrizzlyGenerator._backend.queryGenerator
+    gen.templates = Config("sqlite", {k: v for (k, v) in gen.templates.config.items() if k != "window"})
+
+    df = grizzly.read_table("events", index="globaleventid")
+    with self.assertRaises(ValueError):
+      df.row_number().generateQuery()
+
+  def test_paginateQuery(self):
+    df = grizzly.read_table("events")
+    pages = df.paginate(["actor1countrycode", "globaleventid"], page_size=10, ascending=[True, False])
+
+    expected = "select * from (select * from events $t0) $t2 order by $t2.actor1countrycode asc,$t2.globaleventid desc limit 10"
+    self.matchSnipped(pages.query().generateQuery(), expected)
+
+    pages.lastKey = ["DEU", 470000000]
+    expected = "select * from (select * from (select * from events $t0) $t3 where $t3.actor1countrycode > 'DEU' or ($t3.actor1countrycode = 'DEU' and $t3.globaleventid < 470000000)) $t5 order by $t5.actor1countrycode asc,$t5.globaleventid desc limit 10"
+    self.matchSnipped(pages.query().generateQuery(), expected)
+
+  def test_paginateExec(self):
+    df = grizzly.read_table("events")
+    df = df[df.globaleventid < 470000000]
+    allIds = [r[0] for r in df.sort_values("globaleventid")[["globaleventid"]].collect()]
+
+    pages = list(df.sort_values("globaleventid").paginate(page_size=7))
+    self.assertTrue(all(len(p) == 7 for p in pages[:-1]))
+    ids = [row[0] for page in pages for row in page]
+    self.assertEqual(ids, allIds)
+
+    # resume after a given key
+    pages = df.paginate("globaleventid", page_size=1000, after=allIds[2])
+    self.assertEqual([row[0] for page in pages for row in page], allIds[3:])
+
+    with self.assertRaises(ValueError):
+      grizzly.read_table("events").paginate()
+
+  def test_paginateQuotedKey(self):
+    from grizzly.generator import GrizzlyGenerator
+    executor = GrizzlyGenerator._backend
+    executor.connection.execute("CREATE TEMP TABLE paginate_t(name TEXT)")
+    names = ["Adams", "O'Brien", "O'Connor", "Smith"]
+    executor.connection.executemany("INSERT INTO paginate_t VALUES (?)", [(n,) for n in names])
+
+    pages = list(grizzly.read_table("paginate_t").paginate("NAME", page_size=1))
+    self.assertEqual([row[0] for page in pages for row in page], names)
+
+    pages = grizzly.read_table("paginate_t").paginate("name", page_size=1)
+    pages.lastKey = ["O'Brien"]
+    self.assertIn("> 'O''Brien'", pages.query().generateQuery())
+
+  def test_sample(self):
+    df = grizzly.read_table("events")
+
+    s = df.sample(frac=0.1)
+    expected = "select * from (select * from events $t0) $t1 where (random() / 18446744073709551616.0 + 0.5) < 0.1"
+    self.matchSnipped(s.generateQuery(), expected)
+
+    s = df.sample(n=5)
+    expected = "select * from (select * from events $t0) $t2 order by (random() / 18446744073709551616.0 + 0.5) limit 5"
+    self.matchSnipped(s.generateQuery(), expected)
+
+    self.assertEqual(len(s.collect()), 5)
+    self.assertEqual(len(df.sample(frac=0.0).collect()), 0)
+    self.assertEqual(len(df.sample(frac=1.0).collect()), len(df.collect()))
+
+    with self.assertRaises(ValueError):
+      df.sample(frac=0.1, n=10)
+    with self.assertRaises(ValueError):
+      df.sample(frac=0.1, method="cluster")
+    # SQLite's random() cannot be seeded
+    with self.assertRaises(ValueError):
+      df.sample(frac=0.1, seed=42).generateQuery()
+
+  def test_sampleDialects(self):
+    from grizzly.generator import GrizzlyGenerator
+    GrizzlyGenerator._backend.queryGenerator = SQLGenerator("postgresql")
+    df = grizzly.read_table("events")
+
+    s = df.sample(frac=0.01, method="bernoulli", seed=42)
+    expected = "select * from events $t1 tablesample bernoulli (1.0) repeatable (42)"
+    self.matchSnipped(s.generateQuery(), expected)
+
+    # TABLESAMPLE works on base tables only
+    s = df[df.globaleventid > 3].sample(frac=0.5)
+    expected = "select * from (select * from (select * from events $t0) $t2 where $t2.globaleventid > 3) $t3 where random() < 0.5"
+    self.matchSnipped(s.generateQuery(), expected)
+
+    GrizzlyGenerator._backend.queryGenerator = SQLGenerator("monetdb")
+    s = df.sample(n=100, seed=7)
+    expected = "select * from (select * from events $t0) $t4 sample 100 seed 7"
+    self.matchSnipped(s.generateQuery(), expected)
+
+    # Oracle rejects SAMPLE(100), the whole input is not sampled
+    GrizzlyGenerator._backend.queryGenerator = SQLGenerator("oracle")
+    s = df.sample(frac=1.0)
+    expected = "select * from (select * from events $t0) $t5"
+    self.matchSnipped(s.generateQuery(), expected)
+
+  def test_sampleNoLimit(self):
+    from grizzly.config import Config
+    from grizzly.generator import GrizzlyGenerator
+    gen = GrizzlyGenerator._backend.queryGenerator
+    gen.templates = Config("sqlite", {k: v for (k, v) in gen.templates.config.items() if k != "limit"})
+
+    df = grizzly.read_table("events")
+    df.sample(frac=0.5).generateQuery()
+    with self.assertRaises(ValueError):
+      df.sample(n=10).generateQuery()
+
+  def test_approxCountDistinct(self):
+    df = grizzly.read_table("events")
+
+    # SQLite has no approximate aggregates -> HyperLogLog on the client
+    exact = len([r for r in df[["actor1name"]].distinct().collect() if r[0] is not None])
+    approx = df.approx_count_distinct("actor1name")
+    self.assertAlmostEqual(approx, exact, delta=max(exact * 0.03, 2))
+
+    # ... which is not possible in a query
+    g = df.groupby("actor1countrycode").approx_count_distinct("actor1name")
+    with self.assertRaises(ValueError):
+      g.generateQuery()
+
+  def test_approxQuantile(self):
+    df = grizzly.read_table("events")
+    values = sorted(r[0] for r in df[["globaleventid"]].collect())
+
+    median = df.approx_quantile("globaleventid", 0.5)
+    self.assertAlmostEqual(median, values[len(values) // 2], delta=(values[-1] - values[0]) * 0.01)
+    self.assertEqual(df.approx_quantile("globaleventid", 0.0), values[0])
+    self.assertEqual(df.approx_quantile("globaleventid", 1.0), values[-1])
+
+    with self.assertRaises(ValueError):
+      df.approx_quantile("globaleventid", 50)
+
+  def test_approxNative(self):
+    from grizzly.generator import GrizzlyGenerator
+    GrizzlyGenerator._backend.queryGenerator = SQLGenerator("oracle")
+
+    df = grizzly.read_table("events")
+    g = df.groupby("actor1countrycode")
+    g = g.approx_count_distinct("actor1name", "names")
+    g = g.approx_quantile("avgtone", 0.9, "p90")
+
+    expected = "select $t1.actor1countrycode, approx_count_distinct($t1.actor1name) as names, approx_percentile(0.9) within group (order by $t1.avgtone) as p90 from (select * from events $t0) $t1 group by $t1.actor1countrycode"
+    self.matchSnipped(g.generateQuery(), expected)
+
+  def test_udfCompileCache(self):
+    import tempfile
+    import grizzly.udfcompiler as udfcompiler
+    from grizzly.generator import GrizzlyGenerator
+
+    def mysqlfunc(a: int) -> int:
+      b = a + 1
+      return b * 2
+
+    compiled = []
+    realCompile = udfcompiler._compile
+    def countingCompile(*args):
+      compiled.append(args)
+      return realCompile(*args)
+
+    oldDir = udfcompiler.cacheDir
+    with tempfile.TemporaryDirectory() as tmp:
+      udfcompiler.cacheDir = tmp
+      udfcompiler._compile = countingCompile
+      udfcompiler.clearCache()
+      try:
+        gen = SQLGenerator("postgresql")
+        gen.inlineUDFs = False
+        GrizzlyGenerator._backend.queryGenerator = gen
+        df = grizzly.read_table("events")
+        df["x"] = df.globaleventid.map(mysqlfunc, lang="sql")
+
+        first = df.generateQuery()
+        self.assertEqual(df.generateQuery(), first)
+        self.assertEqual(len(compiled), 1)
+
+        # from the disk cache, e.g. in a new process
+        udfcompiler.clearCache()
+        self.assertEqual(df.generateQuery(), first)
+        self.assertEqual(len(compiled), 1)
+
+        # other dialect -> compiled again
+        gen = SQLGenerator("oracle")
+        gen.inlineUDFs = False
+        GrizzlyGenerator._backend.queryGenerator = gen
+        df.generateQuery()
+        self.assertEqual(len(compiled), 2)
+      finally:
+        udfcompiler._compile = realCompile
+        udfcompiler.cacheDir = oldDir
+        udfcompiler.clearCache()
+
+  def test_createFunctionOnce(self):
+    from grizzly.generator import GrizzlyGenerator
+    from grizzly.instrumentation import Action, QueryHook
+    from grizzly.sqlgenerator import DDLStatement
+
+    class PreQueries(QueryHook):
+      def __init__(self):
+        self.sql = []
+      def on_pre_query(self, action, sql, secs):
+        self.sql.append(sql)
+
+    executor = GrizzlyGenerator._backend
+    hook = executor.addHook(PreQueries())
+
+    # SQLite has no CREATE FUNCTION, use an idempotent statement instead
+    [f1] = DDLStatement.create("function grizzly_f", ["CREATE TEMP VIEW IF NOT EXISTS grizzly_f AS SELECT 1"])
+    [f2] = DDLStatement.create("function grizzly_f", ["CREATE TEMP VIEW IF NOT EXISTS grizzly_f AS SELECT 2"])
+    other = "SELECT 1"
+    action = Action("test", None)
+    try:
+      executor._runPreQueries([f1, other], action)
+      executor._runPreQueries([f1, other], action)
+      self.assertEqual(hook.sql, [f1, other, other])
+
+      # a changed definition replaces the function, so the old one must be created again
+      executor._runPreQueries([f2], action)
+      executor._runPreQueries([f1], action)
+      self.assertEqual(hook.sql, [f1, other, other, f2, f1])
+    finally:
+      executor.connection.execute("DROP VIEW IF EXISTS grizzly_f")
+
+  def test_createObjectsOnce(self):
+    from grizzly.generator import GrizzlyGenerator
+    from grizzly.instrumentation import Action, QueryHook
+    from grizzly.sqlgenerator import DDLStatement
+
+    # all statements of an external table belong to the same object
+    gen = SQLGenerator("postgresql")
+    (pre, _) = gen.generate(grizzly.read_external_files("filename.csv", ["a:int, b:str, c:float"], True, fileFormat="csv", fdw_extension_name="file_fdw"))
+    self.assertTrue(len(pre) > 1)
+    self.assertTrue(all(isinstance(pq, DDLStatement) for pq in pre))
+    self.assertEqual(len(set((pq.objName, pq.key) for pq in pre)), 1)
+
+    class PreQueries(QueryHook):
+      def __init__(self):
+        self.sql = []
+      def on_pre_query(self, action, sql, secs):
+        self.sql.append(sql)
+
+    executor = GrizzlyGenerator._backend
+    hook = executor.addHook(PreQueries())
+    action = Action("test", None)
+
+    table = DDLStatement.create("table grizzly_t", ["DROP TABLE IF EXISTS temp.grizzly_t", "CREATE TEMP TABLE grizzly_t (a int)"])
+    executor._runPreQueries(table, action)
+    executor._runPreQueries(table, action)
+    self.assertEqual(hook.sql, table)
+
+    # a new connection does not have the objects
+    executor.connection.close()
+    executor.connection = sqlite3.connect("grizzly.db")
+    executor._runPreQueries(table, action)
+    self.assertEqual(hook.sql, table + table)
+
   def test_DistinctAll(self):
     df = grizzly.read_table("events")
     df = df.distinct()
@@ -718,6 +1269,36 @@ class DataFrameTest(CodeMatcher):
     #print(tl)
 
     self.assertEqual(len(tl), 10)
+    self.assertEqual(tl, df.collect()[-10:])
+
+    # computed columns of the ordered DataFrame are part of the tail
+    df["next"] = df.globaleventid + 1
+    tl = df.tail(3)
+    self.assertEqual(tl, df.collect()[-3:])
+    self.assertTrue(all(r[-1] == r[0] + 1 for r in tl))
+
+  def test_topN(self):
+    df = grizzly.read_table("events")
+    df = df.sort_values(["actor1name", "globaleventid"], ascending=[True, False])
+
+    actual = df.limit(10).generateQuery()
+    expected = "select * from (select * from events $t0) $t2 order by $t2.actor1name asc,$t2.globaleventid desc limit 10"
+    self.matchSnipped(actual, expected)
+
+    actual = df[5:15].generateQuery()
+    expected = "select * from (select * from events $t0) $t3 order by $t3.actor1name asc,$t3.globaleventid desc limit 15 offset 5"
+    self.matchSnipped(actual, expected)
+
+    self.assertEqual(df.head(3), df.collect()[:3])
+
+  def test_topNVector(self):
+    from grizzly.generator import GrizzlyGenerator
+    GrizzlyGenerator._backend.queryGenerator = SQLGenerator("vector")
+    df = grizzly.read_table("events")
+    df = df.sort_values("globaleventid", ascending=False).limit(10)
+
+    expected = "select top 10 * from (select * from events $t0) $t2 order by $t2.globaleventid desc"
+    self.matchSnipped(df.generateQuery(), expected)
 
   def test_showPretty(self):
     df = grizzly.read_table("events") 
@@ -759,6 +1340,113 @@ class DataFrameTest(CodeMatcher):
 
   #   self.assertEqual(dfLen, rowsLen) 
 
+  def test_udfInline(self):
+    from grizzly.generator import GrizzlyGenerator
+    GrizzlyGenerator._backend.queryGenerator = SQLGenerator("postgresql")
+
+    def myinline(a: int) -> int:
+      b = a + 1
+      if b > 3:
+        return b * 2
+      elif b % 2 == 0:
+        b += 10
+      return b
+
+    df = grizzly.read_table("events")
+    df["x"] = df.globaleventid.map(myinline, lang="sql")
+
+    (pre, sql) = df.generate()
+    self.assertEqual(pre, [])
+    expected = "select *,case when (($t0.globaleventid) + 1) > 3 then ((($t0.globaleventid) + 1) * 2) when (((($t0.globaleventid) + 1) % 2 + 2) % 2) = 0 then ((($t0.globaleventid) + 1) + 10) else (($t0.globaleventid) + 1) end as x from events $t0"
+    self.matchSnipped(sql, expected)
+
+    def mysimple(a: int) -> int:
+      b = a + 1
+      return b * 2
+
+    df = grizzly.read_table("events")
+    df["x"] = df.globaleventid.map(mysimple, lang="sql")
+    self.matchSnipped(df.generateQuery(), "select *,((($t0.globaleventid) + 1) * 2) as x from events $t0")
+
+    # disabled: compiled to a function
+    GrizzlyGenerator._backend.queryGenerator.inlineUDFs = False
+    (pre, sql) = df.generate()
+    self.assertEqual(len(pre), 1)
+    self.assertTrue(pre[0].lower().startswith("create or replace function mysimple"))
+
+  def test_udfNotInlinable(self):
+    from grizzly.generator import GrizzlyGenerator
+    GrizzlyGenerator._backend.queryGenerator = SQLGenerator("postgresql")
+
+    def myloop(a: int) -> int:
+      s = 0
+      for i in range(a):
+        s = s + i
+      return s
+
+    def myprint(a: int) -> int:
+      print(a)
+      return a
+
+    for f in [myloop, myprint]:
+      df = grizzly.read_table("events")
+      df["x"] = df.globaleventid.map(f, lang="sql")
+      (pre, sql) = df.generate()
+      self.assertEqual(len(pre), 1)
+      self.assertTrue(pre[0].lower().startswith(f"create or replace function {f.__name__}"))
+      self.matchSnipped(sql, f"select *,{f.__name__}($t0.globaleventid) as x from events $t0")
+
+  def test_udfInlineManyBranches(self):
+    from grizzly.udfcompiler.inliner import inline
+    from grizzly.expression import Param
+    import time
+
+    # the statements after an if are part of both branches: 2^30 branches
+    lines = ["def steps(a: int) -> int:\n", "  r = a\n"] + [f"  if a > {i}:\n    r = r + {i}\n" for i in range(30)] + ["  return r\n"]
+    templates = SQLGenerator("postgresql").templates
+    start = time.perf_counter()
+    self.assertIsNone(inline(lines, templates, [Param("a", "int")], "int"))
+    self.assertLess(time.perf_counter() - start, 1)
+
+    self.assertIsNotNone(inline(lines[:6] + lines[-1:], templates, [Param("a", "int")], "int"))
+
+  def test_udfInlineSemantics(self):
+    from grizzly.generator import GrizzlyGenerator
+    executor = GrizzlyGenerator._backend
+    executor.connection.execute("CREATE TEMP TABLE inline_t(a INTEGER, s TEXT)")
+    values = [(-7, "x"), (-3, "y"), (0, "z"), (5, "w"), (8, "v")]
+    executor.connection.executemany("INSERT INTO inline_t VALUES (?, ?)", values)
+
+    # % has the sign of the right operand in Python, MOD the sign of the left one in SQL
+    def mymod(a: int) -> int:
+      return a % 3 + a % -4
+
+    # placeholders in string literals are not replaced
+    def mysuffix(s: str) -> str:
+      return s + '$$param0$$'
+
+    df = grizzly.read_table("inline_t")
+    df["m"] = df.a.map(mymod, lang="sql")
+    df["p"] = df.s.map(mysuffix, lang="sql")
+    self.assertEqual(executor.queryGenerator.generate(df)[0], [])
+
+    rows = df[["a", "s", "m", "p"]].collect()
+    self.assertEqual(rows, [[a, s, mymod(a), mysuffix(s)] for (a, s) in values])
+
+  def test_udfInlineExec(self):
+    def mylabel(s: str) -> str:
+      if len(s) > 5:
+        return "long"
+      return s + "!"
+
+    df = grizzly.read_table("events")
+    df = df[(df.globaleventid < 470000000) & (df.actor1name != None)]
+    df["x"] = df.actor1name.map(mylabel, lang="sql")
+    df = df[["actor1name", "x"]]
+
+    for (name, x) in df.collect():
+      self.assertEqual(x, mylabel(name))
+
   def test_udf(self):
     from grizzly.generator import GrizzlyGenerator
     oldGen = GrizzlyGenerator._backend.queryGenerator
@@ -782,13 +1470,306 @@ class DataFrameTest(CodeMatcher):
 
     actual = df.generateQuery()
 
-    expected = f"""create or replace function myfunc(a integer) returns text as $$ return a+"_grizzly" $$ language plpython3u;{sql}"""
+    expected = f"""create or replace function myfunc(a integer) returns text as $$ return a+"_grizzly" $$ language plpython3u immutable parallel safe;{sql}"""
 
     GrizzlyGenerator._backend.queryGenerator = oldGen
 
     self.matchSnipped(actual, expected, removeLinebreaks=True)
 
 
+  def test_udfAttributes(self):
+    from grizzly.generator import GrizzlyGenerator
+    import grizzly.udfcompiler as udfcompiler
+
+    def mypure(a: int) -> int:
+      s = 0
+      for i in range(a):
+        s = s + i
+      return s
+
+    def myprint(a: int) -> int:
+      print(a)
+      return a
+
+    def mypurepy(a: int) -> str:
+      import math
+      return str(math.sqrt(a)) + "x"
+
+    def myquery(a: int) -> int:
+      return plpy.execute("select 1")[0]["?column?"] + a
+
+    def createFunction(profile, f, lang):
+      gen = SQLGenerator(profile)
+      gen.inlineUDFs = False
+      GrizzlyGenerator._backend.queryGenerator = gen
+      df = grizzly.read_table("events")
+      df["x"] = df.globaleventid.map(f, lang=lang)
+      (pre, _) = df.generate()
+      return pre[0].replace("\n", " ").lower()
+
+    oldDir = udfcompiler.cacheDir
+    udfcompiler.cacheDir = None
+    try:
+      self.assertTrue(createFunction("postgresql", mypure, "sql").endswith("language plpgsql immutable parallel safe;"))
+      self.assertTrue(createFunction("postgresql", myprint, "sql").endswith("language plpgsql;"))
+      self.assertTrue(createFunction("postgresql", mypurepy, "py").endswith("language plpython3u immutable parallel safe;"))
+      self.assertTrue(createFunction("postgresql", myquery, "py").endswith("language plpython3u;"))
+
+      self.assertIn("return integer deterministic parallel_enable is pragma udf;", createFunction("oracle", mypure, "sql"))
+      self.assertNotIn("deterministic", createFunction("oracle", myprint, "sql"))
+    finally:
+      udfcompiler.cacheDir = oldDir
+
+  def test_udfBatched(self):
+    from grizzly.generator import GrizzlyGenerator
+    GrizzlyGenerator._backend.queryGenerator = SQLGenerator("postgresql")
+
+    def mybatched(a: int, b: str) -> str:
+      return b * a
+
+    df = grizzly.read_table("events", schema=Schema.build({"globaleventid": int, "actor1name": str}, complete=True))
+    df = df[df.globaleventid > 10]
+    df["x"] = df[["globaleventid", "actor1name"]].map(mybatched)
+
+    (pre, sql) = df.generate()
+    self.assertEqual(len(pre), 1)
+    self.matchSnipped(pre[0], """create or replace function mybatched_batch(_a integer[],_b text[]) returns text[] as $$
+      def _mybatched(a: int, b: str) -> str:
+        return b * a
+      return [ _mybatched(a,b) for (a,b) in zip(_a,_b) ]
+      $$ language plpython3u immutable parallel safe;""", removeLinebreaks=True)
+
+    expected = "with $t2 as (select *,row_number() over () as grizzly_rn,$t1.globaleventid as grizzly_p0_0,$t1.actor1name as grizzly_p0_1 from (select * from events $t0) $t1 where $t1.globaleventid > 10) " \
+      "select $t2.globaleventid,$t2.actor1name,$t4.x from $t2 join (select unnest($t3.grizzly_rn) as grizzly_rn,unnest(mybatched_batch($t3.grizzly_p0_0,$t3.grizzly_p0_1)) as x " \
+      "from (select array_agg(grizzly_rn) as grizzly_rn,array_agg(grizzly_p0_0) as grizzly_p0_0,array_agg(grizzly_p0_1) as grizzly_p0_1 from $t2 group by (grizzly_rn - 1) / 10000) $t3) $t4 on $t2.grizzly_rn = $t4.grizzly_rn"
+    self.matchSnipped(sql, expected)
+
+    # the join does not keep the order of a sorted input
+    df = grizzly.read_table("events")
+    df = df[["globaleventid", "actor1name"]].sort_values("globaleventid")
+    df = df[df.globaleventid > 10]
+    df["x"] = df[["globaleventid", "actor1name"]].map(mybatched)
+    sql = df.generate()[1]
+    self.assertTrue(sql.startswith("WITH"))
+    self.assertTrue(sql.endswith("ORDER BY " + sql.split()[1] + ".grizzly_rn"))
+
+    # unknown columns, only some columns known or disabled: a call per row
+    df = grizzly.read_table("events")
+    df["x"] = df[["globaleventid", "actor1name"]].map(mybatched)
+    self.matchSnipped(df.generate()[1], "select *,mybatched($t0.globaleventid,$t0.actor1name) as x from events $t0")
+
+    df = grizzly.read_table("events", schema={"globaleventid": int, "actor1name": str})
+    df["x"] = df[["globaleventid", "actor1name"]].map(mybatched)
+    self.matchSnipped(df.generate()[1], "select *,mybatched($t0.globaleventid,$t0.actor1name) as x from events $t0")
+
+    GrizzlyGenerator._backend.queryGenerator.batchUDFs = False
+    df = grizzly.read_table("events", schema={"globaleventid": int, "actor1name": str})
+    df["x"] = df[["globaleventid", "actor1name"]].map(mybatched)
+    self.matchSnipped(df.generate()[1], "select *,mybatched($t0.globaleventid,$t0.actor1name) as x from events $t0")
+
+  def test_udfBatchedVectorized(self):
+    from grizzly.generator import GrizzlyGenerator
+    GrizzlyGenerator._backend.queryGenerator = SQLGenerator("postgresql")
+
+    def vec_scale(a: float) -> float:
+      return a * 2.5
+
+    df = grizzly.read_table("events", schema=Schema.build({"globaleventid": int, "avgtone": float}, complete=True))
+    df["x"] = df.avgtone.map(vec_scale)
+
+    (pre, _) = df.generate()
+    self.matchSnipped(pre[0], """create or replace function vec_scale_batch(_a float8[]) returns float8[] as $$
+      def _vec_scale(a: float) -> float:
+        return a * 2.5
+      import numpy
+      return numpy.asarray(_vec_scale(numpy.asarray(_a))).tolist()
+      $$ language plpython3u immutable parallel safe;""", removeLinebreaks=True)
+
+  def test_fallbackQuery(self):
+    from grizzly.generator import GrizzlyGenerator
+
+    def myfallback(a: int, b: int) -> int:
+      return a + b
+
+    df = grizzly.read_table("events")
+    df = df[df.globaleventid > 10]
+    df["x"] = df[["globaleventid", "nummentions"]].map(myfallback, lang="sql", fallback=True)
+    df["y"] = df.globaleventid + 1
+
+    (pre, sql) = GrizzlyGenerator._backend.queryGenerator.generateFallbackInput(df, [df.computedCols[0]])
+    self.assertEqual(pre, [])
+    expected = "select *,null as x,$t1.globaleventid as grizzly_p0_0,$t1.nummentions as grizzly_p0_1,($t1.globaleventid + 1) as y from (select * from events $t0) $t1 where $t1.globaleventid > 10"
+    self.matchSnipped(sql, expected)
+
+  def test_fallbackPushdown(self):
+    from grizzly.generator import GrizzlyGenerator
+    from grizzly import fallback
+
+    def myfallback(a: int, b: int) -> int:
+      return a + b
+
+    df = grizzly.read_table("events")
+    df["x"] = df[["globaleventid", "nummentions"]].map(myfallback, lang="sql", fallback=True)
+    df = df[df.nummentions > 2][["globaleventid", "x"]]
+    df = df[df.x > 10].limit(5)
+
+    (node, calls) = fallback.findUDFs(df)
+    (top, needed, local) = fallback.split(df, node, calls)
+    self.assertIs(top, df.parents[0].parents[0])
+    self.assertEqual(needed, calls)
+    self.assertEqual([type(op).__name__ for op in local], ["Filter", "Limit"])
+
+    (pre, sql) = GrizzlyGenerator._backend.queryGenerator.generateFallbackInput(top, calls, needed)
+    expected = "select $t2.globaleventid,$t2.x,grizzly_p0_0,grizzly_p0_1 from (select * from (select *,null as x,$t0.globaleventid as grizzly_p0_0,$t0.nummentions as grizzly_p0_1 from events $t0) $t1 where $t1.nummentions > 2 ) $t2"
+    self.matchSnipped(sql, expected)
+
+    # the UDF result is projected away: everything is executed by the DBMS
+    df2 = node[["globaleventid"]].limit(5)
+    (top, needed, local) = fallback.split(df2, node, calls)
+    self.assertIs(top, df2)
+    self.assertEqual((needed, local), ([], []))
+
+  def test_fallbackElementwise(self):
+    from grizzly.fallback import isElementwise
+
+    def arithm(a: int, b: float) -> float:
+      c = a * 2 - b
+      return abs(c) / 3 + c ** 2
+
+    def division(a: int, b: int) -> float:
+      return a / b
+
+    def branch(a: int) -> int:
+      if a > 1:
+        return a
+      return 0
+
+    def strings(s: str) -> str:
+      return s + "x"
+
+    df = grizzly.read_table("events")
+    udfs = dict((f.__name__, df.globaleventid.map(f).udf) for f in [arithm, division, branch, strings])
+    self.assertTrue(isElementwise(udfs["arithm"]))
+    self.assertFalse(isElementwise(udfs["division"]))
+    self.assertFalse(isElementwise(udfs["branch"]))
+    self.assertFalse(isElementwise(udfs["strings"]))
+
+  def test_fallbackExec(self):
+    from grizzly.generator import GrizzlyGenerator
+    executor = GrizzlyGenerator._backend
+    executor.connection.execute("CREATE TEMP TABLE fallback_t(a INTEGER, b INTEGER, s TEXT)")
+    executor.connection.executemany("INSERT INTO fallback_t VALUES (?, ?, ?)", [(i, i * 2, "x" * i) for i in range(25)])
+    executor.fallbackChunkSize = 7
+
+    def myscale(a: int, b: int) -> int:
+      c = a * 3
+      return c + b // 2
+
+    def myupper(s: str) -> str:
+      r = ""
+      for ch in s:
+        r = r + ch.upper()
+      return r
+
+    df = grizzly.read_table("fallback_t")
+    df = df[df.a > 2]
+    df["x"] = df[["a", "b"]].map(myscale, lang="sql", fallback=True)
+    df["y"] = df.s.map(myupper, lang="sql", fallback=True)
+
+    p_df = df._fallback()
+    self.assertEqual(list(p_df.columns), ["a", "b", "s", "x", "y"])
+    self.assertEqual(len(p_df), 22)
+    self.assertEqual(list(p_df["x"]), [a * 4 for a in range(3, 25)])
+    self.assertEqual(list(p_df["y"]), ["X" * a for a in range(3, 25)])
+
+    self.assertEqual(len(df._fallback(limit=10)), 10)
+
+    # filters, projections and limits above the UDF
+    top = df[df.b < 40][["a", "x"]]
+    top = top[top.x > 20].sort_values("x", ascending=False).limit(3)
+    p_df = top._fallback()
+    self.assertEqual(list(p_df.columns), ["a", "x"])
+    self.assertEqual(list(p_df["a"]), [19, 18, 17])
+    self.assertEqual(list(p_df["x"]), [76, 72, 68])
+
+  def test_fallbackParallel(self):
+    from grizzly.generator import GrizzlyGenerator
+    from grizzly.expression import UDF
+    from grizzly import fallback
+    executor = GrizzlyGenerator._backend
+    executor.connection.execute("CREATE TEMP TABLE fallback_t(a INTEGER, s TEXT)")
+    executor.connection.executemany("INSERT INTO fallback_t VALUES (?, ?)", [(i, "x" * i) for i in range(25)])
+    executor.fallbackChunkSize = 4
+    executor.fallbackWorkers = 3
+
+    def mycount(s: str, a: int) -> int:
+      n = 0
+      for ch in s:
+        n = n + a
+      return n
+
+    # local functions cannot be pickled, the workers get the source code
+    df = grizzly.read_table("fallback_t")
+    df["n"] = df[["s", "a"]].map(mycount, lang="sql", fallback=True)
+    self.assertIsInstance(fallback._portable(df.computedCols[0].udf), tuple)
+    moduleLevel = UDF("isElementwise", [], [], "bool", func=fallback.isElementwise)
+    self.assertIs(fallback._portable(moduleLevel), fallback.isElementwise)
+
+    p_df = df._fallback()
+    self.assertEqual(list(p_df["a"]), list(range(25)))
+    self.assertEqual(list(p_df["n"]), [a * a for a in range(25)])
+    self.assertEqual(len(df._fallback(limit=6)), 6)
+
+    # uses a module and a closure variable: the source is not self-contained, evaluated in this process
+    factor = 3
+    def myscaled(s: str, a: int) -> int:
+      return len(re.sub("x", "yy", s)) + a * factor
+
+    df2 = grizzly.read_table("fallback_t")
+    df2["n"] = df2[["s", "a"]].map(myscaled, lang="sql", fallback=True)
+    self.assertIsNone(fallback._portable(df2.computedCols[0].udf))
+    self.assertEqual(list(df2._fallback()["n"]), [myscaled("x" * a, a) for a in range(25)])
+
+    # None means all CPUs, 0 is not
+    executor.fallbackWorkers = 0
+    with self.assertRaises(ValueError):
+      df._fallback()
+
+    # no UDF to apply locally
+    with self.assertRaises(ValueError):
+      grizzly.read_table("fallback_t")._fallback()
+
+  def test_udfPurity(self):
+    from grizzly.udfcompiler import purity
+    import inspect
+
+    def pure(a: int, b: str) -> str:
+      from math import floor
+      parts = [b] * floor(a / 2)
+      def twice(x):
+        return x + x
+      return "".join(twice(p) for p in parts).upper()
+
+    def usesGlobalDict(a: int) -> int:
+      GD["last"] = a
+      return a
+
+    def usesRandom(a: int) -> float:
+      import random
+      return random.random() * a
+
+    def usesHash(a: str) -> int:
+      return hash(a)
+
+    def modifiesModule(a: int) -> int:
+      import math
+      math.offset = a
+      return a
+
+    self.assertEqual(purity.ofPython(inspect.getsource(pure)), purity.IMMUTABLE)
+    for f in [usesGlobalDict, usesRandom, usesHash, modifiesModule]:
+      self.assertEqual(purity.ofPython(inspect.getsource(f)), purity.VOLATILE, f.__name__)
+
   # def test_udflambda(self):
   #   df = grizzly.read_table("events") 
   #   # df["newid"] = [df['globaleventid'] == 467268277]
@@ -1020,6 +2001,53 @@ class DataFrameTest(CodeMatcher):
     self.assertEqual(len(res[0]), 58)
     self.assertEqual(len(res[1]), 58)
 
+  def test_locLargeListValues(self):
+    from grizzly.generator import GrizzlyGenerator
+    gen = GrizzlyGenerator._backend.queryGenerator
+    ids = [467268277,477265011,477265011]
+
+    df = grizzly.read_table("events", index="globaleventid")
+    expected = sorted(df.loc[ids].collect())
+
+    gen.inList["threshold"] = 2
+    df = df.loc[ids]
+    actual = df.generateQuery()
+    self.matchSnipped(actual, "select * from (select * from events $t0) $t1 WHERE $t1.globaleventid IN (VALUES (467268277),(477265011),(477265011))")
+    self.assertEqual(sorted(df.collect()), expected)
+
+  def test_locLargeListTempTable(self):
+    from grizzly.generator import GrizzlyGenerator
+    gen = GrizzlyGenerator._backend.queryGenerator
+    ids = [467268277,477265011,470747760]
+
+    df = grizzly.read_table("events", index="globaleventid")
+    expected = sorted(df.loc[ids].collect())
+
+    gen.inList = {
+      "threshold": 2,
+      "strategy": "temp_table",
+      "expr": "$$column$$ IN (SELECT v FROM $$name$$)",
+      "create": ["DROP TABLE IF EXISTS $$name$$", "CREATE TEMP TABLE $$name$$ (v $$type$$)"],
+      "insert": "INSERT INTO $$name$$ VALUES $$values$$",
+      "chunk_size": 2,
+      "types": {"int": "INTEGER"}
+    }
+    df = df.loc[ids]
+    (pre, sql) = df.generate()
+    self.assertEqual(len(pre), 4) # drop, create and two inserts
+    self.assertIn("CREATE TEMP TABLE grizzly_in_", pre[1])
+    self.assertIn("IN (SELECT v FROM grizzly_in_", sql)
+    self.assertEqual(sorted(df.collect()), expected)
+
+  def test_locLargeListPostgres(self):
+    gen = SQLGenerator("postgresql")
+    df = grizzly.read_table("events", index="actor1name")
+    (pre, sql) = gen.generate(df.loc[[f"a'{i}" for i in range(1001)] + ['b"c']])
+
+    self.assertEqual(pre, [])
+    self.assertIn(""".actor1name = ANY('{"a''0","a''1",""", sql)
+    self.assertTrue(sql.strip().endswith("""b\\"c"}'::TEXT[])"""))
+
   def test_colAggmin(self):
     df = grizzly.read_table("events")
     minTone1 = df["avgtone"].min()
@@ -1125,6 +2153,7 @@ class DataFrameTest(CodeMatcher):
   def test_computedColML(self):
 
     from grizzly.generator import GrizzlyGenerator
+    from grizzly import modelcache
     oldGen = GrizzlyGenerator._backend.queryGenerator
 
     newGen = SQLGenerator("postgresql")
@@ -1145,31 +2174,207 @@ class DataFrameTest(CodeMatcher):
       # df.show(pretty = True)
 
       actual = df.generateQuery()
-      expected = """CREATE OR REPLACE FUNCTION apply(input text) RETURNS text AS $$ import onnxruntime
-import random
-def apply(input: str) -> str:
-      def input_to_tensor(input:str):
-      return input
+      expected = """CREATE OR REPLACE FUNCTION apply_""" + modelcache.key(onnx_path) + """(input text) RETURNS text AS $$ import onnxruntime
+""" + modelcache.source(4) + """
+def input_to_tensor(input:str):
+  return input
+
+def tensor_to_output(tensor) -> str:
+  return "positiv"
+
+def apply_model(input: str) -> str:
+  session = cachedModel(\"""" + modelcache.key(onnx_path) + """\", "/var/lib/postgresql/roberta-sequence-classification.onnx", lambda: onnxruntime.InferenceSession("/var/lib/postgresql/roberta-sequence-classification.onnx"))
+  inputs = input_to_tensor(input)
+  ret = session.run(None, inputs)
+  return(tensor_to_output(ret))
+return apply_model(input)
+$$ LANGUAGE plpython3u; SELECT sentiment, count($t0.review) FROM (SELECT *, apply_""" + modelcache.key(onnx_path) + """($t2.review) as sentiment FROM reviews_SIZE $t2) $t0 GROUP BY sentiment"""
+
+      self.matchSnipped(actual, expected)
+    finally:
+      GrizzlyGenerator._backend.queryGenerator = oldGen
 
 
-      def tensor_to_output(tensor) -> str:
+  def test_modelBatched(self):
+    from grizzly.generator import GrizzlyGenerator
+    import ast
+    oldGen = GrizzlyGenerator._backend.queryGenerator
+
+    def input_to_tensor(review: str):
+      return {"input": [[len(review)]]}
+
+    def tensor_to_output(tensor) -> str:
       return "positiv"
 
+    def body(ddl):
+      code = re.search(r"(?:AS \$\$|\{)(.*)(?:\$\$ LANGUAGE|\})", ddl, re.S).group(1)
+      # the function body must be valid Python
+      ast.parse("def f():\n" + "\n".join("  " + l for l in code.splitlines()))
+      return code
 
-  def apply_model(input):
-    if not hasattr(random, "onnx_session"):
-        random.onnx_session = onnxruntime.InferenceSession("/var/lib/postgresql/roberta-sequence-classification.onnx")
-    inputs = input_to_tensor(input)
-    ret = random.onnx_session.run(None, inputs)
-    return(tensor_to_output(ret))
-  return apply_model(input)
-return apply(input)
-$$ LANGUAGE plpython3u; SELECT sentiment, count($t0.review) FROM (SELECT *, apply($t2.review) as sentiment FROM reviews_SIZE $t2) $t0 GROUP BY sentiment"""
+    from grizzly import modelcache
+    name = "apply_" + modelcache.key("/models/sentiment.onnx")
 
-      self.matchSnipped(actual, expected)
+    try:
+      # PostgreSQL: arrays of batch_udfs.size rows, passed to the model in batches of batch_size
+      GrizzlyGenerator._backend.queryGenerator = SQLGenerator("postgresql")
+      df = grizzly.read_table("reviews", schema = Schema.build({"id": int, "review": str}, complete = True))
+      df["sentiment"] = df["review"].apply_onnx_model("/models/sentiment.onnx", input_to_tensor, tensor_to_output, batch_size = 16)
+      (pre, sql) = df.generate()
+
+      self.assertEqual(len(pre), 1)
+      self.assertTrue(pre[0].startswith(f"CREATE OR REPLACE FUNCTION {name}_batch(review TEXT[]) RETURNS TEXT[]"))
+      self.assertIn("for start in range(0, len(rows), 16):", body(pre[0]))
+      expected = "WITH $t1 AS (SELECT *,row_number() OVER () as grizzly_rn,$t0.review as grizzly_p0_0 FROM reviews $t0) " \
+        "SELECT $t1.id,$t1.review,$t3.sentiment FROM $t1 JOIN (SELECT unnest($t2.grizzly_rn) as grizzly_rn,unnest(" + name + "_batch($t2.grizzly_p0_0)) as sentiment " \
+        "FROM (SELECT array_agg(grizzly_rn) as grizzly_rn,array_agg(grizzly_p0_0) as grizzly_p0_0 FROM $t1 GROUP BY (grizzly_rn - 1) / 10000) $t2) $t3 ON $t1.grizzly_rn = $t3.grizzly_rn"
+      self.matchSnipped(sql, expected)
+
+      # MonetDB passes vectors, the model gets model_batch_size rows at once
+      GrizzlyGenerator._backend.queryGenerator = SQLGenerator("monetdb")
+      df = grizzly.read_table("reviews")
+      df["sentiment"] = df["review"].apply_onnx_model("/models/sentiment.onnx", input_to_tensor, tensor_to_output)
+      (pre, sql) = df.generate()
+
+      self.assertTrue(pre[0].startswith(f"CREATE OR REPLACE FUNCTION {name}(review string) RETURNS string LANGUAGE python"))
+      code = body(pre[0])
+      self.assertIn("for row in zip(review)", code)
+      self.assertIn("for start in range(0, len(rows), 64):", code)
+      self.matchSnipped(sql, f"SELECT *,{name}($t0.review) as sentiment FROM reviews $t0")
+
+      with self.assertRaises(ValueError):
+        df["review"].apply_onnx_model("/models/sentiment.onnx", input_to_tensor, tensor_to_output, batch_size = 0)
+    finally:
+      GrizzlyGenerator._backend.queryGenerator = oldGen
+
+  def test_modelBatchedFallback(self):
+    from grizzly.generator import GrizzlyGenerator
+    import numpy
+    import sys
+    import tempfile
+    import types
+    oldGen = GrizzlyGenerator._backend.queryGenerator
+
+    # a model exported with a fixed batch size of 1
+    class FixedSession:
+      def __init__(self, path):
+        pass
+      def run(self, names, inputs):
+        feed = inputs["input"]
+        if numpy.shape(feed)[0] != 1:
+          raise RuntimeError("invalid dimensions for input")
+        return [numpy.asarray(feed) * 2]
+
+    def input_to_tensor(review: str):
+      return {"input": numpy.array([[len(review)]])}
+
+    def flat_to_tensor(review: str):
+      return {"input": numpy.array([len(review)])}
+
+    def tensor_to_output(tensor) -> int:
+      return int(numpy.ravel(tensor[0])[0])
+
+    def run(converter, reviews):
+      df = grizzly.read_table("reviews")
+      df["n"] = df["review"].apply_onnx_model(path, converter, tensor_to_output)
+      (pre, _) = df.generate()
+      code = re.search(r"\{(.*)\}", pre[0], re.S).group(1)
+      env = {}
+      exec("def f(review):\n" + "\n".join("  " + l for l in code.splitlines()), env)
+      return env["f"](reviews)
+
+    fakeRuntime = types.ModuleType("onnxruntime")
+    fakeRuntime.InferenceSession = FixedSession
+    oldRuntime = sys.modules.get("onnxruntime")
+    sys.modules["onnxruntime"] = fakeRuntime
+    try:
+      GrizzlyGenerator._backend.queryGenerator = SQLGenerator("monetdb")
+      with tempfile.NamedTemporaryFile(suffix=".onnx") as model:
+        path = model.name
+        reviews = ["a", "bb", "ccc"]
+        # the batched run fails, the rows are run one by one
+        self.assertEqual(run(input_to_tensor, reviews), [2, 4, 6])
+        # 1-D inputs have no batch dimension, they are not concatenated
+        self.assertEqual(run(flat_to_tensor, reviews), [2, 4, 6])
+    finally:
+      GrizzlyGenerator._backend.queryGenerator = oldGen
+      if oldRuntime is None:
+        del sys.modules["onnxruntime"]
+      else:
+        sys.modules["onnxruntime"] = oldRuntime
+
+  def test_onnxTwoModels(self):
+    from grizzly.generator import GrizzlyGenerator
+    from grizzly import modelcache
+    oldGen = GrizzlyGenerator._backend.queryGenerator
+
+    def input_to_tensor(review: str):
+      return {"input": [[len(review)]]}
+
+    def tensor_to_output(tensor) -> str:
+      return "positiv"
+
+    try:
+      GrizzlyGenerator._backend.queryGenerator = SQLGenerator("postgresql")
+      df = grizzly.read_table("reviews")
+      df["sentiment"] = df["review"].apply_onnx_model("/models/sentiment.onnx", input_to_tensor, tensor_to_output)
+      df["language"] = df["review"].apply_onnx_model("/models/language.onnx", input_to_tensor, tensor_to_output)
+      (pre, sql) = df.generate()
+
+      # each model has its own function, the second one does not replace the first
+      names = ["apply_" + modelcache.key(p) for p in ["/models/sentiment.onnx", "/models/language.onnx"]]
+      self.assertNotEqual(names[0], names[1])
+      self.assertEqual(len(pre), 2)
+      for (name, ddl) in zip(names, pre):
+        self.assertTrue(ddl.startswith(f"CREATE OR REPLACE FUNCTION {name}(review TEXT)"))
+      self.matchSnipped(sql, f"SELECT *,{names[0]}($t0.review) as sentiment,{names[1]}($t0.review) as language FROM reviews $t0")
     finally:
       GrizzlyGenerator._backend.queryGenerator = oldGen
 
+  def test_modelCache(self):
+    from grizzly import modelcache
+    import os
+    import random
+    import tempfile
+
+    loads = []
+    def loader(name):
+      def load():
+        loads.append(name)
+        return name.upper()
+      return load
+
+    with tempfile.TemporaryDirectory() as d:
+      paths = [os.path.join(d, f"model{i}") for i in range(3)]
+      for p in paths:
+        open(p, "w").close()
+
+      namespace = {}
+      exec(modelcache.source(2), namespace)
+      cachedModel = namespace["cachedModel"]
+      if hasattr(random, "grizzly_models"):
+        del random.grizzly_models
+
+      self.assertEqual(cachedModel(modelcache.key(paths[0]), paths[0], loader("a")), "A")
+      self.assertEqual(cachedModel(modelcache.key(paths[1]), paths[1], loader("b")), "B")
+      self.assertEqual(cachedModel(modelcache.key(paths[0]), paths[0], loader("a")), "A")
+      self.assertEqual(loads, ["a", "b"])
+
+      # file changed
+      os.utime(paths[0], (0, 12345))
+      cachedModel(modelcache.key(paths[0]), paths[0], loader("a"))
+      self.assertEqual(loads, ["a", "b", "a"])
+
+      # at most 2 models, b was used least recently
+      cachedModel(modelcache.key(paths[2]), paths[2], loader("c"))
+      cachedModel(modelcache.key(paths[1]), paths[1], loader("b"))
+      self.assertEqual(loads, ["a", "b", "a", "c", "b"])
+      self.assertEqual(len(random.grizzly_models), 2)
+      del random.grizzly_models
+
+    self.assertNotEqual(modelcache.key(paths[0]), modelcache.key(paths[1]))
+    # embedded into SOURCE='...' for Vector
+    self.assertNotIn("'", modelcache.source())
 
   def test_LoadWithSchema(self):
     df = grizzly.read_table("t3", index="globaleventid", schema = {"globaleventid":int, "actor1name":str, "actor1countrycode":str,"actiongeo_long":float})
@@ -1209,6 +2414,7 @@ $$ LANGUAGE plpython3u; SELECT sentiment, count($t0.review) FROM (SELECT *, appl
     oldGen = GrizzlyGenerator._backend.queryGenerator
 
     newGen = SQLGenerator("postgresql")
+    newGen.batchUDFs = False
     GrizzlyGenerator._backend.queryGenerator = newGen
 
     df = grizzly.read_table("b", index="globaleventid", schema = {"globaleventid":int, "actor1name":str, "actor1countrycode":str,"actiongeo_long":float})
@@ -1224,7 +2430,7 @@ $$ LANGUAGE plpython3u; SELECT sentiment, count($t0.review) FROM (SELECT *, appl
     expected = """CREATE OR REPLACE FUNCTION myfunc(i text) RETURNS integer AS $$l = len(i)
     l = l + l
     return l
-    $$ LANGUAGE plpython3u;
+    $$ LANGUAGE plpython3u IMMUTABLE PARALLEL SAFE;
     SELECT min($t1.globaleventid) as min, max($t1.globaleventid) as max, avg($t1.globaleventid) as mean, count($t1.globaleventid) as count FROM (SELECT $t4.globaleventid, myfunc($t4.actor1name) as newcol FROM (SELECT * from b $t0) $t4) $t1 
     UNION ALL 
     SELECT min($t3.newcol) as min, max($t3.newcol) as max, avg($t3.newcol) as mean, count($t3.newcol) as count FROM (SELECT $t4.globaleventid, myfunc($t4.actor1name) as newcol FROM (SELECT * from b $t0) $t4) $t3"""
@@ -1,4 +1,5 @@
-from grizzly.expression import BoolExpr, ColRef, Constant, LogicExpr
+from grizzly.expression import BoolExpr, ColRef, Constant, LogicExpr, ExprInterner
+import copy
 import unittest
 import grizzly
 
@@ -40,7 +41,44 @@ class ExpressionTest(unittest.TestCase):
     self.assertEqual(innerAnd.right.left.column, "e")
     self.assertIsNone(innerAnd.right.right)
 
-    
+  def test_slots(self):
+    df = grizzly.read_table("t1")
+    expr = (df.a == 1) & (df.b > 2)
+
+    for e in [expr, expr.left, expr.left.left, expr.left.right]:
+      self.assertFalse(hasattr(e, "__dict__"))
+
+    # unset slots and special attributes must not be treated as DataFrame operations
+    with self.assertRaises(AttributeError):
+      ColRef.__new__(ColRef).column
+    self.assertEqual(copy.copy(df.a).column, "a")
+
+  def test_structuralHash(self):
+    df = grizzly.read_table("t1")
+    e1 = (df.a == 1) | (df.b < "x")
+    e2 = (df.a == 1) | (df.b < "x")
+    e3 = (df.a == 2) | (df.b < "x")
+
+    self.assertEqual(hash(e1), hash(e2))
+    self.assertNotEqual(hash(e1), hash(e3))
+
+  def test_intern(self):
+    df = grizzly.read_table("t1")
+    expr = (df.a == 1) | (df.a == 2) | (df.a == 1)
+
+    interner = ExprInterner()
+    res = interner.intern(expr)
+
+    # (a == 1 or a == 2) or a == 1
+    self.assertIs(res.left.left, res.right)
+    self.assertIs(res.left.left.left, res.left.right.left)
+    # a, 1, 2, a == 1, a == 2, OR, OR
+    self.assertEqual(len(interner), 7)
+
+    # same column of another DataFrame is not shared
+    other = grizzly.read_table("t2")
+    self.assertIsNot(interner.intern(other.a == 1), res.right)
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
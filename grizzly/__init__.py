@@ -15,7 +15,7 @@ def read_table(tableName, index=None, schema=None, inferSchema=False):
     schema = Schema(None)
   elif schema is None and inferSchema:
     schemaTypes = GrizzlyGenerator._backend.getSchemaForObject(tableName)
-    schema = Schema(schemaTypes)
+    schema = Schema(schemaTypes, complete=True)
   elif isinstance(schema, dict):
     schema = Schema.build(schema)
     # schema = Schema(schema)
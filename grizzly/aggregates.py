@@ -5,6 +5,8 @@ class AggregateType(Enum):
   MEAN = 3
   COUNT = 4
   SUM = 5
+  APPROX_COUNT_DISTINCT = 6
+  APPROX_QUANTILE = 7
 
   @staticmethod
   def getName(v):
@@ -18,5 +20,13 @@ class AggregateType(Enum):
       return "count"
     elif v == AggregateType.SUM:
       return "sum"
+    elif v == AggregateType.APPROX_COUNT_DISTINCT:
+      return "approx_count_distinct"
+    elif v == AggregateType.APPROX_QUANTILE:
+      return "approx_quantile"
     else:
-      raise ValueError(f"Unknown aggregate type: {v}")
\ No newline at end of file
+      raise ValueError(f"Unknown aggregate type: {v}")
+
+  @staticmethod
+  def isApproximate(v):
+    return v == AggregateType.APPROX_COUNT_DISTINCT or v == AggregateType.APPROX_QUANTILE
@@ -6,44 +6,76 @@ logger = logging.getLogger(__name__)
 
 class Config:
 
+  # parsed config files, keyed by (path, mtime) of the file.
+  # The parsed dicts are shared between all Config instances and must not be modified
+  _cache = {}
+
   @staticmethod
-  def loadProfile(profile):
-    logger.debug("loading configs for profile %s",profile)
-    if not profile:
-      return Config(profile, dict())
+  def clearCache():
+    Config._cache.clear()
 
+  @staticmethod
+  def _findConfigFile(confFileName):
     configDir = Path.home().joinpath(".config","grizzly")
     locations = [Path.cwd(), configDir]
 
-    confFileName = "grizzly.yml"
-
-    path = None
     for loc in locations:
       p = loc.joinpath(confFileName)
-      if p.exists():
-        path = p
-        logger.debug(f"found config file in: {str(path)}")
-        break
-
-    if not path: # as not found in expected locations
-      logger.debug(f"Cannot find config file {confFileName} in {[str(l) for l in locations]} - creating default in {str(configDir)}...")
-      # load packaged ressource
-      import pkg_resources 
-      my_data = pkg_resources.resource_string(__name__, "grizzly.yml").decode("utf-8") 
-      
-      filename = configDir.joinpath(confFileName)
-      os.makedirs(os.path.dirname(filename), exist_ok=True) # create config directory
-      with open(filename,'w') as target:
-        target.writelines(my_data) # copy 
-
-      logger.debug("done")
-      path = filename # use below
+      try:
+        mtime = p.stat().st_mtime_ns
+        logger.debug(f"found config file in: {str(p)}")
+        return (p, mtime)
+      except OSError:
+        pass
+
+    # as not found in expected locations
+    logger.debug(f"Cannot find config file {confFileName} in {[str(l) for l in locations]} - creating default in {str(configDir)}...")
+    # load packaged ressource
+    my_data = Config._readPackagedConfig(confFileName)
 
+    filename = configDir.joinpath(confFileName)
+    os.makedirs(os.path.dirname(filename), exist_ok=True) # create config directory
+    with open(filename,'w') as target:
+      target.writelines(my_data) # copy
+
+    logger.debug("done")
+    return (filename, filename.stat().st_mtime_ns)
+
+  @staticmethod
+  def _readPackagedConfig(confFileName):
+    try:
+      from importlib.resources import files
+      return files("grizzly").joinpath(confFileName).read_text(encoding="utf-8")
+    except ImportError: # Python < 3.9
+      from importlib.resources import read_text
+      return read_text("grizzly", confFileName, encoding="utf-8")
 
+  @staticmethod
+  def _parse(path):
     import yaml
-    configs = None
+    # the C implementation is much faster, but only available if PyYAML was built with libyaml
+    loader = getattr(yaml, "CFullLoader", yaml.FullLoader)
     with open(path,"r") as configFile:
-      configs = yaml.load(configFile, Loader=yaml.FullLoader)
+      return yaml.load(configFile, Loader=loader)
+
+  @staticmethod
+  def loadProfile(profile):
+    logger.debug("loading configs for profile %s",profile)
+    if not profile:
+      return Config(profile, dict())
+
+    confFileName = "grizzly.yml"
+
+    (path, mtime) = Config._findConfigFile(confFileName)
+
+    key = (str(path), mtime)
+    configs = Config._cache.get(key)
+    if configs is None:
+      configs = Config._parse(path)
+      # a changed file gets a new key, drop the outdated versions of it
+      for k in [k for k in Config._cache if k[0] == key[0]]:
+        del Config._cache[k]
+      Config._cache[key] = configs
 
     return Config(profile, configs[profile])
 
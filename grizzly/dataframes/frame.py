@@ -2,19 +2,37 @@ from grizzly.dataframes.schema import ColType, Schema, SchemaError
 from grizzly.aggregates import AggregateType
 import queue
 from typing import List, Tuple, Callable
-from grizzly.expression import AllColumns, ArithmExpr, ArithmeticOperation, BinaryExpression, BoolExpr, Constant, Expr, ColRef, FuncCall, ComputedCol, ExpressionException, ExprTraverser, LogicExpr, BooleanOperation, SetExpr, SetOperation
+from grizzly.expression import AllColumns, ArithmExpr, ArithmeticOperation, BinaryExpression, BoolExpr, Constant, Expr, ColRef, FuncCall, ComputedCol, ExpressionException, ExprTraverser, LogicExpr, LogicOperation, BooleanOperation, SetExpr, SetOperation
 from grizzly.generator import GrizzlyGenerator
-from grizzly.expression import ModelUDF,UDF, Param, ModelType
+from grizzly.expression import ModelUDF,UDF, Param, ModelType, WindowFunc
 from grizzly.udfcompiler.udfcompiler_exceptions import UDFCompilerException
+from grizzly import fallback, modelcache
 
 
 import inspect
+import os
+import sys
 
 from collections import namedtuple
 
 import logging
 logger = logging.getLogger(__name__)
 
+_grizzlyDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+
+def _userCodeLocation():
+  '''
+  (file, line) of the first stack frame outside of grizzly, i.e. the line of the 
+  user's program that created an operator
+  '''
+  frame = sys._getframe(1)
+  while frame is not None and os.path.abspath(frame.f_code.co_filename).startswith(_grizzlyDir):
+    frame = frame.f_back
+
+  if frame is None:
+    return None
+  return (frame.f_code.co_filename, frame.f_lineno)
+
 
 class GrizzlyIndexError(Exception):
   def __init__(self, *args: object) -> None:
@@ -44,6 +62,8 @@ class DataFrame(object):
       self.parents = [parents]
 
     self.alias = alias
+    # where in the user's program this operator was created, used e.g. for explain
+    self.origin = _userCodeLocation()
 
   @property
   def schema(self):
@@ -64,9 +84,11 @@ class DataFrame(object):
       if x.left: #and isinstance(x.left, Expr):
           x.left = self._updateRef(x.left) 
 
-      if x.right: # and isinstance(x.right, Expr):
+      # the right side of IN is a list of values, not of column names
+      if x.right and not (isinstance(x, SetExpr) and isinstance(x.right, list)):
           x.right = self._updateRef(x.right)
 
+      x._hash = None # children changed, invalidate cached hash
       return x
     elif isinstance(x, list) or isinstance(x, tuple):
       return [self._updateRef(y) for y in x]
@@ -94,8 +116,7 @@ class DataFrame(object):
   def distinct(self):
     return Projection(None, self, doDistinct = True)
 
-  def join(self, other, on, how="inner", comp = "="):
-
+  def _joinCondition(self, other, on):
     if isinstance(on, list):
       
       lOn = None
@@ -112,8 +133,30 @@ class DataFrame(object):
 
       on = [lOn, rOn]
 
+    return on
+
+  def join(self, other, on, how="inner", comp = "="):
+    on = self._joinCondition(other, on)
     return Join(self, other, on, how, comp)
 
+  def semi_join(self, other, on, comp = "=", method = "exists"):
+    '''
+    All rows of this DataFrame that have at least one match in other.
+    The result has only the columns of this DataFrame and contains every row
+    at most once. method is "exists" (EXISTS subquery) or "in" (IN subquery,
+    only for a join on two columns with "=")
+    '''
+    on = self._joinCondition(other, on)
+    return SemiJoin(self, other, on, comp, anti=False, method=method)
+
+  def anti_join(self, other, on, comp = "="):
+    '''
+    All rows of this DataFrame that have no match in other, generated as 
+    NOT EXISTS subquery
+    '''
+    on = self._joinCondition(other, on)
+    return SemiJoin(self, other, on, comp, anti=True, method="exists")
+
   def union(self, other, distinct = False, by = None):
     left = self
     right = other
@@ -138,9 +181,21 @@ class DataFrame(object):
     if isinstance(offset, int):
       offset = Constant(offset)
 
+    if isinstance(self, Ordering) and not self.computedCols:
+      # ORDER BY and LIMIT in one query block, so that the DBMS can do a top-N sort
+      return TopN(Constant(n), offset, self)
 
     return Limit(Constant(n), offset, self)
 
+  def sample(self, frac: float = None, n: int = None, method: str = "system", seed: int = None):
+    '''
+    A random sample of either the fraction frac or n rows. method is
+    "system" (sample blocks/pages, fast but clustered) or "bernoulli" (sample
+    rows). How the sample is generated depends on the dialect, see the sample
+    section in grizzly.yml
+    '''
+    return Sample(frac, n, method, seed, self)
+
   def sort_values(self, by, ascending=None):
     if not isinstance(by, list):
       by = [by]
@@ -149,6 +204,87 @@ class DataFrame(object):
       raise ValueError(f"List of columns and list of orders must be equal")
     return Ordering(by, ascending, self)
 
+  def paginate(self, order_by = None, page_size: int = 1000, ascending = True, after = None):
+    '''
+    Iterate over the result page by page (each page is a list of rows).
+    Instead of LIMIT/OFFSET, the next page is selected with a predicate on the
+    sort key of the last row of the previous page (keyset pagination), so the
+    DBMS does not have to skip all previous rows for every page.
+    The sort key (order_by) must be unique and must not contain NULLs. If the
+    DataFrame is the result of sort_values, its order is used by default.
+    after can be the key of the last row already read to resume paging
+    '''
+    if page_size < 1:
+      raise ValueError(f"page size must be at least 1, but got {page_size}")
+
+    base = self
+    if order_by is None:
+      if isinstance(self, Ordering):
+        base = self.parents[0]
+        order_by = [c.colName() for c in self.by]
+        ascending = True if self.ascending is None else self.ascending
+      elif self.index is not None:
+        order_by = self.index
+      else:
+        raise ValueError("paginate needs an order (order_by, sort_values or an index)")
+
+    return _Paginator(base, order_by, ascending, page_size, after)
+
+  ###################################
+  # window functions
+
+  def _window(self, funcName, col, partition_by, order_by, ascending, frame, alias):
+    if order_by is None and self.index is not None:
+      order_by = self.index
+
+    return Window(funcName, col, partition_by, order_by, ascending, frame, alias, self)
+
+  def _windowAlias(self, name, order_by):
+    '''
+    default name of a window function column, suffixed with the first order
+    column (e.g. rank_avgtone): rank and row_number are reserved words e.g. in MySQL
+    '''
+    if order_by is None:
+      order_by = self.index
+    first = order_by[0] if isinstance(order_by, list) and order_by else order_by
+    if isinstance(first, ColRef):
+      first = first.colName()
+    return f"{name}_{first}" if first else name
+
+  def row_number(self, partition_by = None, order_by = None, ascending = True, alias = None):
+    '''number the rows (starting at 1) in every partition in the given order (default alias: row_number_<first order column>)'''
+    if alias is None:
+      alias = self._windowAlias("row_number", order_by)
+    return self._window("row_number", None, partition_by, order_by, ascending, None, alias)
+
+  def rank(self, order_by, partition_by = None, ascending = True, method = "min", alias = None):
+    '''
+    rank of the rows in every partition. Like in Pandas, method determines
+    the rank of ties: "min" (RANK), "dense" (DENSE_RANK) or "first" (ROW_NUMBER).
+    The default alias is rank_<first order column>
+    '''
+    funcs = {"min": "rank", "dense": "dense_rank", "first": "row_number"}
+    if method not in funcs:
+      raise ValueError(f"unsupported rank method: {method}. Must be one of {list(funcs.keys())}")
+    if alias is None:
+      alias = self._windowAlias("rank", order_by)
+    return self._window(funcs[method], None, partition_by, order_by, ascending, None, alias)
+
+  def cumsum(self, col, order_by = None, partition_by = None, alias = None):
+    '''running sum of col in the given order (default: the index)'''
+    if alias is None:
+      alias = f"cumsum_{col}"
+    return self._window(AggregateType.SUM, col, partition_by, order_by, True, "unbounded", alias)
+
+  def rolling(self, window: int, order_by = None, partition_by = None):
+    '''
+    aggregates over a sliding window of the current and the window-1 preceding rows
+    e.g. df.rolling(3, order_by="day").mean("price")
+    '''
+    if window < 1:
+      raise ValueError(f"window size must be at least 1, but got {window}")
+    return _Rolling(self, window, order_by, partition_by)
+
   def map(self, func, lang='py', fallback=False):
     # XXX: if map is called on df it's a table UDF, if called on a projection it a scalar udf
     # df.map(myfunc) vs. df['a'].map(myfunc)
@@ -474,7 +610,7 @@ class DataFrame(object):
 
     # if we are a grouping  and the function is not applied on a grouping column
     # then add the aggregation to the list...
-    if isinstance(self, Grouping) and len([1 for fCol in f.inputCols for groupCol in self.groupCols if fCol.column == groupCol.column]) == 0:
+    if isinstance(self, Grouping) and len([1 for fCol in f.inputCols for groupCol in self.groupCols if isinstance(fCol, ColRef) and fCol.column == groupCol.column]) == 0:
       self._addAggFunc(f)
       return self
 
@@ -533,6 +669,27 @@ class DataFrame(object):
     # SUM only over numeric columns
     return self.__genTableAgg(col, AggregateType.SUM, lambda c: c[1] == ColType.NUMERIC or c[1] == ColType.UNKNOWN)
 
+  def approx_count_distinct(self, col, alias = "approx_count_distinct"):
+    '''
+    approximate number of distinct values in col. Uses the DBMS' function if
+    configured in the approx section of grizzly.yml, otherwise a HyperLogLog
+    sketch is computed on the client (not possible on groupings)
+    '''
+    theCol = DataFrame._getFuncCallCol(self, col)
+    f = FuncCall(AggregateType.APPROX_COUNT_DISTINCT, theCol, None, alias)
+    return self._exec_or_add_aggr(f)
+
+  def approx_quantile(self, col, q: float, alias = "approx_quantile"):
+    '''
+    approximate q-quantile (0 <= q <= 1) of col, e.g. q = 0.5 for the median.
+    Like approx_count_distinct, a t-digest is used if the DBMS has no function
+    '''
+    if not 0 <= q <= 1:
+      raise ValueError(f"quantile must be between 0 and 1, but got {q}")
+    theCol = DataFrame._getFuncCallCol(self, col)
+    f = FuncCall(AggregateType.APPROX_QUANTILE, theCol + [Constant(q)], None, alias)
+    return self._exec_or_add_aggr(f)
+
   def __genTableAgg(self, col, aggType, filterFunc):
     if not self.schema and col is None:
       raise SchemaError("must have a schema to compute aggregations over table")
@@ -583,50 +740,31 @@ class DataFrame(object):
     prequeries = "" if not pre else ";".join(pre)
     return f"{prequeries} {qry}"
 
+  def explain(self, analyze=False):
+    '''
+    Get the query plan the DBMS chooses for this DataFrame. With analyze=True
+    the query is executed and the plan contains the actual runtimes (if the 
+    DBMS supports it). Plan nodes are mapped back to the operators (tN) of this
+    DataFrame, see grizzly.explain.Plan
+    '''
+    return GrizzlyGenerator.explain(self, analyze)
+
   def show(self, pretty=False, delim=",", maxColWidth=20, limit=20):
     try:
       print(GrizzlyGenerator.toString(self,delim,pretty,maxColWidth,limit))
     except UDFCompilerException:
-      print(self._fallback())
-
-  def _fallback(self):
-    funccall_found = False
-    table = self
-
-    # Find first funccall and remove computedCols from DataFrame
-    while not funccall_found:
-      # TODO: handle multiple funccalls in Fallback
-      for x in table.computedCols:
-        if isinstance(x, FuncCall):
-          funccall = x
-          table.computedCols.remove(funccall)
-          funccall_found = True
-      # Get parent df if current df has no funccall objekt in computedCols 
-      table = table.parents[0]
-
-    if funccall.udf.fallback == False:
-      raise
-    else:
-      # Fallback to apply udf local with pandas
-      logger.info('Fallback to UDF execution with pandas')
-      # Get Parameters for UDF
-      inputcols = ", ".join(str(col.column).upper() for col in funccall.inputCols)
-
-      # Download Data into DataFrame (SQL statement without projection of UDF)
-      p_df = GrizzlyGenerator.to_df(table)
+      (node, _) = fallback.findUDFs(self)
+      if node is None:
+        raise
+      print(self._fallback(limit))
 
-      # Different handlings for single and multiple parameters
-      if len(funccall.inputCols) == 1:
-        p_df[funccall.alias] = p_df[inputcols].apply(funccall.udf.func)
-      else:
-        raise NotImplementedError('Fallback for UDFs with more than one parameter not supported yet')
-        #params = []
-        #for p in funccall.inputCols:
-        #  params.append(p_df[str(p.column).upper()])
-        #import numpy
-        #vfunc = numpy.vectorize(funccall.udf.func)
-        #p_df[funccall.alias] = vfunc(params)
-      return p_df
+  def _fallback(self, limit=None):
+    '''
+    Apply the UDFs that could not be compiled (fallback=True) locally, in
+    chunks of the result (see grizzly.fallback). Returns a pandas DataFrame
+    '''
+    logger.info('Fallback to local UDF execution')
+    return GrizzlyGenerator.fallback(self, limit)
 
   def first(self):
     tup = GrizzlyGenerator.fetchone(self)
@@ -646,15 +784,21 @@ class DataFrame(object):
     if not isinstance(self, Ordering):
       raise ValueError("can get tail only of ordered DataFrame")
 
-
-    # add a count 
-    cntFunc = FuncCall(AggregateType.COUNT, inputCols=[])
-    prj = self.project(cntFunc)
-
-    # add the offset: count - n
-    expr = ArithmExpr(prj, Constant(n), ArithmeticOperation.SUB)
-
-    return self.limit(n=n, offset=expr).collect()
+    # the first n rows in reversed order, reversed back locally
+    if isinstance(self.ascending, list):
+      ascending = [not a for a in self.ascending]
+    else:
+      # a single direction is generated for the last column only, the others are ascending
+      last = self.ascending is None or self.ascending
+      ascending = [False] * (len(self.by) - 1) + [not last]
+
+    reversedOrder = Ordering([c.colName() for c in self.by], ascending, self.parents[0])
+    # the computed columns reference this node by its alias
+    reversedOrder.computedCols = list(self.computedCols)
+    reversedOrder.alias = self.alias
+    rows = reversedOrder.limit(n).collect()
+    rows.reverse()
+    return rows
     
   # def __str__(self):
   #   strRep = GrizzlyGenerator.toString(self, pretty=True)
@@ -751,7 +895,11 @@ class Projection(DataFrame):
     self.doDistinct = True
     return self
 
-  def apply_torch_model(self, path: str, toTensorFunc, clazz, outputDict, clazzParameters: List, n_predictions: int = 1, *helperFuncs):
+  def apply_torch_model(self, path: str, toTensorFunc, clazz, outputDict, clazzParameters: List, n_predictions: int = 1, *helperFuncs, batch_size: int = None):
+    '''
+    batch_size: number of rows passed through the model at once if the DBMS calls
+    the function with arrays of rows (model_batch_size of the profile by default)
+    '''
 
     if len(outputDict) <= 0:
       raise ValueError("output dict must not be empty")
@@ -759,7 +907,7 @@ class Projection(DataFrame):
     # TODO maybe better to create a new UDF object and pass it to the code generator
     sqlGenerator = GrizzlyGenerator._backend.queryGenerator
 
-    modelPathHash = abs(hash(path))
+    modelPathHash = modelcache.key(path)
     funcName = f"grizzly_predict_{modelPathHash}"
     attrsString = "_".join([r.column for r in self.columns])
 
@@ -770,7 +918,7 @@ class Projection(DataFrame):
 
     toTensorInputType = sig.parameters[list(sig.parameters)[0]].annotation.__name__
     params = [Param("invalue", toTensorInputType), Param("n_predictions", "int")]
-    paramsStr = ",".join([f"{p.name} {sqlGenerator._mapTypes(p.type)}" for p in params])
+    paramsStr = ",".join([f"{p.name} {sqlGenerator._mapTypes(p.type, sqlGenerator.templates['types'])}" for p in params])
 
     # predictedType = type(outputDict[0]).__name__
     predictedType = "str"  # hard coded string because we collect n predictions in a list of strings
@@ -805,19 +953,28 @@ class Projection(DataFrame):
     template_replacement_dict["$$modelclassparameters$$"] = modelParameters
     template_replacement_dict["$$modelclassname$$"] = clazz.__name__
     template_replacement_dict["$$modelclassdef$$"] = clazzCode
+    template_replacement_dict["$$batchsize$$"] = _checkBatchSize(batch_size)
     udf = ModelUDF(funcName, params, predictedType, ModelType.TORCH, template_replacement_dict)
-    call = FuncCall(funcName, self.columns + [n_predictions] , udf, f"predicted_{attrsString}")
+    call = FuncCall(funcName, self.columns + [Constant(n_predictions)], udf, f"predicted_{attrsString}")
 
     # return self.project([call])
     return call
 
-  def apply_onnx_model(self, onnx_path, input_to_tensor, tensor_to_output):
-    funcName = "apply"
+  def apply_onnx_model(self, onnx_path, input_to_tensor, tensor_to_output, batch_size: int = None):
+    '''
+    batch_size: number of rows passed to the model at once if the DBMS calls
+    the function with arrays of rows (model_batch_size of the profile by default)
+    '''
+    # one function per model, a second model must not replace the function of the first one
+    funcName = f"apply_{modelcache.key(onnx_path)}"
     attrsString = "_".join([r.column for r in self.columns])
     in_sig = inspect.signature(input_to_tensor)
     input_names = list(in_sig.parameters.keys())
     input_names_str = ','.join(input_names)
+    # the converters are defined at the top level of the generated function
+    sqlGenerator = GrizzlyGenerator._backend.queryGenerator
     (lines1, _) = inspect.getsourcelines(input_to_tensor)
+    lines1 = sqlGenerator._unindent(lines1)
     params = []
     for param in in_sig.parameters:
       type = in_sig.parameters[param].annotation.__name__
@@ -827,6 +984,7 @@ class Projection(DataFrame):
 
     out_sig = inspect.signature(tensor_to_output)
     (lines2, _) = inspect.getsourcelines(tensor_to_output)
+    lines2 = sqlGenerator._unindent(lines2)
     returntype = out_sig.return_annotation.__name__
     if (returntype == "_empty"):
       raise ValueError("Output converter function must specify the return type")
@@ -838,8 +996,10 @@ class Projection(DataFrame):
     template_replacement_dict["$$tensor_to_output_func$$"] = "".join(lines2)
     template_replacement_dict["$$input_names$$"] = input_names_str
     template_replacement_dict["$$onnx_file_path$$"] = onnx_path
+    template_replacement_dict["$$modelpathhash$$"] = modelcache.key(onnx_path)
     template_replacement_dict["$$input_to_tensor_func_name$$"] = input_to_tensor.__name__
     template_replacement_dict["$$tensor_to_output_func_name$$"] = tensor_to_output.__name__
+    template_replacement_dict["$$batchsize$$"] = _checkBatchSize(batch_size)
 
     udf = ModelUDF(funcName, params, returntype, ModelType.ONNX, template_replacement_dict)
     call = FuncCall(funcName, self.columns, udf, f"predicted_{attrsString}")
@@ -857,6 +1017,7 @@ class Projection(DataFrame):
 
     template_replacement_dict = {}
     template_replacement_dict["$$tf_checkpoint_file$$"] = tf_checkpoint_file
+    template_replacement_dict["$$modelpathhash$$"] = modelcache.key(tf_checkpoint_file)
     template_replacement_dict["$$vocab_file$$"] = vocab_file
     template_replacement_dict["$$network_input_names$$"] = f"""[{', '.join('"%s"' % n for n in network_input_names)}]"""
     template_replacement_dict["$$constants$$"] = f"[{','.join(str(item) for item in constants)}]"
@@ -1017,6 +1178,73 @@ class Join(DataFrame):
   def rightParent(self):
     return self.right
 
+class SemiJoin(Join):
+  # semi and anti joins only filter the left input, so they are not Joins 
+  # regarding the schema, but share the handling of the right parent
+  def __init__(self, parent, other, on, comp, anti, method):
+    if method not in ("exists", "in"):
+      raise ValueError(f"unknown method for semi join: {method}, must be 'exists' or 'in'")
+    if method == "in" and (anti or not isinstance(on, list) or comp != "="):
+      raise ValueError("IN is only supported for semi joins on two columns with '='")
+    # the columns of both sides would have the same alias, the subquery would only see its own rows
+    if other.alias == parent.alias:
+      raise ValueError("cannot semi/anti join a DataFrame with itself, use a projection or filter of it as other")
+
+    self.right = other
+    self.on = on
+    self.how = "anti" if anti else "semi"
+    self.comp = comp
+    self.anti = anti
+    self.method = method
+
+    if isinstance(on, Expr):
+      parent.schema.merge(other.schema).check(on)
+
+    DataFrame.__init__(self, parent.schema, parent, GrizzlyGenerator._incrAndGetTupleVar())
+
+class Window(DataFrame):
+  def __init__(self, funcName, col, partitionBy, orderBy, ascending, frame, alias, parent: DataFrame):
+    tVar = GrizzlyGenerator._incrAndGetTupleVar()
+
+    def refs(cols):
+      if cols is None:
+        return []
+      if not isinstance(cols, list):
+        cols = [cols]
+      result = []
+      for c in cols:
+        if isinstance(c, str):
+          c = ColRef(c, self)
+        elif isinstance(c, ColRef):
+          c = ColRef(c.colName(), self)
+        else:
+          raise ExpressionException(f"expected a column name or column reference, but got {c}")
+        parent.schema.check(c)
+        result.append(c)
+      return result
+
+    inputCols = refs(col)
+    partitionBy = refs(partitionBy)
+    orderBy = refs(orderBy)
+
+    if not orderBy and (frame is not None or funcName in ("row_number", "rank", "dense_rank")):
+      raise ValueError(f"window function for {alias} requires an order (order_by or an index)")
+    if isinstance(ascending, list) and len(ascending) != len(orderBy):
+      raise ValueError(f"List of columns and list of orders must be equal")
+
+    self.func = WindowFunc(funcName, inputCols, partitionBy, orderBy, ascending, frame, alias)
+
+    if parent.schema.typeDict is None:
+      newSchema = Schema(None)
+    else:
+      newSchema = Schema(parent.schema.typeDict.copy())
+      colType = ColType.NUMERIC
+      if funcName in (AggregateType.MIN, AggregateType.MAX):
+        colType = parent.schema[inputCols[0].colName()]
+      newSchema.typeDict[alias] = colType
+
+    super().__init__(newSchema, parent, tVar, parent.index)
+
 class Union(DataFrame):
   def __init__(self, parent, other, distinct):
     # TODO check schemas match!
@@ -1038,6 +1266,33 @@ class Limit(DataFrame):
     self.offset = offset
     super().__init__(parent.schema, parent, GrizzlyGenerator._incrAndGetTupleVar())
 
+class Sample(DataFrame):
+  def __init__(self, frac, n, method, seed, parent):
+    if (frac is None) == (n is None):
+      raise ValueError("exactly one of frac and n must be given for sample")
+    if frac is not None and not 0 <= frac <= 1:
+      raise ValueError(f"sample fraction must be between 0 and 1, but got {frac}")
+    if n is not None and n < 0:
+      raise ValueError(f"sample size must not be negative (got {n})")
+    if method not in ("system", "bernoulli"):
+      raise ValueError(f"unsupported sample method: {method}. Must be one of ['system', 'bernoulli']")
+
+    self.frac = frac
+    self.n = n
+    self.method = method
+    self.seed = seed
+    super().__init__(parent.schema, parent, GrizzlyGenerator._incrAndGetTupleVar(), parent.index)
+
+class TopN(Limit):
+  '''
+  A Limit on top of an Ordering, generated as a single ORDER BY ... LIMIT
+  query block. The ordering node is skipped, TopN sorts its parent
+  '''
+  def __init__(self, limit, offset, ordering):
+    super().__init__(limit, offset, ordering.parents[0])
+    self.by = [ColRef(c.colName(), self) for c in ordering.by]
+    self.ascending = ordering.ascending
+
 class Ordering(DataFrame):
   def __init__(self, by:list, ascending, parent):
     super().__init__(parent.schema, parent, GrizzlyGenerator._incrAndGetTupleVar())
@@ -1062,6 +1317,11 @@ class Ordering(DataFrame):
 #########################
 # helpers
 
+def _checkBatchSize(batchSize):
+  if batchSize is not None and (not isinstance(batchSize, int) or batchSize < 1):
+    raise ValueError(f"batch size must be a positive integer, but got {batchSize}")
+  return batchSize
+
 class _IndexAccessor:
   def __init__(self, df):
     self.df = df
@@ -1082,6 +1342,104 @@ class _IndexAccessor:
     else:
       raise ValueError(f"invalid argument to at. Expected column name or tuple, but got {type(at)}")
 
+class _Rolling:
+  def __init__(self, df, window, orderBy, partitionBy):
+    self.df = df
+    self.window = window
+    self.orderBy = orderBy
+    self.partitionBy = partitionBy
+
+  def _agg(self, aggType, col, alias):
+    if alias is None:
+      alias = f"rolling_{AggregateType.getName(aggType)}_{col}"
+    return self.df._window(aggType, col, self.partitionBy, self.orderBy, True, self.window - 1, alias)
+
+  def sum(self, col, alias = None):
+    return self._agg(AggregateType.SUM, col, alias)
+
+  def mean(self, col, alias = None):
+    return self._agg(AggregateType.MEAN, col, alias)
+
+  def min(self, col, alias = None):
+    return self._agg(AggregateType.MIN, col, alias)
+
+  def max(self, col, alias = None):
+    return self._agg(AggregateType.MAX, col, alias)
+
+  def count(self, col, alias = None):
+    return self._agg(AggregateType.COUNT, col, alias)
+
+class _Paginator:
+  def __init__(self, df, orderBy, ascending, pageSize, after):
+    if not isinstance(orderBy, list):
+      orderBy = [orderBy]
+    self.keyCols = [c.colName() if isinstance(c, ColRef) else c for c in orderBy]
+
+    if isinstance(ascending, list):
+      if len(ascending) != len(self.keyCols):
+        raise ValueError(f"List of columns and list of orders must be equal")
+      self.ascending = ascending
+    else:
+      self.ascending = [ascending] * len(self.keyCols)
+
+    if after is not None and not isinstance(after, (list, tuple)):
+      after = [after]
+    if after is not None and len(after) != len(self.keyCols):
+      raise ValueError(f"key of the last row must have {len(self.keyCols)} values, but got {len(after)}")
+
+    self.df = df
+    self.pageSize = pageSize
+    # sort key of the last row returned so far, None before the first page
+    self.lastKey = after
+    self.done = False
+
+  def _seek(self, df):
+    '''
+    predicate selecting the rows after lastKey in the sort order:
+    k1 > v1 OR (k1 = v1 AND k2 > v2) OR ...
+    This is the expanded form of (k1, k2) > (v1, v2), which not all
+    DBMS support and which only works if all columns have the same direction
+    '''
+    expr = None
+    for i in reversed(range(len(self.keyCols))):
+      op = BooleanOperation.GT if self.ascending[i] else BooleanOperation.LT
+      term = BoolExpr(ColRef(self.keyCols[i], df), Constant(self.lastKey[i]), op)
+      if expr is not None:
+        eq = BoolExpr(ColRef(self.keyCols[i], df), Constant(self.lastKey[i]), BooleanOperation.EQ)
+        term = LogicExpr(term, LogicExpr(eq, expr, LogicOperation.AND), LogicOperation.OR)
+      expr = term
+    return expr
+
+  def query(self) -> DataFrame:
+    '''the DataFrame for the next page'''
+    df = self.df
+    if self.lastKey is not None:
+      df = df.filter(self._seek(df))
+    return df.sort_values(self.keyCols, self.ascending).limit(self.pageSize)
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    if self.done:
+      raise StopIteration()
+
+    # the values as returned by the driver: the key of the last row must keep its type (e.g. Decimal, date)
+    rows = [list(r) for r in GrizzlyGenerator.iterator(self.query(), includeHeader=True)]
+    header = rows[0]
+    rows = rows[1:]
+
+    if len(rows) < self.pageSize:
+      self.done = True
+    if not rows:
+      raise StopIteration()
+
+    # e.g. Oracle returns upper case column names
+    names = [h.lower() for h in header]
+    positions = [names.index(c.lower()) for c in self.keyCols]
+    self.lastKey = [rows[-1][p] for p in positions]
+    return rows
+
 class _IndexLocator:
   def __init__(self, df):
     self.df = df
@@ -42,18 +42,20 @@ class Schema(object):
   
   cnt = 0
 
-  def __init__(self, typeDict):
+  def __init__(self, typeDict, complete: bool = False):
     super().__init__()
 
     self.typeDict = typeDict
+    # typeDict lists all columns (e.g. read from the database), not only the ones the user specified
+    self.complete = complete
 
   @staticmethod
-  def build(typeDict: dict):
+  def build(typeDict: dict, complete: bool = False):
     newSchema = {}
     for (name,pyType) in typeDict.items():
       newSchema[name] = ColType.fromPython(pyType)
 
-    return Schema(newSchema)
+    return Schema(newSchema, complete)
 
   @staticmethod
   def fromList(schemaList):
@@ -208,6 +210,8 @@ class Schema(object):
     And returns the resulting schema
     '''
     newSchemaDict = {}
+    # all columns are listed explicitly or come from complete schemas
+    complete = all(col.df.schema.complete for col in refs if isinstance(col, AllColumns))
 
     # no schema has been set until now
     # add columns with "unknown" type
@@ -236,7 +240,7 @@ class Schema(object):
             t = Schema._inferType(col, self)
             newSchemaDict[name] = t
 
-    return Schema(newSchemaDict)
+    return Schema(newSchemaDict, complete)
         
   def append(self,value): 
     '''
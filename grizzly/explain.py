@@ -0,0 +1,219 @@
+import json
+import re
+from typing import Dict, List
+
+# tuple variables produced by GrizzlyGenerator._incrAndGetTupleVar
+ALIAS_PATTERN = re.compile(r"\bt[0-9]+\b")
+
+class PlanNode(object):
+  """
+  A node of a query plan returned by the DBMS.
+
+  operation is the kind of the node (e.g. "Seq Scan", "SCAN", "Filter"),
+  detail contains the rest of the description. properties holds all values
+  reported by the DBMS for this node (only for structured formats, e.g. costs
+  and actual times for PostgreSQL).
+  aliases and operators refer to the grizzly operators (tN) this node
+  belongs to.
+  """
+
+  def __init__(self, operation: str, detail: str = "", properties: Dict = None):
+    self.operation = operation
+    self.detail = detail
+    self.properties = properties if properties is not None else {}
+    self.children: List[PlanNode] = []
+    self.aliases: List[str] = []
+    self.operators = []
+
+  def walk(self):
+    yield self
+    for c in self.children:
+      yield from c.walk()
+
+  def _text(self):
+    if self.properties:
+      return json.dumps(self.properties, default=str)
+    return f"{self.operation} {self.detail}"
+
+  def _render(self, lines, depth):
+    desc = self.operation
+    if self.detail:
+      desc += f" {self.detail}"
+
+    refs = []
+    for op in self.operators:
+      ref = f"{op.alias}: {type(op).__name__}"
+      origin = getattr(op, "origin", None)
+      if origin:
+        ref += f" at {origin[0]}:{origin[1]}"
+      refs.append(ref)
+
+    if refs:
+      desc += "  [" + "; ".join(refs) + "]"
+
+    lines.append("  " * depth + "-> " + desc)
+    for c in self.children:
+      c._render(lines, depth + 1)
+
+  def __str__(self):
+    return f"{self.operation} {self.detail}".strip()
+
+class Plan(object):
+  """
+  The structured result of DataFrame.explain()
+  """
+
+  def __init__(self, root: PlanNode, sql: str, df = None, analyze: bool = False, properties: Dict = None):
+    self.root = root
+    self.sql = sql
+    self.analyze = analyze
+    self.properties = properties if properties is not None else {}
+    self.operators = Plan._collectOperators(df) if df is not None else {}
+
+    for node in self.nodes():
+      found = []
+      for a in ALIAS_PATTERN.findall(node._text()):
+        if a in self.operators and a not in found:
+          found.append(a)
+      node.aliases = found
+      node.operators = [self.operators[a] for a in found]
+
+  @staticmethod
+  def _collectOperators(df) -> Dict:
+    from grizzly.dataframes.frame import Join, Union
+    ops = {}
+    todo = [df]
+    while todo:
+      current = todo.pop()
+      if current.alias:
+        ops[current.alias] = current
+
+      if current.parents:
+        todo += current.parents
+      if isinstance(current, Join) or isinstance(current, Union):
+        todo.append(current.rightParent())
+
+    return ops
+
+  def nodes(self):
+    return list(self.root.walk())
+
+  def nodesFor(self, alias: str) -> List[PlanNode]:
+    '''all plan nodes that belong to the grizzly operator with the given alias'''
+    return [n for n in self.nodes() if alias in n.aliases]
+
+  def find(self, operation: str) -> List[PlanNode]:
+    '''all plan nodes whose operation contains the given string (case insensitive)'''
+    operation = operation.lower()
+    return [n for n in self.nodes() if operation in n.operation.lower()]
+
+  def __str__(self):
+    lines = []
+    self.root._render(lines, 0)
+    for (k, v) in self.properties.items():
+      lines.append(f"{k}: {v}")
+    return "\n".join(lines)
+
+  @staticmethod
+  def fromRows(fmt: str, rows, sql: str, df = None, analyze: bool = False):
+    '''
+    Build a plan from the rows returned by the EXPLAIN statement. fmt is the
+    explain format configured in the profile: postgresql_json, sqlite or text
+    '''
+    if fmt == "postgresql_json":
+      (root, props) = _parsePostgresJSON(rows)
+    elif fmt == "sqlite":
+      (root, props) = (_parseSQLite(rows), {})
+    elif fmt == "text":
+      (root, props) = (_parseText(rows), {})
+    else:
+      raise ValueError(f"Unknown explain format: {fmt}")
+
+    return Plan(root, sql, df, analyze, props)
+
+###########################################################################
+# parsers for the different EXPLAIN outputs
+
+_PG_DETAIL_KEYS = ["Relation Name", "Alias", "Join Type", "Index Name", "Index Cond", "Hash Cond", "Merge Cond", "Join Filter", "Filter", "Sort Key", "Group Key"]
+
+def _parsePostgresJSON(rows):
+  value = rows[0][0]
+  if isinstance(value, str):
+    value = json.loads(value)
+  if isinstance(value, list):
+    value = value[0]
+
+  def build(p):
+    props = {k: v for (k, v) in p.items() if k != "Plans"}
+    detail = ", ".join(f"{k}: {p[k]}" for k in _PG_DETAIL_KEYS if k in p)
+    node = PlanNode(p["Node Type"], detail, props)
+    for child in p.get("Plans", []):
+      node.children.append(build(child))
+    return node
+
+  root = build(value["Plan"])
+  props = {k: v for (k, v) in value.items() if k != "Plan"}
+  return (root, props)
+
+def _sqliteOperation(detail: str):
+  words = detail.split()
+  op = []
+  for w in words:
+    if not w.isupper():
+      break
+    op.append(w)
+  if not op:
+    op = words[:1]
+  return (" ".join(op), detail[len(" ".join(op)):].strip())
+
+def _parseSQLite(rows):
+  # rows are (id, parent, notused, detail)
+  root = PlanNode("QUERY PLAN")
+  nodes = {0: root}
+  for (nodeId, parentId, _, detail) in rows:
+    (op, rest) = _sqliteOperation(detail)
+    node = PlanNode(op, rest)
+    nodes[nodeId] = node
+    nodes.get(parentId, root).children.append(node)
+
+  if len(root.children) == 1:
+    return root.children[0]
+  return root
+
+def _parseText(rows):
+  '''
+  Indentation based plans, e.g. MySQL's FORMAT=TREE or MonetDB's PLAN
+  '''
+  lines = []
+  for row in rows:
+    for col in row:
+      if col is not None:
+        lines += str(col).split("\n")
+
+  root = PlanNode("QUERY PLAN")
+  stack = [(-1, root)]
+  for line in lines:
+    if not line.strip():
+      continue
+
+    stripped = line.lstrip(" |")
+    indent = len(line) - len(stripped)
+    text = stripped
+    if text.startswith("->"):
+      text = text[2:].strip()
+
+    m = re.match(r"^([^:(\[]*)(.*)$", text)
+    op = m.group(1).strip()
+    if op:
+      node = PlanNode(op, m.group(2).lstrip(": ").strip())
+    else:
+      node = PlanNode(text)
+
+    while stack[-1][0] >= indent:
+      stack.pop()
+    stack[-1][1].children.append(node)
+    stack.append((indent, node))
+
+  if len(root.children) == 1:
+    return root.children[0]
+  return root
@@ -36,7 +36,37 @@ class ExpressionException(Exception):
   def __init__(self, *args: object):
       super().__init__(*args)
 
+def _hashOf(x) -> int:
+  '''structural hash of an expression operand (expression, list of values, DataFrame, ...)'''
+  if isinstance(x, Expr):
+    return hash(x)
+  elif isinstance(x, list) or isinstance(x, tuple):
+    return hash(tuple(_hashOf(i) for i in x))
+
+  try:
+    return hash(x)
+  except TypeError:
+    return id(x)
+
 class Expr(object):
+  # Expressions are created in large numbers (e.g. for generated predicates),
+  # so all subclasses use __slots__ instead of an instance __dict__.
+  # _hash caches the structural hash, see __hash__
+  __slots__ = ("_hash",)
+
+  def __init__(self):
+    self._hash = None
+
+  def _computeHash(self) -> int:
+    return object.__hash__(self)
+
+  def __hash__(self) -> int:
+    # == is overloaded to create a BoolExpr, so Python would make expressions
+    # unhashable. The structural hash is cached, a node that is modified
+    # afterwards (e.g. by DataFrame._updateRef) must reset _hash to None
+    if self._hash is None:
+      self._hash = self._computeHash()
+    return self._hash
 
   @staticmethod
   def _checkRight(other):
@@ -136,34 +166,49 @@ class Expr(object):
     return expr
 
 class BinaryExpression(Expr):
+  __slots__ = ("left", "right", "operand")
+
   def __init__(self, left: Expr, right: Expr, operand):
     self.left = left
     self.right = right
     self.operand = operand
     super().__init__()  
 
-  def __hash__(self) -> int:
-      return hash((self.left, self.right, self.operand))
+  def _computeHash(self) -> int:
+    return hash((type(self), self.operand, _hashOf(self.left), _hashOf(self.right)))
 
 class Constant(Expr):
+  __slots__ = ("value", "alias")
+
   def __init__(self, value, alias: str = None):
     self.value = value
     self.alias = alias
     super().__init__()
 
+  def _computeHash(self) -> int:
+    return hash((Constant, _hashOf(self.value)))
+
 class ArithmExpr(BinaryExpression):
+  __slots__ = ()
+
   def __init__(self, left: Expr, right: Expr, operand: ArithmeticOperation):
     super().__init__(left, right, operand)
 
 class BoolExpr(BinaryExpression):
+  __slots__ = ()
+
   def __init__(self, left: Expr, right: Expr, operand: BinaryExpression):
     super().__init__(left, right, operand)
 
 class LogicExpr(BinaryExpression):
+  __slots__ = ()
+
   def __init__(self, left: Expr, right: Expr, operand: LogicOperation):
     super().__init__(left, right, operand)
 
 class SetExpr(BoolExpr):
+  __slots__ = ()
+
   def __init__(self, left: Expr, right: Expr, operand: SetOperation):
       super().__init__(left, right, operand)
 
@@ -176,6 +221,8 @@ class Param:
   #   return f"{self.name}:{self.type}"
 
 class ComputedCol(object):
+  __slots__ = ("value", "alias")
+
   def __init__(self, value, alias = None):
     self.value = value
     self.alias = alias
@@ -203,6 +250,8 @@ class ModelUDF(UDF):
     self.templace_replacement_dict = template_replacement_dict
 
 class FuncCall(Expr):
+  __slots__ = ("funcName", "inputCols", "udf", "alias")
+
   def __init__(self, funcName, inputCols: List, udf: UDF = None, alias: str = ""):
     self.funcName = funcName
     self.inputCols = inputCols
@@ -211,6 +260,10 @@ class FuncCall(Expr):
 
     super().__init__()
 
+  def __hash__(self) -> int:
+    # not cached: the input columns are updated in place when the call is added to a DataFrame
+    return hash((FuncCall, _hashOf(self.funcName), _hashOf(self.inputCols), id(self.udf)))
+
   # def __str__(self):
   #   cols = [f"{self.df.alias}.{c.column}" for c in self.inputCols]
   #   colsStr = ", ".join(cols)
@@ -221,7 +274,29 @@ class FuncCall(Expr):
     
   #   return s
 
+class WindowFunc(Expr):
+  """
+  A function evaluated over a window of rows: funcName(inputCols) OVER
+  (PARTITION BY partitionBy ORDER BY orderBy [frame]).
+  frame is None (DBMS default), "unbounded" (all rows up to the current one)
+  or the number of preceding rows to include
+  """
+  __slots__ = ("funcName", "inputCols", "partitionBy", "orderBy", "ascending", "frame", "alias")
+
+  def __init__(self, funcName, inputCols: List, partitionBy: List, orderBy: List, ascending = True, frame = None, alias: str = ""):
+    self.funcName = funcName
+    self.inputCols = inputCols
+    self.partitionBy = partitionBy
+    self.orderBy = orderBy
+    self.ascending = ascending
+    self.frame = frame
+    self.alias = alias
+
+    super().__init__()
+
 class ColRef(Expr):
+  __slots__ = ("column", "alias", "df")
+
   def __init__(self, column: str, df, alias: str = ""):
     if not isinstance(column, str):
       raise ValueError(f"Invalid value for column: {column}")
@@ -238,6 +313,11 @@ class ColRef(Expr):
   def colName(self):
     return self.column
 
+  def _computeHash(self) -> int:
+    # the DataFrame is not part of the hash as it is changed when the 
+    # reference is passed to an operator
+    return hash((ColRef, self.column))
+
   def min(self):
     return self.df.min(self.column)
 
@@ -258,7 +338,11 @@ class ColRef(Expr):
   # we mimic the DF API here and return a projection, followed by 
   # the according operation
   def __getattr__(self, name: str):
-    
+    # only called if the normal lookup failed. Unset slots and special
+    # methods (looked up e.g. by copy or pickle) must not end up in a projection
+    if name in _COLREF_SLOTS or (name.startswith("__") and name.endswith("__")):
+      raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
     if not hasattr(super(), name):
       p = self.df.project(self.column)
       return getattr(p, name)
@@ -275,7 +359,11 @@ class ColRef(Expr):
       p = self.df.project(self.column)
       return p[expr] # use __getitem__ of DataFrame
 
+_COLREF_SLOTS = frozenset(s for c in ColRef.__mro__ for s in getattr(c, "__slots__", ()))
+
 class AllColumns(ColRef):
+  __slots__ = ()
+
   def __init__(self, df):
     super().__init__('*', df)
 
@@ -309,4 +397,95 @@ class ExprTraverser:
       if isinstance(current, BinaryExpression) and current.right:
         todo.put_nowait(current.right)
       
-      visitorFunc(current)
\ No newline at end of file
+      visitorFunc(current)
+
+
+class ExprInterner:
+  """
+  Hash-consing for expression trees: structurally identical subexpressions
+  are replaced by one shared instance, e.g. the many `df.a` references in
+  a generated predicate like `(df.a == 1) | (df.a == 2) | ...`.
+
+  Interning is optional and meant for one expression (or the expressions of
+  one operator) before it is passed to a DataFrame: operators re-point the
+  column references of their expression to themselves, so shared nodes must
+  not be used by different operators. FuncCalls are never shared.
+  The interner keeps all canonical nodes alive, drop it when done.
+  """
+
+  def __init__(self):
+    self._nodes = {}
+
+  def __len__(self):
+    return len(self._nodes)
+
+  @staticmethod
+  def _valueKey(v):
+    if isinstance(v, list) or isinstance(v, tuple):
+      v = tuple(v)
+    try:
+      hash(v)
+    except TypeError:
+      return None
+    return (type(v), v)
+
+  def _key(self, node):
+    def childKey(c):
+      # children are already replaced by their canonical instance
+      if isinstance(c, Expr):
+        return ("expr", id(c))
+      key = ExprInterner._valueKey(c)
+      return key if key is not None else ("obj", id(c))
+
+    if isinstance(node, ColRef):
+      return (type(node), node.column, node.alias, id(node.df))
+    elif isinstance(node, Constant):
+      key = ExprInterner._valueKey(node.value)
+      return None if key is None else (Constant, key, node.alias)
+    elif isinstance(node, BinaryExpression):
+      return (type(node), node.operand, childKey(node.left), childKey(node.right))
+
+    return None
+
+  def intern(self, expr):
+    '''return the canonical instance of expr, its subexpressions are replaced in place'''
+    if not isinstance(expr, Expr):
+      return expr
+
+    # id(original node) -> (original node, canonical node). The original is
+    # kept so that its id cannot be reused while interning
+    canonical = {}
+    todo = [(expr, False)]
+    while todo:
+      (node, childrenDone) = todo.pop()
+      if id(node) in canonical:
+        continue
+
+      if isinstance(node, BinaryExpression):
+        if not childrenDone:
+          todo.append((node, True))
+          for c in (node.left, node.right):
+            if isinstance(c, Expr) and id(c) not in canonical:
+              todo.append((c, False))
+          continue
+
+        if isinstance(node.left, Expr):
+          node.left = canonical[id(node.left)][1]
+        if isinstance(node.right, Expr):
+          node.right = canonical[id(node.right)][1]
+        node._hash = None
+
+      key = self._key(node)
+      found = node if key is None else self._nodes.setdefault(key, node)
+      canonical[id(node)] = (node, found)
+
+    return canonical[id(expr)][1]
+
+def intern(expr, interner: ExprInterner = None):
+  '''
+  Share identical subexpressions of expr, see ExprInterner. Pass the same 
+  interner to share nodes between several expressions of one operator
+  '''
+  if interner is None:
+    interner = ExprInterner()
+  return interner.intern(expr)
@@ -0,0 +1,480 @@
+"""
+Local evaluation of UDFs the DBMS cannot execute (compilation failed and the
+UDF was applied with fallback=True).
+
+The DataFrame that computes the UDF columns is executed without them, their
+input values are selected instead (see SQLGenerator.generateFallbackInput).
+The result is fetched in chunks and the UDFs are applied to every chunk on
+the client, so only one chunk of input rows is in memory at a time.
+
+The plan is split at the UDF (see split): filters, projections, orderings and
+limits above it that don't use the UDF results are still executed by the
+DBMS, so that only the reduced data is downloaded. The operators that depend
+on the UDF results are applied locally to the evaluated chunks.
+
+A UDF is called once per chunk with NumPy arrays if it is known to work
+element-wise: its name starts with vec_ (like for MonetDB and batched UDFs)
+or it only consists of arithmetic on numeric parameters. Otherwise it is
+called for every row with numpy.vectorize.
+
+With more than one worker, the chunks are evaluated in a process pool. UDFs
+are sent to the workers by reference if they can be pickled (functions
+defined at module level), otherwise as source code, like to the DBMS. If
+the source code uses names defined outside of the function (imports, helper
+functions, closure variables), the UDFs are evaluated in this process.
+"""
+import ast
+import builtins
+import collections
+import logging
+import os
+import pickle
+import textwrap
+
+from grizzly.expression import (ArithmExpr, ArithmeticOperation, BinaryExpression, BoolExpr, BooleanOperation,
+  ColRef, ComputedCol, Constant, FuncCall, LogicExpr, LogicOperation, ModelUDF, SetExpr, SetOperation)
+from grizzly.udfcompiler import purity
+
+logger = logging.getLogger(__name__)
+
+_NUMERIC = ("int", "float")
+
+def findUDFs(df):
+  '''
+  The first DataFrame (from df towards the base table) with computed columns
+  that are UDFs with fallback=True, and these UDF calls. (None, []) if there
+  is none
+  '''
+  current = df
+  while current is not None:
+    calls = [x for x in current.computedCols if isinstance(x, FuncCall) and x.udf is not None
+      and not isinstance(x.udf, ModelUDF) and x.udf.fallback]
+    if calls:
+      return (current, calls)
+    current = current.parents[0] if current.parents else None
+
+  return (None, [])
+
+def split(df, node, calls):
+  '''
+  Split the plan of df at node, which computes the UDF calls. Returns
+  (top, needed, local): top is the highest DataFrame that can be executed by
+  the DBMS, needed the calls whose results are still part of its result and
+  local the operators above top that must be applied locally (bottom-up)
+  '''
+  from grizzly.dataframes.frame import Projection
+  above = []
+  current = df
+  while current is not node:
+    above.insert(0, current)
+    current = current.parents[0]
+
+  top = node
+  needed = list(calls)
+  for (i, op) in enumerate(above):
+    if not needed:
+      # the UDF results were projected away, nothing depends on them
+      return (df, needed, [])
+
+    aliases = set(f.alias.lower() for f in needed)
+    if not _canPush(op, aliases):
+      return (top, needed, above[i:])
+
+    top = op
+    if isinstance(op, Projection) and op.columns:
+      projected = set(c.lower() for c in _columns(op.columns))
+      needed = [f for f in needed if f.alias.lower() in projected]
+
+  return (top, needed, [])
+
+def _canPush(op, aliases) -> bool:
+  '''can the operator be executed by the DBMS although the UDF results are not computed'''
+  from grizzly.dataframes.frame import Filter, Limit, Ordering, Projection, TopN
+  if isinstance(op, Filter):
+    exprs = [op.expr]
+  elif isinstance(op, Projection):
+    # DISTINCT on the NULL placeholders and the additional input columns would be wrong
+    if op.doDistinct and (not op.columns or any(c.lower() in aliases for c in _columns(op.columns))):
+      return False
+    exprs = [c for c in op.columns or [] if not isinstance(c, ColRef)]
+  elif isinstance(op, (Ordering, TopN)):
+    exprs = list(op.by)
+  elif isinstance(op, Limit):
+    exprs = []
+  else:
+    return False
+
+  return not any(c.lower() in aliases for c in _columns(exprs + list(op.computedCols)))
+
+def _columns(expr):
+  '''names of the columns referenced in the expression (or list of expressions)'''
+  from grizzly.dataframes.frame import DataFrame
+  if isinstance(expr, list):
+    return [c for e in expr for c in _columns(e)]
+  elif isinstance(expr, ColRef):
+    return [expr.column]
+  elif isinstance(expr, BinaryExpression):
+    return _columns(expr.left) + _columns(expr.right)
+  elif isinstance(expr, ComputedCol):
+    return _columns(expr.value)
+  elif isinstance(expr, FuncCall):
+    return _columns(list(expr.inputCols))
+  elif isinstance(expr, DataFrame):
+    # a subquery, doesn't see the columns of the outer query
+    return []
+  return []
+
+def isElementwise(udf) -> bool:
+  '''can the UDF be called with arrays instead of single values'''
+  if udf.name.startswith("vec_"):
+    return True
+
+  if udf.returnType not in _NUMERIC or any(p.type not in _NUMERIC for p in udf.params):
+    return False
+
+  try:
+    tree = ast.parse(textwrap.dedent("".join(udf.lines)))
+  except SyntaxError:
+    return False
+
+  funcs = [n for n in tree.body if isinstance(n, ast.FunctionDef)]
+  if len(funcs) != 1 or funcs[0].decorator_list:
+    return False
+
+  names = set(p.name for p in udf.params)
+  for (i, stmt) in enumerate(funcs[0].body):
+    if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 and isinstance(stmt.targets[0], ast.Name):
+      if not _isArithmetic(stmt.value, names):
+        return False
+      names.add(stmt.targets[0].id)
+    elif isinstance(stmt, ast.Return) and i == len(funcs[0].body) - 1:
+      return stmt.value is not None and _isArithmetic(stmt.value, names)
+    elif isinstance(stmt, ast.Pass) or (isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant)):
+      continue # pass or docstring
+    else:
+      return False
+
+  return False
+
+def _isNumber(node) -> bool:
+  return isinstance(node, ast.Constant) and type(node.value) in (int, float)
+
+def _isArithmetic(node, names) -> bool:
+  '''
+  an expression with the same result for arrays as for every single value.
+  Division by a variable is excluded, it fails for 0 in Python but not
+  in NumPy
+  '''
+  if isinstance(node, ast.Name):
+    return node.id in names
+  elif isinstance(node, ast.Constant):
+    return _isNumber(node)
+  elif isinstance(node, ast.UnaryOp):
+    return isinstance(node.op, (ast.USub, ast.UAdd)) and _isArithmetic(node.operand, names)
+  elif isinstance(node, ast.BinOp):
+    if isinstance(node.op, (ast.Add, ast.Sub, ast.Mult)):
+      return _isArithmetic(node.left, names) and _isArithmetic(node.right, names)
+    elif isinstance(node.op, (ast.Div, ast.FloorDiv, ast.Mod)):
+      return _isArithmetic(node.left, names) and _isNumber(node.right) and node.right.value != 0
+    elif isinstance(node.op, ast.Pow):
+      return _isArithmetic(node.left, names) and isinstance(node.right, ast.Constant) and type(node.right.value) == int and node.right.value >= 0
+  elif isinstance(node, ast.Call):
+    return isinstance(node.func, ast.Name) and node.func.id == "abs" and len(node.args) == 1 and not node.keywords and _isArithmetic(node.args[0], names)
+  return False
+
+def apply(func, args, numRows: int, elementwise: bool):
+  '''the results of the UDF function for the argument arrays (one per parameter)'''
+  import numpy
+
+  if not args:
+    return numpy.array([func() for _ in range(numRows)], dtype=object)
+
+  if elementwise:
+    res = func(*args)
+    if numpy.ndim(res) == 0: # e.g. a constant
+      res = numpy.full(numRows, res)
+    return res
+
+  # otypes: otherwise the function is called once more on the first values to find the type
+  return numpy.vectorize(func, otypes=[object])(*args)
+
+def evaluate(calls, header, chunks, inputName, workers: int = 1):
+  '''
+  Apply the UDF calls to the chunks (lists of rows) of the result of
+  SQLGenerator.generateFallbackInput with the given header. inputName(i, j)
+  is the column name of the j-th input of the i-th call.
+  With workers > 1 (None: number of CPUs) the chunks are evaluated in a
+  process pool, at most two chunks per worker are pending.
+  Yields a pandas DataFrame per chunk, in the order of the chunks
+  '''
+  # e.g. Oracle returns upper case column names
+  colNames = {c.lower(): c for c in header}
+  inputs = [[colNames[inputName(i, j).lower()] for j in range(len(f.inputCols))] for (i, f) in enumerate(calls)]
+  hidden = [c for cols in inputs for c in cols]
+  elementwise = [isElementwise(f.udf) for f in calls]
+  for (f, e) in zip(calls, elementwise):
+    logger.info(f"applying UDF {f.udf.name} locally, {'once per chunk' if e else 'per row'}")
+
+  outputs = [colNames[f.alias.lower()] for f in calls]
+  if workers is None:
+    workers = os.cpu_count() or 1
+  elif workers < 1:
+    raise ValueError(f"number of workers must be at least 1 (or None for all CPUs), but got {workers}")
+
+  portable = [_portable(f.udf) for f in calls] if workers > 1 else []
+  if workers > 1 and any(p is None for p in portable):
+    names = [f.udf.name for (f, p) in zip(calls, portable) if p is None]
+    logger.info(f"UDFs {names} use names defined outside of them, evaluating them in this process")
+    workers = 1
+
+  if workers == 1 or not calls:
+    udfs = list(zip([f.udf.func for f in calls], inputs, outputs, elementwise))
+    frames = (_process(rows, header, udfs, hidden) for rows in chunks)
+  else:
+    udfs = list(zip(portable, inputs, outputs, elementwise))
+    frames = _processParallel(chunks, header, udfs, hidden, workers)
+
+  empty = True
+  for frame in frames:
+    empty = False
+    yield frame
+
+  if empty:
+    # the columns of the result
+    yield _process([], header, udfs, hidden)
+
+def _processParallel(chunks, header, udfs, hidden, workers):
+  from concurrent.futures import ProcessPoolExecutor
+
+  logger.info(f"evaluating UDFs in {workers} processes")
+  pool = ProcessPoolExecutor(max_workers=workers)
+  pending = collections.deque()
+  try:
+    for rows in chunks:
+      pending.append(pool.submit(_process, rows, header, udfs, hidden))
+      if len(pending) >= 2 * workers:
+        yield pending.popleft().result()
+
+    while pending:
+      yield pending.popleft().result()
+  finally:
+    # e.g. the consumer stopped after a limit. Cancel the chunks that did not
+    # start yet instead of shutdown(cancel_futures=True), which needs Python 3.9
+    for f in pending:
+      f.cancel()
+    pool.shutdown()
+
+def _portable(udf):
+  '''
+  the UDF function if it can be pickled, otherwise its name and source code.
+  None if the source code is not self-contained: it is compiled in an empty
+  namespace, imports, helper functions and closure variables would be missing
+  '''
+  try:
+    pickle.dumps(udf.func)
+    return udf.func
+  except (pickle.PicklingError, AttributeError, TypeError):
+    pass
+
+  source = textwrap.dedent("".join(udf.lines))
+  try:
+    free = purity.freeNames(source)
+  except SyntaxError:
+    return None
+  if not free <= set(dir(builtins)):
+    return None
+  return (udf.func.__name__, source)
+
+# functions compiled from source code in a worker process: source -> function
+_compiled = {}
+
+def _function(func):
+  if callable(func):
+    return func
+
+  (name, source) = func
+  if source not in _compiled:
+    namespace = {}
+    exec(source, namespace)
+    _compiled[source] = namespace[name]
+  return _compiled[source]
+
+def _process(rows, header, udfs, hidden):
+  '''apply the UDFs (function, input columns, output column, elementwise) to the rows'''
+  import pandas
+
+  frame = pandas.DataFrame.from_records(rows, columns=header)
+
+  for (func, cols, output, elementwise) in udfs:
+    args = [frame[c].to_numpy() for c in cols]
+    frame[output] = apply(_function(func), args, len(frame), elementwise)
+
+  return frame.drop(columns=hidden).infer_objects()
+
+def collect(frames, limit = None):
+  '''concatenate the frames into one pandas DataFrame, stop after limit rows'''
+  import pandas
+
+  result = []
+  numRows = 0
+  for frame in frames:
+    result.append(frame)
+    numRows += len(frame)
+    if limit is not None and numRows >= limit:
+      break
+
+  p_df = pandas.concat(result, ignore_index=True)
+  return p_df if limit is None else p_df.head(limit)
+
+def applyLocal(ops, frames):
+  '''
+  Apply the operators (bottom-up, see split) to the pandas DataFrames of
+  evaluate. Filters, projections and limits are applied per frame, orderings
+  need the complete result
+  '''
+  from grizzly.dataframes.frame import Filter, Limit, Ordering, Projection, TopN
+  for op in ops:
+    logger.info(f"applying {type(op).__name__} locally")
+    if isinstance(op, Filter):
+      frames = _filter(op, frames)
+    elif isinstance(op, Projection):
+      frames = _project(op, frames)
+    elif isinstance(op, (Ordering, TopN)):
+      frames = _order(op, frames)
+      if isinstance(op, TopN):
+        frames = _limit(op, frames)
+    elif isinstance(op, Limit):
+      frames = _limit(op, frames)
+    else:
+      raise ValueError(f"{type(op).__name__} cannot be applied to the result of a UDF evaluated locally")
+
+    if op.computedCols and not isinstance(op, Projection):
+      frames = _compute(op.computedCols, frames)
+
+  return frames
+
+def _filter(op, frames):
+  import pandas
+
+  for frame in frames:
+    mask = _eval(op.expr, frame)
+    if not isinstance(mask, pandas.Series):
+      mask = pandas.Series(bool(mask), index=frame.index)
+    yield frame[mask.fillna(False).astype(bool)]
+
+def _project(op, frames):
+  for frame in frames:
+    result = frame[[_column(frame, c) for c in _columns(op.columns)]] if op.columns else frame
+    result = next(_compute(op.computedCols, [result]))
+    yield result.drop_duplicates() if op.doDistinct else result
+
+def _compute(computedCols, frames):
+  for frame in frames:
+    frame = frame.copy()
+    for c in computedCols:
+      if not isinstance(c, ComputedCol) or not c.alias:
+        raise ValueError(f"computed column {c} cannot be evaluated locally")
+      frame[c.alias] = _eval(c.value, frame)
+    yield frame
+
+def _order(op, frames):
+  import pandas
+
+  p_df = pandas.concat(list(frames), ignore_index=True)
+  by = [_column(p_df, c) for c in _columns(op.by)]
+
+  # like in the generated ORDER BY, a single direction applies to the last column
+  if isinstance(op.ascending, list):
+    ascending = op.ascending
+  else:
+    ascending = [True] * (len(by) - 1) + [op.ascending is None or bool(op.ascending)]
+
+  yield p_df.sort_values(by, ascending=ascending, kind="stable", ignore_index=True)
+
+def _limit(op, frames):
+  remaining = _eval(op.limit, None)
+  skip = _eval(op.offset, None) if op.offset is not None else 0
+
+  for frame in frames:
+    if skip >= len(frame):
+      skip -= len(frame)
+      continue
+
+    frame = frame.iloc[skip:skip + remaining]
+    skip = 0
+    remaining -= len(frame)
+    yield frame
+
+    if remaining <= 0:
+      break
+
+def _column(frame, name):
+  '''the column of the pandas DataFrame with the given name, the DBMS may have changed the case'''
+  for c in frame.columns:
+    if c.lower() == name.lower():
+      return c
+  raise ValueError(f"column {name} not found in the result, got {list(frame.columns)}")
+
+def _eval(expr, frame):
+  '''evaluate the expression on the pandas DataFrame'''
+  if expr is None:
+    return None
+  elif isinstance(expr, list):
+    return [_eval(e, frame) for e in expr]
+  elif isinstance(expr, ColRef):
+    return frame[_column(frame, expr.column)]
+  elif isinstance(expr, Constant):
+    return expr.value
+
+  elif isinstance(expr, LogicExpr):
+    l = _eval(expr.left, frame)
+    if expr.operand == LogicOperation.NOT:
+      return ~l
+    r = _eval(expr.right, frame)
+    if expr.operand == LogicOperation.AND:
+      return l & r
+    elif expr.operand == LogicOperation.OR:
+      return l | r
+    elif expr.operand == LogicOperation.XOR:
+      return l ^ r
+
+  elif isinstance(expr, SetExpr):
+    if expr.operand == SetOperation.IN and isinstance(expr.right, list):
+      return _eval(expr.left, frame).isin(expr.right)
+
+  elif isinstance(expr, BoolExpr):
+    l = _eval(expr.left, frame)
+    if expr.right is None:
+      # comparison with NULL
+      if expr.operand == BooleanOperation.EQ:
+        return l.isna()
+      elif expr.operand == BooleanOperation.NE:
+        return l.notna()
+    else:
+      r = _eval(expr.right, frame)
+      ops = {
+        BooleanOperation.EQ: lambda a, b: a == b,
+        BooleanOperation.NE: lambda a, b: a != b,
+        BooleanOperation.GT: lambda a, b: a > b,
+        BooleanOperation.GE: lambda a, b: a >= b,
+        BooleanOperation.LT: lambda a, b: a < b,
+        BooleanOperation.LE: lambda a, b: a <= b
+      }
+      if expr.operand in ops:
+        return ops[expr.operand](l, r)
+
+  elif isinstance(expr, ArithmExpr):
+    l = _eval(expr.left, frame)
+    r = _eval(expr.right, frame)
+    ops = {
+      ArithmeticOperation.ADD: lambda a, b: a + b,
+      ArithmeticOperation.SUB: lambda a, b: a - b,
+      ArithmeticOperation.MUL: lambda a, b: a * b,
+      ArithmeticOperation.DIV: lambda a, b: a / b,
+      ArithmeticOperation.MOD: lambda a, b: a % b,
+      ArithmeticOperation.POW: lambda a, b: a ** b
+    }
+    if expr.operand in ops:
+      return ops[expr.operand](l, r)
+
+  raise ValueError(f"expression cannot be evaluated locally: {expr}")
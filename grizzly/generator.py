@@ -46,6 +46,14 @@ class GrizzlyGenerator(object):
     return GrizzlyGenerator._backend.to_df(df)
 
   
+  @staticmethod
+  def fallback(df, limit = None):
+    """
+    Execute the query and apply UDFs that could not be compiled locally,
+    returns a pandas DataFrame
+    """
+    return GrizzlyGenerator._backend.fallback(df, limit)
+
   @staticmethod
   def table(df):
     """
@@ -54,6 +62,13 @@ class GrizzlyGenerator(object):
     """
     return GrizzlyGenerator._backend.table(df)
 
+  @staticmethod
+  def explain(df, analyze=False):
+    """
+    Let the underlying generator explain the query plan of the DataFrame
+    """
+    return GrizzlyGenerator._backend.explain(df, analyze)
+
   @staticmethod
   def close():
     """
@@ -0,0 +1,227 @@
+import itertools
+import logging
+from decimal import Decimal
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+class Action(object):
+  """
+  A single DataFrame action (collect, show, count, ...) run by an executor.
+  Hooks get the action as first argument of every event so that the events
+  of concurrent or nested actions can be told apart.
+  """
+
+  _ids = itertools.count()
+
+  def __init__(self, name: str, df = None):
+    self.id = next(Action._ids)
+    self.name = name
+    self.alias = df.alias if df is not None else None
+
+  def __str__(self):
+    return f"{self.name}#{self.id} ({self.alias})"
+
+class QueryHook(object):
+  """
+  Base class for instrumentation hooks. Register an instance with
+  RelationalExecutor.addHook and override the events you are interested in.
+  All durations are given in seconds.
+  """
+
+  def on_generate(self, action: Action, secs: float, preQueries: List[str], sql: str):
+    '''Query code for the action was generated'''
+    pass
+
+  def on_pre_query(self, action: Action, sql: str, secs: float):
+    '''A pre-query (UDF creation, external table, ...) was executed'''
+    pass
+
+  def on_execute_start(self, action: Action, sql: str):
+    '''The query is about to be sent to the DBMS'''
+    pass
+
+  def on_execute_end(self, action: Action, sql: str, secs: float):
+    '''The DBMS accepted the query and returned a cursor'''
+    pass
+
+  def on_fetch_batch(self, action: Action, rows: int, bytes: int, secs: float):
+    '''A batch of result rows was fetched. bytes is an estimate of the payload size'''
+    pass
+
+  def on_action_end(self, action: Action):
+    '''The action finished, e.g. the iterator was exhausted'''
+    pass
+
+def estimateBytes(rows) -> int:
+  '''
+  Estimate the payload size of the given rows. This is not the size on the
+  wire (which depends on the driver), but good enough to compare actions.
+  '''
+  size = 0
+  for row in rows:
+    for v in row:
+      if v is None:
+        continue
+      t = type(v)
+      if t is str or t is bytes:
+        size += len(v)
+      elif t is bool:
+        size += 1
+      elif t is int or t is float or isinstance(v, Decimal):
+        size += 8
+      else:
+        size += len(str(v))
+  return size
+
+class ActionStats(object):
+  def __init__(self, action: Action):
+    self.action = action
+    self.sql = None
+    self.generateSecs = 0.0
+    self.preQueries = 0
+    self.preQuerySecs = 0.0
+    self.executeSecs = 0.0
+    self.fetchSecs = 0.0
+    self.batches = 0
+    self.rows = 0
+    self.bytes = 0
+
+  @property
+  def totalSecs(self):
+    return self.generateSecs + self.preQuerySecs + self.executeSecs + self.fetchSecs
+
+  def asDict(self) -> Dict:
+    return {
+      "action": self.action.name,
+      "id": self.action.id,
+      "alias": self.action.alias,
+      "generate_secs": self.generateSecs,
+      "pre_queries": self.preQueries,
+      "pre_query_secs": self.preQuerySecs,
+      "execute_secs": self.executeSecs,
+      "fetch_secs": self.fetchSecs,
+      "total_secs": self.totalSecs,
+      "batches": self.batches,
+      "rows": self.rows,
+      "bytes": self.bytes,
+      "sql": self.sql
+    }
+
+  def __str__(self):
+    return f"{self.action}: total {self.totalSecs:.6f}s (generate {self.generateSecs:.6f}s, " \
+      f"{self.preQueries} pre-queries {self.preQuerySecs:.6f}s, execute {self.executeSecs:.6f}s, " \
+      f"fetch {self.fetchSecs:.6f}s), {self.rows} rows, ~{self.bytes} bytes"
+
+class StatsCollector(QueryHook):
+  """
+  Default hook: records durations and counts per action and passes the
+  finished ActionStats to all exporters.
+  """
+
+  def __init__(self, exporters = None, keep: int = 1000):
+    self.exporters = list(exporters) if exporters else []
+    self.keep = keep
+    self.finished: List[ActionStats] = []
+    self._running: Dict[int, ActionStats] = {}
+
+  def _stats(self, action: Action) -> ActionStats:
+    s = self._running.get(action.id)
+    if s is None:
+      s = ActionStats(action)
+      self._running[action.id] = s
+    return s
+
+  def on_generate(self, action, secs, preQueries, sql):
+    s = self._stats(action)
+    s.generateSecs += secs
+    s.sql = sql
+
+  def on_pre_query(self, action, sql, secs):
+    s = self._stats(action)
+    s.preQueries += 1
+    s.preQuerySecs += secs
+
+  def on_execute_end(self, action, sql, secs):
+    s = self._stats(action)
+    s.executeSecs += secs
+    if s.sql is None:
+      s.sql = sql
+
+  def on_fetch_batch(self, action, rows, bytes, secs):
+    s = self._stats(action)
+    s.batches += 1
+    s.rows += rows
+    s.bytes += bytes
+    s.fetchSecs += secs
+
+  def on_action_end(self, action):
+    s = self._running.pop(action.id, None)
+    if s is None:
+      return
+
+    self.finished.append(s)
+    if self.keep is not None and len(self.finished) > self.keep:
+      del self.finished[:len(self.finished) - self.keep]
+
+    for e in self.exporters:
+      e.export(s)
+
+  def clear(self):
+    self.finished = []
+
+class LoggingExporter(object):
+  """
+  Writes one log line per finished action
+  """
+  def __init__(self, theLogger = None, level = logging.INFO):
+    self.logger = theLogger if theLogger is not None else logger
+    self.level = level
+
+  def export(self, stats: ActionStats):
+    self.logger.log(self.level, str(stats))
+
+class HistogramExporter(object):
+  """
+  Simple in-memory histogram of the total action durations, per action name.
+  Bucket bounds are upper bounds in seconds, the last bucket collects
+  everything above the largest bound.
+  """
+  DEFAULT_BOUNDS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60]
+
+  def __init__(self, bounds: List[float] = None):
+    self.bounds = sorted(bounds) if bounds else HistogramExporter.DEFAULT_BOUNDS
+    self.counts: Dict[str, List[int]] = {}
+    self.sums: Dict[str, float] = {}
+
+  def export(self, stats: ActionStats):
+    self.add(stats.action.name, stats.totalSecs)
+
+  def add(self, name: str, secs: float):
+    if name not in self.counts:
+      self.counts[name] = [0] * (len(self.bounds) + 1)
+      self.sums[name] = 0.0
+
+    idx = len(self.bounds)
+    for i, b in enumerate(self.bounds):
+      if secs <= b:
+        idx = i
+        break
+
+    self.counts[name][idx] += 1
+    self.sums[name] += secs
+
+  def buckets(self, name: str):
+    '''list of (upper bound, count) pairs for the given action name'''
+    counts = self.counts.get(name, [0] * (len(self.bounds) + 1))
+    return list(zip(self.bounds + [float("inf")], counts))
+
+  def __str__(self):
+    lines = []
+    for name, counts in self.counts.items():
+      n = sum(counts)
+      lines.append(f"{name}: {n} actions, mean {self.sums[name] / n:.6f}s")
+      for (bound, cnt) in self.buckets(name):
+        if cnt > 0:
+          lines.append(f"  <= {bound}s: {cnt}")
+    return "\n".join(lines)
@@ -0,0 +1,51 @@
+"""
+Cache for the models of ModelUDFs (apply_torch_model, apply_onnx_model,
+apply_tensorflow_model).
+
+The source of cachedModel is embedded into the generated functions (see
+$$modelcache$$ in the *_code templates of grizzly.yml), so that all model
+UDFs running in the same process of the DBMS share one cache. Models are
+keyed by the hash of their path, i.e. different models don't collide, and
+are only loaded again if the modification time of the file changed. At most
+max_models models (model_cache section of the profile) are kept, the least
+recently used one is dropped first.
+"""
+import hashlib
+import inspect
+
+MAX_MODELS = 4
+
+def key(path: str) -> str:
+  '''
+  key of the model file in the cache. hash() of a str is randomized per process,
+  the key must be the same in the client and for every generated function
+  '''
+  return hashlib.sha1(path.encode()).hexdigest()[:16]
+
+# no docstring and no single quotes: the code is embedded into quoted function bodies (e.g. Vector)
+def cachedModel(key, path, load, maxModels = MAX_MODELS):
+  # a module is shared by all functions in the process, the cache is stored there
+  import collections
+  import os
+  import random
+  if not hasattr(random, "grizzly_models"):
+    random.grizzly_models = collections.OrderedDict()
+  models = random.grizzly_models
+
+  mtime = os.path.getmtime(path)
+  entry = models.get(key)
+  if entry is None or entry[0] != mtime:
+    models.pop(key, None)
+    entry = (mtime, load())
+    models[key] = entry
+    while len(models) > maxModels:
+      models.popitem(last = False)
+  else:
+    models.move_to_end(key)
+
+  return entry[1]
+
+def source(maxModels: int = MAX_MODELS) -> str:
+  '''the code of cachedModel with the given limit, to embed into a model UDF'''
+  code = inspect.getsource(cachedModel)
+  return code.replace("maxModels = MAX_MODELS", f"maxModels = {int(maxModels)}", 1)
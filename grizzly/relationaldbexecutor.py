@@ -1,38 +1,147 @@
 # from grizzly.generator import GrizzlyGenerator
 from unicodedata import decimal
-from grizzly.sqlgenerator import SQLGenerator
-# Imports needed for getting the db vendor
-import sqlite3
-import cx_Oracle
-import psycopg2
+from grizzly.sqlgenerator import SQLGenerator, DDLStatement
+
+from grizzly.instrumentation import Action, estimateBytes
+from grizzly.explain import Plan
+from grizzly.aggregates import AggregateType
+from grizzly.expression import ColRef
+from grizzly.sketches import HyperLogLog, TDigest
+from grizzly import fallback
 
 import logging
+import time
 from typing import List
 from decimal import Decimal
 
 logger = logging.getLogger(__name__)
 
 class RelationalExecutor(object):
+
+  # maps the top level module of a DB-API connection class to the profile
+  # name in grizzly.yml. The driver modules are never imported by us, we only
+  # look at the class of the connection object we were given
+  _driverProfiles = {
+    "cx_Oracle": "oracle",
+    "oracledb": "oracle",
+    "psycopg2": "postgresql",
+    "sqlite3": "sqlite",
+    "pymonetdb": "monetdb",
+    "pymysql": "mysql",
+    "MySQLdb": "mysql",
+  }
   
   def __init__(self, connection, queryGenerator=None):
     self.connection = connection
     # Create SQLGenerator with known connection type
-    # Creates dependencies for cx_oracle and postgresql packages, if not wanted,
-    # profile for SQLGenerator must be defined manually for udf compiler
+    # the profile for SQLGenerator must be defined manually if the driver 
+    # is not known, e.g. for the udf compiler
     # another approach could be to try to execute vendorspecific sql statements
     if not queryGenerator:
-      if type(connection) == cx_Oracle.Connection:
-        self.queryGenerator = SQLGenerator('oracle')
-      elif type(connection) == psycopg2.extensions.connection:
-        self.queryGenerator = SQLGenerator('postgresql')
-      elif type(connection) == sqlite3.Connection:
-        self.queryGenerator = SQLGenerator('sqlite')
-      else:
-        self.queryGenerator = SQLGenerator()
+      self.queryGenerator = SQLGenerator(RelationalExecutor._detectProfile(connection))
     else:
       self.queryGenerator = queryGenerator
+
+    # instrumentation hooks, see grizzly.instrumentation
+    self.hooks = []
+    # number of rows to fetch at once when hooks are registered
+    self.fetchBatchSize = 1000
+    # number of rows a UDF is applied to at once when it's evaluated locally, see grizzly.fallback
+    self.fallbackChunkSize = 10000
+    # number of processes that apply the UDFs to the chunks in parallel, None: number of CPUs
+    self.fallbackWorkers = 1
+    # objects (functions, external tables) created on the connection: name -> key of
+    # the definition, see _runPreQueries
+    self._createdObjects = {}
+    self._objectsConnection = connection
     super().__init__()
 
+  @staticmethod
+  def _detectProfile(connection):
+    '''
+    Get the profile name for the given connection based on the module name of 
+    its class, e.g. psycopg2.extensions.connection -> postgresql. 
+    Returns None if the driver is unknown.
+    '''
+    module = type(connection).__module__ or ""
+    driver = module.split(".")[0]
+    return RelationalExecutor._driverProfiles.get(driver)
+
+  ###################################
+  # instrumentation
+
+  def addHook(self, hook):
+    '''
+    Register a hook (see grizzly.instrumentation.QueryHook) that is notified 
+    about query generation, execution and fetching of every action
+    '''
+    self.hooks.append(hook)
+    return hook
+
+  def removeHook(self, hook):
+    self.hooks.remove(hook)
+
+  def _emit(self, event, action, *args):
+    # queries run outside of an action (e.g. schema lookups) are not reported
+    if action is None:
+      return
+    for h in self.hooks:
+      getattr(h, event)(action, *args)
+
+  def _endAction(self, action):
+    self._emit("on_action_end", action)
+
+  def _generate(self, df, action, genFunc = None):
+    start = time.perf_counter()
+    if genFunc is None:
+      (pre, sql) = self.queryGenerator.generate(df)
+    else:
+      (pre, sql) = genFunc()
+    self._emit("on_generate", action, time.perf_counter() - start, pre, sql)
+    return (pre, sql)
+
+  def _rows(self, rs, action):
+    '''
+    Iterate over the result set. If hooks are registered, rows are fetched 
+    in batches and every batch is reported
+    '''
+    if not self.hooks:
+      yield from rs
+      return
+
+    while True:
+      start = time.perf_counter()
+      batch = rs.fetchmany(self.fetchBatchSize)
+      secs = time.perf_counter() - start
+      if not batch:
+        break
+
+      self._emit("on_fetch_batch", action, len(batch), estimateBytes(batch), secs)
+      yield from batch
+
+  def _chunks(self, rs, action, size):
+    '''the rows of the result set in lists of at most size rows'''
+    while True:
+      start = time.perf_counter()
+      batch = rs.fetchmany(size)
+      secs = time.perf_counter() - start
+      if not batch:
+        break
+
+      if self.hooks:
+        self._emit("on_fetch_batch", action, len(batch), estimateBytes(batch), secs)
+      yield batch
+
+  def _fetchone(self, rs, action):
+    start = time.perf_counter()
+    row = rs.fetchone()
+    if self.hooks:
+      rows = [row] if row is not None else []
+      self._emit("on_fetch_batch", action, len(rows), estimateBytes(rows), time.perf_counter() - start)
+    return row
+
+  ###################################
+
   def generate(self, df):
     return self.queryGenerator.generate(df)
 
@@ -41,22 +150,61 @@ class RelationalExecutor(object):
     prequeries = ";".join(pre)
     return f"{prequeries} {qry}"
 
-  def _execute(self, sql):
+  def _execute(self, sql, action = None, isPreQuery = False):
     logger.debug(sql)
+    if not isPreQuery:
+      self._emit("on_execute_start", action, sql)
+    start = time.perf_counter()
     cursor = self.connection.cursor()
     try:
       cursor.execute(sql)
-      return cursor  
     except Exception as e:
       logger.error(f"Failed to execute query. Reason: {e}")
       logger.error(f"Query: {sql}")
       logger.exception(e)
       raise e
-    
+
+    secs = time.perf_counter() - start
+    if isPreQuery:
+      self._emit("on_pre_query", action, sql, secs)
+    else:
+      self._emit("on_execute_end", action, sql, secs)
+    return cursor
 
   def close(self):
+    self._createdObjects.clear()
     self.connection.close()
 
+  def _runPreQueries(self, pre, action):
+    '''
+    Execute the pre-queries of a query. Statements that create an object
+    (DDLStatement) are skipped if the object was already created with the
+    same definition on this connection
+    '''
+    if self._objectsConnection is not self.connection:
+      # reconnected, the objects have to be created again
+      self._createdObjects.clear()
+      self._objectsConnection = self.connection
+
+    created = {}
+    for pq in pre:
+      isDDL = isinstance(pq, DDLStatement)
+      if isDDL and self._createdObjects.get(pq.objName) == pq.key:
+        continue
+
+      try:
+        self._execute(pq, action, isPreQuery=True).close()
+      except Exception:
+        # e.g. an aborted transaction may have dropped objects we created
+        self._createdObjects.clear()
+        raise
+
+      if isDDL:
+        created[pq.objName] = pq.key
+
+    # only now, all statements of an object must run in the loop above
+    self._createdObjects.update(created)
+
   def getSchemaForObject(self, objName: str):
     (qry, namesColIdx, typesColIdx) = self.queryGenerator.getTableSchema(objName)
     if qry is None:
@@ -76,47 +224,59 @@ class RelationalExecutor(object):
 
 
   def fetchone(self, df):
-    rs = self.execute(df)
-    return rs.fetchone()
+    action = Action("fetchone", df)
+    try:
+      rs = self.execute(df, action)
+      return self._fetchone(rs, action)
+    finally:
+      self._endAction(action)
 
   def collect(self, df, includeHeader):
-    rs = self.execute(df)
+    action = Action("collect", df)
+    try:
+      rs = self.execute(df, action)
 
-    tuples = []
+      tuples = []
 
-    if includeHeader:
-      cols = RelationalExecutor.__getHeader(rs)
-      tuples.append(cols)
+      if includeHeader:
+        cols = RelationalExecutor.__getHeader(rs)
+        tuples.append(cols)
 
-    def convert(i):
-      t = type(i)
-      if t is int or t is float or t is str or t is bool:
-        return i
-      elif isinstance(i, Decimal):
-        return float(i)
-      else:
-        return str(i)
+      def convert(i):
+        t = type(i)
+        if t is int or t is float or t is str or t is bool:
+          return i
+        elif isinstance(i, Decimal):
+          return float(i)
+        else:
+          return str(i)
 
-    for row in rs:
-      # if the driver returns the tuple as some specialiced class (e.g. a Row implementation) 
-      # we hide this by converting it into a Python list
-      rowAsList = [convert(elem) for elem in row]
-      tuples.append(rowAsList)
+      for row in self._rows(rs, action):
+        # if the driver returns the tuple as some specialiced class (e.g. a Row implementation) 
+        # we hide this by converting it into a Python list
+        rowAsList = [convert(elem) for elem in row]
+        tuples.append(rowAsList)
 
-    return tuples
+      return tuples
+    finally:
+      self._endAction(action)
 
   def iterator(self, df, includeHeader):
     '''
     Returns an iterator over the result of the DF
     If includeHeader is true, the first row to be returned are the column names
     '''
-    rs = self.execute(df)
+    action = Action("iterator", df)
+    try:
+      rs = self.execute(df, action)
 
-    if includeHeader:
-      yield RelationalExecutor.__getHeader(rs)
+      if includeHeader:
+        yield RelationalExecutor.__getHeader(rs)
 
-    for row in rs:
-      yield row
+      for row in self._rows(rs, action):
+        yield row
+    finally:
+      self._endAction(action)
 
   @staticmethod
   def __getHeader(rs) -> List[str]:
@@ -127,34 +287,45 @@ class RelationalExecutor(object):
     return cols
 
   def table(self,df,limit=10):
-    rs = self.execute(df)
-    import beautifultable
-    table = beautifultable.BeautifulTable()
+    action = Action("table", df)
+    try:
+      rs = self.execute(df, action)
+      import beautifultable
+      table = beautifultable.BeautifulTable()
 
-    header = RelationalExecutor.__getHeader(rs)
-    table.columns.header = header
+      header = RelationalExecutor.__getHeader(rs)
+      table.columns.header = header
 
-    cnt = 0
-    for row in rs:
+      cnt = 0
+      for row in self._rows(rs, action):
 
-      if cnt > limit:
-        break
+        if cnt > limit:
+          break
 
-      cnt += 1
-      table.rows.append(row)
+        cnt += 1
+        table.rows.append(row)
 
-    rs.close()
-    return str(table)
+      rs.close()
+      return str(table)
+    finally:
+      self._endAction(action)
 
   def toString(self, df, delim=",", pretty=False, maxColWidth=20, limit=20):
-    rs = self.execute(df)
+    action = Action("toString", df)
+    try:
+      return self._toString(df, action, delim, pretty, maxColWidth, limit)
+    finally:
+      self._endAction(action)
+
+  def _toString(self, df, action, delim, pretty, maxColWidth, limit):
+    rs = self.execute(df, action)
 
     cols = RelationalExecutor.__getHeader(rs)
 
     if not pretty:
       strings = [delim.join(cols)]
       cnt = 0
-      for row in rs:
+      for row in self._rows(rs, action):
         cnt += 1
         if limit is None or cnt <= limit:
           strings.append(delim.join([str(col) for col in row]))
@@ -167,7 +338,7 @@ class RelationalExecutor(object):
 
       return "\n".join(strings)
     else:
-      firstRow = rs.fetchone()
+      firstRow = self._fetchone(rs, action)
 
       colWidths = [ min(maxColWidth, max(len(x),len(str(y)))) for x,y in zip(cols, firstRow)]
 
@@ -187,7 +358,7 @@ class RelationalExecutor(object):
 
       resultRep = [formatRow(cols), formatRow(firstRow)]
       cnt = 1 # we already fetched and processed the first row
-      for row in rs:
+      for row in self._rows(rs, action):
         cnt += 1
         if  limit is None or cnt <= limit:
           resultRep.append(formatRow(row))
@@ -200,12 +371,52 @@ class RelationalExecutor(object):
       return "\n".join(resultRep)
 
   def to_df(self, df):
-    (pre, qry) = self.queryGenerator.generate(df)
-    import pandas
-    p_df = pandas.read_sql(qry, self.connection)
-    return p_df
+    action = Action("to_df", df)
+    try:
+      (pre, qry) = self._generate(df, action)
+      import pandas
+
+      self._emit("on_execute_start", action, qry)
+      start = time.perf_counter()
+      p_df = pandas.read_sql(qry, self.connection)
+      secs = time.perf_counter() - start
+      # pandas executes and fetches in one go, we report the whole time as execution
+      self._emit("on_execute_end", action, qry, secs)
+      if self.hooks:
+        self._emit("on_fetch_batch", action, len(p_df), int(p_df.memory_usage(deep=True).sum()), 0.0)
+      return p_df
+    finally:
+      self._endAction(action)
+
+  def fallbackIterator(self, df):
+    '''
+    Execute df and apply the UDFs with fallback=True locally, see
+    grizzly.fallback. Yields a pandas DataFrame per chunk of fallbackChunkSize rows
+    '''
+    (node, calls) = fallback.findUDFs(df)
+    if node is None:
+      raise ValueError("DataFrame has no UDFs that can be applied locally (fallback=True)")
+
+    # operators above the UDF that don't depend on its results are executed by the DBMS
+    (top, needed, local) = fallback.split(df, node, calls)
+
+    action = Action("fallback", df)
+    try:
+      (pre, sql) = self._generate(top, action, lambda: self.queryGenerator.generateFallbackInput(top, calls, needed))
+      self._runPreQueries(pre, action)
+      rs = self._execute(sql, action)
+      header = RelationalExecutor.__getHeader(rs)
+
+      frames = fallback.evaluate(needed, header, self._chunks(rs, action, self.fallbackChunkSize), SQLGenerator.udfInputName, self.fallbackWorkers)
+      yield from fallback.applyLocal(local, frames)
+    finally:
+      self._endAction(action)
+
+  def fallback(self, df, limit = None):
+    '''the result of df as pandas DataFrame, with the UDFs with fallback=True applied locally'''
+    return fallback.collect(self.fallbackIterator(df), limit)
 
-  def execute(self, df):
+  def execute(self, df, action = None):
     """
     Execute the operations and print results to stdout
     If pre-queries are necessary, e.g. for UDF or External table creation,
@@ -214,26 +425,81 @@ class RelationalExecutor(object):
     Non-pretty mode outputs in CSV style -- the delim parameter can be used to 
     set the delimiter. Non-pretty mode ignores the maxColWidth parameter.
     """
+    ownAction = action is None
+    if ownAction:
+      action = Action("execute", df)
 
-    (pre,sql) = self.queryGenerator.generate(df)
-    for pq in pre:
-      # print(pq)
-      self._execute(pq).close()
-    # print(sql)
-    return self._execute(sql)
+    try:
+      (pre,sql) = self._generate(df, action)
+      self._runPreQueries(pre, action)
+      # print(sql)
+      return self._execute(sql, action)
+    finally:
+      if ownAction:
+        self._endAction(action)
 
   def _execAgg(self, df, f):
     """
     Really executes the aggregation and returns the single result
     """
-    (pre, aggQry) = self.queryGenerator._generateAggCode(df, f)
-    for pq in pre:
-      self._execute(pq).close()
-    # execute an SQL query and get the result set
-    rs = self._execute(aggQry)
-    #fetch first (and only) row, return first column only
-    return rs.fetchone()[0]  
+    if not self.queryGenerator.hasNativeAggregate(f.funcName):
+      return self._execSketchAgg(df, f)
+
+    action = Action("aggregate", df)
+    try:
+      (pre, aggQry) = self._generate(df, action, lambda: self.queryGenerator._generateAggCode(df, f))
+      self._runPreQueries(pre, action)
+      # execute an SQL query and get the result set
+      rs = self._execute(aggQry, action)
+      #fetch first (and only) row, return first column only
+      return self._fetchone(rs, action)[0]
+    finally:
+      self._endAction(action)
+
+  def _execSketchAgg(self, df, f):
+    """
+    Compute an approximate aggregate the DBMS has no function for with a
+    sketch on the client. Only the input column is fetched (in batches)
+    """
+    col = f.inputCols[0]
+    if not isinstance(col, ColRef):
+      raise ValueError(f"{AggregateType.getName(f.funcName)} on the client requires a column, but got {col}")
+
+    if f.funcName == AggregateType.APPROX_COUNT_DISTINCT:
+      sketch = HyperLogLog()
+    else:
+      sketch = TDigest()
+
+    action = Action("aggregate", df)
+    try:
+      rs = self.execute(df[[col.colName()]], action)
+      for row in self._rows(rs, action):
+        if row[0] is not None: # NULLs are ignored like in SQL aggregates
+          sketch.add(row[0])
+    finally:
+      self._endAction(action)
+
+    if f.funcName == AggregateType.APPROX_COUNT_DISTINCT:
+      return sketch.estimate()
+    return sketch.quantile(f.inputCols[1].value)
+
+  def explain(self, df, analyze = False):
+    """
+    Run the dialect specific EXPLAIN for the query of df and return the 
+    parsed plan. With analyze=True the query is actually executed by the DBMS
+    """
+    action = Action("explain", df)
+    try:
+      (pre, explainSQL, fmt) = self.queryGenerator.generateExplain(df, analyze)
+      self._runPreQueries(pre, action)
+
+      rs = self._execute(explainSQL, action)
+      rows = list(self._rows(rs, action))
+      rs.close()
+
+      return Plan.fromRows(fmt, rows, explainSQL, df, analyze)
+    finally:
+      self._endAction(action)
 
   def _gen_agg(self, df, func):
     return self.queryGenerator._generateAggCode(df, func)
-
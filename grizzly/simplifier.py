@@ -0,0 +1,259 @@
+"""
+Simplification of expression trees before SQL code is generated:
+
+ - constant arithmetic is folded, e.g. 2 * 3 -> 6 and (x * -1) + 1 -> 1 - x
+ - comparisons of numeric constants are evaluated
+ - nested AND/OR are flattened, duplicate terms removed and constant
+   true/false terms eliminated
+ - OR-chains of equality comparisons on the same column become IN (...)
+ - NOT is pushed down to the comparisons (De Morgan), e.g. ~(x > 1) -> x <= 1
+
+The input expression is not modified, changed parts are rebuilt.
+"""
+from grizzly.expression import ArithmExpr, ArithmeticOperation, BinaryExpression, BoolExpr, BooleanOperation, ColRef, ComputedCol, Constant, LogicExpr, LogicOperation, SetExpr, SetOperation
+
+_NEGATED = {
+  BooleanOperation.EQ: BooleanOperation.NE,
+  BooleanOperation.NE: BooleanOperation.EQ,
+  BooleanOperation.GT: BooleanOperation.LE,
+  BooleanOperation.LE: BooleanOperation.GT,
+  BooleanOperation.GE: BooleanOperation.LT,
+  BooleanOperation.LT: BooleanOperation.GE
+}
+
+_COMPARE = {
+  BooleanOperation.EQ: lambda a, b: a == b,
+  BooleanOperation.NE: lambda a, b: a != b,
+  BooleanOperation.GT: lambda a, b: a > b,
+  BooleanOperation.GE: lambda a, b: a >= b,
+  BooleanOperation.LT: lambda a, b: a < b,
+  BooleanOperation.LE: lambda a, b: a <= b
+}
+
+def simplify(expr):
+  '''simplified version of the given expression (or ComputedCol)'''
+  if isinstance(expr, ComputedCol):
+    value = simplify(expr.value)
+    return expr if value is expr.value else ComputedCol(value, expr.alias)
+
+  res = _simplify(expr)
+  if isinstance(res, bool):
+    # the whole predicate is constant. There is no portable boolean literal
+    return BoolExpr(Constant(1), Constant(1 if res else 0), BooleanOperation.EQ)
+  return res
+
+def _isNumber(e):
+  return isinstance(e, Constant) and e.alias is None and type(e.value) in (int, float)
+
+def _isLiteral(e):
+  '''a constant single value that may be used in an IN list'''
+  return isinstance(e, Constant) and e.alias is None and e.value is not None and not isinstance(e.value, list)
+
+def _key(e):
+  '''structural identity of an expression, used to find duplicates'''
+  if isinstance(e, ColRef):
+    return (type(e), e.column, id(e.df), e.alias)
+  elif isinstance(e, Constant):
+    v = e.value
+    if isinstance(v, list):
+      v = tuple(_key(x) for x in v)
+    try:
+      hash(v)
+    except TypeError:
+      v = id(v)
+    return (Constant, type(e.value), v, e.alias)
+  elif isinstance(e, BinaryExpression):
+    return (type(e), e.operand, _key(e.left), _key(e.right))
+  elif isinstance(e, list) or isinstance(e, tuple):
+    return tuple(_key(x) for x in e)
+  elif e is None or isinstance(e, bool):
+    return e
+  # function calls (UDFs might not be deterministic), DataFrames, ...
+  return ("obj", id(e))
+
+def _simplify(e):
+  if isinstance(e, LogicExpr):
+    if e.operand == LogicOperation.NOT:
+      return _negate(_simplify(e.left))
+    elif e.operand == LogicOperation.AND or e.operand == LogicOperation.OR:
+      return _combine(e.operand, [_simplify(t) for t in _terms(e, e.operand)])
+    else:
+      return _rebuild(e, _toExpr(_simplify(e.left)), _toExpr(_simplify(e.right)))
+
+  elif isinstance(e, SetExpr):
+    return _rebuild(e, _simplify(e.left), e.right)
+
+  elif isinstance(e, BoolExpr):
+    left = _simplify(e.left)
+    right = _simplify(e.right)
+    if _isNumber(left) and _isNumber(right) and e.operand in _COMPARE:
+      return _COMPARE[e.operand](left.value, right.value)
+    return _rebuild(e, left, right)
+
+  elif isinstance(e, ArithmExpr):
+    return _simplifyArithm(e, _simplify(e.left), _simplify(e.right))
+
+  return e
+
+def _toExpr(e):
+  if isinstance(e, bool):
+    return simplify(e)
+  return e
+
+def _rebuild(e, left, right):
+  if left is e.left and right is e.right:
+    return e
+  return type(e)(left, right, e.operand)
+
+def _isNegation(e):
+  '''x * -1 or -1 * x, returns x'''
+  if isinstance(e, ArithmExpr) and e.operand == ArithmeticOperation.MUL:
+    if _isNumber(e.right) and e.right.value == -1:
+      return e.left
+    if _isNumber(e.left) and e.left.value == -1:
+      return e.right
+  return None
+
+def _fold(op, a, b):
+  '''the value of a op b for numeric constants, None if it must be left to the DBMS'''
+  if op == ArithmeticOperation.ADD:
+    return a + b
+  elif op == ArithmeticOperation.SUB:
+    return a - b
+  elif op == ArithmeticOperation.MUL:
+    return a * b
+  elif op == ArithmeticOperation.DIV and b != 0:
+    if isinstance(a, float) or isinstance(b, float):
+      return a / b
+    # integer division truncates in SQL, only fold exact results
+    if a % b == 0:
+      return a // b
+  elif op == ArithmeticOperation.MOD and isinstance(a, int) and isinstance(b, int) and a >= 0 and b > 0:
+    return a % b
+  return None
+
+def _simplifyArithm(e, left, right):
+  if _isNumber(left) and _isNumber(right):
+    v = _fold(e.operand, left.value, right.value)
+    if v is not None:
+      return Constant(v)
+
+  if e.operand == ArithmeticOperation.ADD:
+    # y + (x * -1) -> y - x
+    negRight = _isNegation(right)
+    if negRight is not None:
+      return ArithmExpr(left, negRight, ArithmeticOperation.SUB)
+    negLeft = _isNegation(left)
+    if negLeft is not None:
+      return ArithmExpr(right, negLeft, ArithmeticOperation.SUB)
+
+  return _rebuild(e, left, right)
+
+def _terms(e, op):
+  '''operands of a chain of the same AND/OR operation. Iterative, chains can be long'''
+  terms = []
+  todo = [e]
+  while todo:
+    current = todo.pop()
+    if isinstance(current, LogicExpr) and current.operand == op:
+      todo.append(current.right)
+      todo.append(current.left)
+    else:
+      terms.append(current)
+  return terms
+
+def _negate(e):
+  if isinstance(e, bool):
+    return not e
+  elif isinstance(e, LogicExpr):
+    if e.operand == LogicOperation.NOT:
+      return e.left
+    elif e.operand == LogicOperation.AND:
+      return _combine(LogicOperation.OR, [_negate(t) for t in _terms(e, LogicOperation.AND)])
+    elif e.operand == LogicOperation.OR:
+      return _combine(LogicOperation.AND, [_negate(t) for t in _terms(e, LogicOperation.OR)])
+  elif isinstance(e, BoolExpr) and not isinstance(e, SetExpr) and e.operand in _NEGATED:
+    # x = NULL is generated as x is NULL, the negation x <> NULL as x is not NULL
+    return BoolExpr(e.left, e.right, _NEGATED[e.operand])
+
+  return LogicExpr(e, None, LogicOperation.NOT)
+
+def _inCandidate(t):
+  '''(column, [values]) if t is col = literal or col IN (literals), else None'''
+  if isinstance(t, SetExpr):
+    if t.operand == SetOperation.IN and isinstance(t.left, ColRef) and isinstance(t.right, list):
+      return (t.left, t.right)
+  elif isinstance(t, BoolExpr) and t.operand == BooleanOperation.EQ:
+    if isinstance(t.left, ColRef) and _isLiteral(t.right):
+      return (t.left, [t.right.value])
+    if isinstance(t.right, ColRef) and _isLiteral(t.left):
+      return (t.right, [t.left.value])
+  return None
+
+def _mergeIn(terms):
+  '''col = 1 OR col = 2 OR col IN (3, 4) -> col IN (1, 2, 3, 4)'''
+  groups = {}
+  for t in terms:
+    cand = _inCandidate(t)
+    if cand is not None:
+      groups.setdefault(_key(cand[0]), []).append(cand)
+
+  result = []
+  done = set()
+  for t in terms:
+    cand = _inCandidate(t)
+    if cand is None:
+      result.append(t)
+      continue
+
+    k = _key(cand[0])
+    if len(groups[k]) == 1:
+      result.append(t)
+    elif k not in done:
+      done.add(k)
+      values = []
+      seen = set()
+      for (_, vals) in groups[k]:
+        for v in vals:
+          vk = (type(v), v)
+          if vk not in seen:
+            seen.add(vk)
+            values.append(v)
+      result.append(SetExpr(cand[0], values, SetOperation.IN))
+
+  return result
+
+def _combine(op, terms):
+  '''build a flat AND/OR of the given (simplified) terms'''
+  isAnd = op == LogicOperation.AND
+
+  flat = []
+  for t in terms:
+    if isinstance(t, LogicExpr) and t.operand == op:
+      flat += _terms(t, op)
+    else:
+      flat.append(t)
+
+  result = []
+  seen = set()
+  for t in flat:
+    if isinstance(t, bool):
+      if t != isAnd: # false in AND, true in OR
+        return t
+      continue
+
+    k = _key(t)
+    if k not in seen:
+      seen.add(k)
+      result.append(t)
+
+  if not isAnd:
+    result = _mergeIn(result)
+
+  if not result:
+    return isAnd
+
+  expr = result[0]
+  for t in result[1:]:
+    expr = LogicExpr(expr, t, op)
+  return expr
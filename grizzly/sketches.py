@@ -0,0 +1,155 @@
+"""
+Streaming sketches to compute approximate aggregates on the client side for
+DBMS that do not have approximate aggregate functions. The values are fed
+one by one (e.g. from a batched fetch), memory is independent of the number
+of values.
+
+ - HyperLogLog: number of distinct values
+ - TDigest: quantiles
+"""
+import hashlib
+import math
+
+def _hash64(value) -> int:
+  # Python's hash() is the identity for small ints, which breaks the assumption
+  # of uniformly distributed bits. It's also randomized per process for str
+  return int.from_bytes(hashlib.blake2b(repr(value).encode(), digest_size=8).digest(), "big")
+
+class HyperLogLog(object):
+  '''
+  Estimates the number of distinct values with 2^precision registers.
+  The standard error is about 1.04 / sqrt(2^precision), i.e. 0.8% for the
+  default precision of 14 (16 KiB of registers)
+  '''
+  def __init__(self, precision: int = 14):
+    if not 4 <= precision <= 18:
+      raise ValueError(f"HyperLogLog precision must be between 4 and 18, but got {precision}")
+    self.precision = precision
+    self.m = 1 << precision
+    self.registers = bytearray(self.m)
+
+  def add(self, value):
+    h = _hash64(value)
+    idx = h >> (64 - self.precision)
+    # position of the first 1-bit in the remaining bits
+    rest = h & ((1 << (64 - self.precision)) - 1)
+    rank = (64 - self.precision) - rest.bit_length() + 1
+    if rank > self.registers[idx]:
+      self.registers[idx] = rank
+
+  def merge(self, other: "HyperLogLog"):
+    if other.precision != self.precision:
+      raise ValueError("cannot merge HyperLogLog sketches with different precision")
+    self.registers = bytearray(max(a, b) for (a, b) in zip(self.registers, other.registers))
+
+  def estimate(self) -> int:
+    m = self.m
+    if m == 16:
+      alpha = 0.673
+    elif m == 32:
+      alpha = 0.697
+    elif m == 64:
+      alpha = 0.709
+    else:
+      alpha = 0.7213 / (1 + 1.079 / m)
+
+    raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+
+    zeros = self.registers.count(0)
+    if raw <= 2.5 * m and zeros > 0:
+      # small range correction: linear counting
+      return round(m * math.log(m / zeros))
+    return round(raw)
+
+class TDigest(object):
+  '''
+  Merging t-digest (Dunning): values are buffered and merged into centroids,
+  the size of a centroid is limited by the k1 scale function, so that the
+  centroids at the tails are small and quantiles there are precise.
+  compression bounds the number of centroids
+  '''
+  def __init__(self, compression: int = 100):
+    self.compression = compression
+    self.centroids = [] # [mean, weight], sorted by mean
+    self.buffer = []
+    self.count = 0
+    self.min = None
+    self.max = None
+
+  def add(self, value, weight: int = 1):
+    value = float(value)
+    if self.min is None or value < self.min:
+      self.min = value
+    if self.max is None or value > self.max:
+      self.max = value
+
+    self.buffer.append([value, weight])
+    self.count += weight
+    if len(self.buffer) >= 5 * self.compression:
+      self._compress()
+
+  def _k(self, q):
+    return self.compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+  def _q(self, k):
+    return (math.sin(k * 2 * math.pi / self.compression) + 1) / 2
+
+  def _compress(self):
+    if not self.buffer:
+      return
+
+    points = sorted(self.centroids + self.buffer, key=lambda c: c[0])
+    self.buffer = []
+
+    total = self.count
+    merged = []
+    current = list(points[0])
+    before = 0 # weight of all centroids before current
+    qLimit = self._q(self._k(0) + 1) * total
+
+    for (mean, weight) in points[1:]:
+      if before + current[1] + weight <= qLimit:
+        newWeight = current[1] + weight
+        current[0] += (mean - current[0]) * weight / newWeight
+        current[1] = newWeight
+      else:
+        merged.append(current)
+        before += current[1]
+        qLimit = self._q(self._k(before / total) + 1) * total
+        current = [mean, weight]
+
+    merged.append(current)
+    self.centroids = merged
+
+  def quantile(self, q: float):
+    if not 0 <= q <= 1:
+      raise ValueError(f"quantile must be between 0 and 1, but got {q}")
+
+    self._compress()
+    if not self.centroids:
+      return None
+    if len(self.centroids) == 1:
+      return self.centroids[0][0]
+
+    target = q * self.count
+
+    # interpolate between the centers of the centroids, and the min/max at the ends
+    first = self.centroids[0]
+    if target < first[1] / 2:
+      return self.min + (first[0] - self.min) * target / (first[1] / 2)
+
+    cumulative = 0
+    for i in range(len(self.centroids) - 1):
+      (mean, weight) = self.centroids[i]
+      (nextMean, nextWeight) = self.centroids[i + 1]
+      center = cumulative + weight / 2
+      nextCenter = cumulative + weight + nextWeight / 2
+      if target < nextCenter:
+        return mean + (nextMean - mean) * (target - center) / (nextCenter - center)
+      cumulative += weight
+
+    last = self.centroids[-1]
+    lastCenter = self.count - last[1] / 2
+    if target >= self.count:
+      return self.max
+    return last[0] + (self.max - last[0]) * (target - lastCenter) / (last[1] / 2)
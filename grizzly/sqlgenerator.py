@@ -1,14 +1,20 @@
 from grizzly.dataframes.schema import ColType
 from grizzly.config import Config
 from grizzly.aggregates import AggregateType
-from grizzly.dataframes.frame import Limit, Ordering, UDF, ModelUDF, Table, ExternalTable, Projection, Filter, Join, Grouping, DataFrame, Union
-from grizzly.expression import AllColumns, ArithmExpr, ArithmeticOperation, BoolExpr, BooleanOperation, ComputedCol, Constant, ExpressionException, FuncCall, ColRef, LogicExpr, LogicOperation, SetExpr, SetOperation
+from grizzly.dataframes.frame import Limit, TopN, Ordering, Sample, UDF, ModelUDF, Table, ExternalTable, Projection, Filter, Join, SemiJoin, Grouping, DataFrame, Union, Window
+from grizzly.expression import WindowFunc, AllColumns, ArithmExpr, ArithmeticOperation, BoolExpr, BooleanOperation, ComputedCol, Constant, ExpressionException, FuncCall, ColRef, LogicExpr, LogicOperation, SetExpr, SetOperation
 from grizzly.generator import GrizzlyGenerator
+from grizzly.simplifier import simplify
 
 import grizzly.udfcompiler as udfcompiler
+from grizzly.udfcompiler import purity
+from grizzly.udfcompiler.inliner import inline, substituteParams
 from grizzly.udfcompiler.udfcompiler_exceptions import UDFCompilerException
+from grizzly import modelcache
 
 from typing import List, Set, Tuple
+import datetime
+import hashlib
 import re
 import logging
 logger = logging.getLogger(__name__)
@@ -16,6 +22,24 @@ logger = logging.getLogger(__name__)
 from typing import NewType
 SqlBigInt = NewType("bigint", int)
 
+class DDLStatement(str):
+  '''
+  A pre-query that (re-)creates the database object objName, e.g. a function
+  or an external table. An object may need several statements (DROP, CREATE,
+  ...), they all have the same key, which is the hash of the object's complete
+  definition. The executor does not run them again while the object exists
+  unchanged on its connection
+  '''
+  def __new__(cls, code: str, objName: str, key: str):
+    obj = super().__new__(cls, code)
+    obj.objName = objName
+    obj.key = key
+    return obj
+
+  @staticmethod
+  def create(objName: str, statements: List[str]) -> List["DDLStatement"]:
+    key = hashlib.sha1("\0".join(statements).encode()).hexdigest()
+    return [DDLStatement(s, objName, key) for s in statements]
 
 class SQLGenerator:
 
@@ -23,8 +47,34 @@ class SQLGenerator:
   def __init__(self, profile: str = None):
     self.profile = profile
     self.templates = Config.loadProfile(profile)
+    # simplify filter, join and computed column expressions (see grizzly.simplifier)
+    self.simplifyExpressions = True
+    # handling of large IN lists, a copy so that it can be changed per generator
+    self.inList = dict(self.templates["in_list"]) if "in_list" in self.templates else {}
+    # embed simple UDFs with lang='sql' as expressions (see grizzly.udfcompiler.inliner)
+    self.inlineUDFs = True
+    self._inlined = {}
+    # evaluate Python UDFs once per chunk of rows on profiles with a batch_udfs section
+    self.batchUDFs = True
+    # id of a computed column -> list of SQL expressions to select instead of it, and
+    # id of a Projection -> additional columns to select (see generateFallbackInput)
+    self._replacedCols = {}
+    self._addedCols = {}
     super().__init__()
 
+  def _simplified(self, expr):
+    return simplify(expr) if self.simplifyExpressions else expr
+
+  @staticmethod
+  def _literal(value) -> str:
+    if value is None:
+      return "NULL"
+    elif isinstance(value, (str, datetime.date, datetime.time)):
+      # dates as string literals, compared with the date/time columns after an implicit cast
+      escaped = str(value).replace("'", "''")
+      return f"'{escaped}'"
+    return str(value)
+
   @staticmethod
   def _unindent(lines: List[str]) -> List[str]:
     firstLine = lines[0]
@@ -85,8 +135,8 @@ class SQLGenerator:
     # we were given a constant
     elif isinstance(expr, Constant):
       alias = f"as {expr.alias}" if expr.alias is not None else ""
-      if isinstance(expr.value, str):
-        exprSQL = f"'{expr.value}' {alias}"
+      if isinstance(expr.value, (str, datetime.date, datetime.time)):
+        exprSQL = f"{SQLGenerator._literal(expr.value)} {alias}"
       elif isinstance(expr.value, list):
         
         eSQLs = []
@@ -107,9 +157,11 @@ class SQLGenerator:
       (lPre,l) = self._exprToSQL(expr.left)
       (rPre,r) = self._exprToSQL(expr.right)
 
-      if isinstance(expr.left, LogicExpr):
+      # AND and OR are associative: a chain of the same operation needs no parentheses
+      flat = expr.operand == LogicOperation.AND or expr.operand == LogicOperation.OR
+      if isinstance(expr.left, LogicExpr) and not (flat and expr.left.operand == expr.operand):
         l = f"({l})"
-      if isinstance(expr.right, LogicExpr):
+      if isinstance(expr.right, LogicExpr) and not (flat and expr.right.operand == expr.operand):
         r = f"({r})"
 
       if expr.operand == LogicOperation.AND:
@@ -125,11 +177,19 @@ class SQLGenerator:
 
       pre = lPre + rPre
 
+    elif isinstance(expr, SetExpr) and isinstance(expr.right, list) and self._isLargeInList(expr.right):
+      (lPre,l) = self._exprToSQL(expr.left)
+      if not isinstance(expr.left, ColRef) and not isinstance(expr.left, Constant):
+        l = f"({l})"
+
+      (rPre, exprSQL) = self._generateLargeInList(l, expr.right)
+      pre = lPre + rPre
+
     elif isinstance(expr, SetExpr): # must be handled before BoolExpr
       (lPre,l) = self._exprToSQL(expr.left)
 
       if isinstance(expr.right, list):
-        (rPre, r) = ([], ",".join([str(x) for x in expr.right]))
+        (rPre, r) = ([], ",".join([SQLGenerator._literal(x) for x in expr.right]))
       else: # should be a DF
         (rPre,r) = self._exprToSQL(expr.right)
 
@@ -250,15 +310,96 @@ class SQLGenerator:
 
     return (pre,exprSQL)
 
+  @staticmethod
+  def _inListType(values):
+    '''python type name of the values of an IN list, None if they are not of one supported type'''
+    types = set(type(v) for v in values)
+    if types == {int}:
+      return "int"
+    elif types == {float} or types == {int, float}:
+      return "float"
+    elif types == {str}:
+      return "str"
+    return None
+
+  def _isLargeInList(self, values) -> bool:
+    threshold = self.inList.get("threshold")
+    if threshold is None or len(values) <= threshold:
+      return False
+
+    strategy = self.inList.get("strategy")
+    if strategy == "values":
+      return SQLGenerator._inListType(values) is not None
+    # typed strategies need a SQL type for the values
+    return SQLGenerator._inListType(values) in self.inList.get("types", {})
+
+  def _generateLargeInList(self, colSQL: str, values) -> Tuple[List[str], str]:
+    '''
+    IN list with more values than the configured threshold: instead of inlining
+    all values, use a VALUES list, an array literal or a temporary table,
+    depending on the in_list strategy of the profile
+    '''
+    strategy = self.inList["strategy"]
+    template = self.inList["expr"]
+    pythonType = SQLGenerator._inListType(values)
+    sqlType = self.inList.get("types", {}).get(pythonType, "")
+
+    pre = []
+    if strategy == "values":
+      valuesSQL = ",".join(f"({SQLGenerator._literal(v)})" for v in values)
+      code = template.replace("$$values$$", valuesSQL)
+
+    elif strategy == "any_array":
+      # one string constant: '{1,2,3}' or '{"a","b"}'
+      if pythonType == "str":
+        elements = ",".join('"' + v.replace("\\", "\\\\").replace('"', '\\"') + '"' for v in values)
+      else:
+        elements = ",".join(str(v) for v in values)
+      arrayLiteral = ("{" + elements + "}").replace("'", "''")
+      code = template.replace("$$values$$", arrayLiteral)
+
+    elif strategy == "temp_table":
+      # the values determine the table name, so that the same list is loaded only once per query
+      digest = hashlib.sha1(repr(values).encode("utf-8")).hexdigest()[:16]
+      name = f"grizzly_in_{digest}"
+
+      for stmt in self.inList["create"]:
+        pre.append(stmt.replace("$$name$$", name).replace("$$type$$", sqlType))
+
+      chunkSize = self.inList.get("chunk_size", 1000)
+      for i in range(0, len(values), chunkSize):
+        rows = ",".join(f"({SQLGenerator._literal(v)})" for v in values[i:i+chunkSize])
+        pre.append(self.inList["insert"].replace("$$name$$", name).replace("$$values$$", rows))
+
+      code = template.replace("$$name$$", name)
+
+    else:
+      raise ValueError(f"Unknown strategy for large IN lists: {strategy}")
+
+    code = code.replace("$$column$$", colSQL).replace("$$type$$", sqlType)
+    if "$$alias$$" in code:
+      code = code.replace("$$alias$$", GrizzlyGenerator._incrAndGetTupleVar())
+
+    return (pre, code)
+
   def _buildFrom(self,df): #-> Tuple[List[str], str, str]:
 
     if df is not None:
 
+      if not any(id(x) in self._replacedCols for x in df.computedCols):
+        batched = self._batchedUDFs(df)
+        if batched:
+          return self._generateBatchedUDFs(df, batched)
+
       computedCols = []
       preCode = []
 
       for x in df.computedCols:
-        (exprPre, exprSQL) = self._exprToSQL(x)
+        if id(x) in self._replacedCols:
+          computedCols += self._replacedCols[id(x)]
+          continue
+
+        (exprPre, exprSQL) = self._exprToSQL(self._simplified(x))
         preCode += exprPre
         computedCols.append(exprSQL)
 
@@ -295,7 +436,7 @@ class SQLGenerator:
             pre += ePre
             prefixed.append(exprSQL)
           
-          prefixed = ",".join(prefixed)
+          prefixed = ",".join(prefixed + self._addedCols.get(id(df), []))
 
         if computedCols:
           prefixed += ","+computedCols
@@ -307,7 +448,7 @@ class SQLGenerator:
       elif isinstance(df,Filter):
         (pre,parentSQL) = self._buildFrom(df.parents[0])
 
-        (exprPre,exprStr) = self._exprToSQL(df.expr)
+        (exprPre,exprStr) = self._exprToSQL(self._simplified(df.expr))
 
         proj = "*"
         if computedCols:
@@ -317,6 +458,57 @@ class SQLGenerator:
 
         return (preCode + pre + exprPre, qry)
 
+      elif isinstance(df, Window):
+        (pre,parentSQL) = self._buildFrom(df.parents[0])
+
+        (wPre, wSQL) = self._generateWindowFunc(df.func)
+        pre += wPre
+
+        qry = f"SELECT *,{wSQL} FROM ({parentSQL}) {df.alias}"
+
+        # computed columns may use the window column, which is only in scope of an outer query
+        if computedCols:
+          qry = f"SELECT *,{computedCols} FROM ({qry}) {df.alias}"
+
+        return (preCode + pre, qry)
+
+      elif isinstance(df, SemiJoin): # must be checked before Join
+
+        (lpre,lparentSQL) = self._buildFrom(df.leftParent())
+
+        (rpre,rparentSQL) = self._buildFrom(df.rightParent())
+
+        lAlias = df.leftParent().alias
+        rAlias = df.rightParent().alias
+
+        if isinstance(df.on, list):
+          if len(df.on) != 2:
+            raise ExpressionException("on condition must consist of exacltly two columns")
+
+          (lOnPre,lOn) = self._exprToSQL(df.on[0])
+          (rOnPre,rOn) = self._exprToSQL(df.on[1])
+          preCode += lOnPre + rOnPre
+          onSQL = f"{lOn} {df.comp} {rOn}"
+        elif isinstance(df.on, LogicExpr) or isinstance(df.on, BoolExpr):
+          (exprPre, onSQL) = self._exprToSQL(self._simplified(df.on))
+          preCode += exprPre
+        else:
+          raise ExpressionException(f"unsupported join condition for {df.how} join: {df.on}")
+
+        if df.method == "in":
+          condSQL = f"{lOn} IN (SELECT {rOn} FROM ({rparentSQL}) {rAlias})"
+        else:
+          notKW = "NOT " if df.anti else ""
+          condSQL = f"{notKW}EXISTS (SELECT 1 FROM ({rparentSQL}) {rAlias} WHERE {onSQL})"
+
+        semiSQL = f"SELECT * FROM ({lparentSQL}) {lAlias} WHERE {condSQL}"
+
+        # computed columns refer to the semi join, which is only in scope of an outer query
+        if computedCols:
+          semiSQL = f"SELECT *,{computedCols} FROM ({semiSQL}) {df.alias}"
+
+        return (preCode + lpre + rpre, semiSQL)
+
       elif isinstance(df, Join):
 
         (lpre,lparentSQL) = self._buildFrom(df.leftParent())
@@ -331,7 +523,7 @@ class SQLGenerator:
           onSQL = f"USING ({onSQL})"
           preCode += exprPre
         elif isinstance(df.on, LogicExpr) or isinstance(df.on, BoolExpr):
-          (exprPre, onSQL) = self._exprToSQL(df.on)
+          (exprPre, onSQL) = self._exprToSQL(self._simplified(df.on))
           onSQL = "ON " + onSQL
           preCode += exprPre
         elif isinstance(df.on, list):
@@ -389,7 +581,7 @@ class SQLGenerator:
         havings = []
         if df.having:
           for h in df.having:
-            (hPre,hSQL) = self._exprToSQL(h)
+            (hPre,hSQL) = self._exprToSQL(self._simplified(h))
             pre += hPre
             havings.append(hSQL)
 
@@ -406,6 +598,35 @@ class SQLGenerator:
 
         return (preCode + pre, groupSQL)
 
+      elif isinstance(df, Sample):
+        (pre,parentSQL) = self._buildFrom(df.parents[0])
+        (sPre, qry) = self._generateSample(df, parentSQL, computedCols)
+        return (preCode + pre + sPre, qry)
+
+      elif isinstance(df, TopN): # must be checked before Limit
+        (pre,parentSQL) = self._buildFrom(df.parents[0])
+
+        (oPre, orderBy) = self._orderBySQL(df.by, df.ascending)
+        pre += oPre
+
+        limitClause = self.templates["limit"].lower()
+        (lPre,limitExpr) = self._exprToSQL(df.limit)
+        pre += lPre
+
+        if limitClause == "top":
+          qry = f"SELECT TOP {limitExpr} * FROM ({parentSQL}) {df.alias} ORDER BY {orderBy}"
+        elif limitClause == "limit":
+          qry = f"SELECT * FROM ({parentSQL}) {df.alias} ORDER BY {orderBy} LIMIT {limitExpr}"
+        else:
+          raise ValueError(f"Unknown keyword for LIMIT: {limitClause}")
+
+        if df.offset is not None:
+          (oPre, offsetExpr) = self._exprToSQL(df.offset)
+          pre += oPre
+          qry += f" OFFSET {offsetExpr}"
+
+        return (preCode+pre, qry)
+
       elif isinstance(df, Limit):
         (pre,parentSQL) = self._buildFrom(df.parents[0])
 
@@ -434,26 +655,14 @@ class SQLGenerator:
       elif isinstance(df, Ordering):
         (pre,parentSQL) = self._buildFrom(df.parents[0])
 
-        by = []
-        for attr in df.by:
-          (exprPre, exprSQL) = self._exprToSQL(attr)
-          pre += exprPre
-          by.append(exprSQL)
-
-        direction = ""
-        # If ascending is not specified, default is ascending on all columns. If specifiec, it can 
-        # be a bool for the order on all columns or a list, specifying a columnwise order.
-        if df.ascending is not None:
-          if isinstance(df.ascending, list):
-            by = [i + " " + ("ASC" if j else "DESC") for i, j in zip(by, df.ascending)]
-          else:
-            direction = "ASC" if df.ascending else "DESC"
-        else:
-          direction = "ASC"
+        (oPre, by) = self._orderBySQL(df.by, df.ascending)
+        pre += oPre
 
-        by = ",".join(by)
+        proj = "*"
+        if computedCols:
+          proj += ","+computedCols
 
-        qry = f"SELECT * FROM ({parentSQL}) {df.alias} ORDER BY {by} {direction}"
+        qry = f"SELECT {proj} FROM ({parentSQL}) {df.alias} ORDER BY {by}"
 
         return (preCode+pre, qry)
 
@@ -464,12 +673,145 @@ class SQLGenerator:
       return ("","")
 
 
+  def _batchedUDFs(self, df) -> List[FuncCall]:
+    '''the computed columns of df that are Python UDFs to be evaluated in batches'''
+    if not self.batchUDFs or "batch_udfs" not in self.templates:
+      return []
+
+    # the result is assembled with an explicit column list, so all columns must be known:
+    # a schema the user gave for some columns of a table would drop the others
+    if df.schema.typeDict is None or not df.schema.complete or not (isinstance(df, Table) or isinstance(df, Filter) or (isinstance(df, Projection) and not df.doDistinct)):
+      return []
+
+    def batchable(udf):
+      # model UDFs need a batched variant of their template
+      return f"{udf.modelType.name}_batch_code" in self.templates if isinstance(udf, ModelUDF) else udf.lang == "py"
+
+    return [x for x in df.computedCols if isinstance(x, FuncCall) and x.udf is not None and batchable(x.udf)
+      and x.alias and x.alias in df.schema.typeDict]
+
+  def _generateBatchedUDFs(self, df, calls: List[FuncCall]) -> Tuple[List[str], str]:
+    '''
+    Instead of calling the UDFs for every row, the rows are numbered and the
+    input values are aggregated into arrays of batch_udfs.size rows. The
+    batched variant of the function is called once per array and its
+    result array is unnested and joined back to the rows by their number
+    '''
+    size = self.templates["batch_udfs"]["size"]
+
+    pre = []
+    replaced = {}
+    inputs = []
+    for (i, f) in enumerate(calls):
+      names = []
+      cols = ["row_number() OVER () as grizzly_rn"] if i == 0 else []
+      for (j, col) in enumerate(f.inputCols):
+        (p, c) = self._exprToSQL(col)
+        pre += p
+        names.append(SQLGenerator.udfInputName(i, j))
+        cols.append(f"{c} as {names[-1]}")
+
+      replaced[id(f)] = cols
+      inputs.append(names)
+
+    (basePre, baseSQL) = self._buildWithReplaced(df, replaced, {})
+
+    for f in calls:
+      pre += DDLStatement.create(f"function {SQLGenerator._batchFuncName(f.udf)}", [SQLGenerator._generateCreateFunc(f.udf, self.templates, batched=True)])
+
+    src = GrizzlyGenerator._incrAndGetTupleVar()
+    batches = GrizzlyGenerator._incrAndGetTupleVar()
+    results = GrizzlyGenerator._incrAndGetTupleVar()
+
+    # all aggregates of a group see the rows in the same order, the arrays are aligned
+    aggs = ",".join(["array_agg(grizzly_rn) as grizzly_rn"] + [f"array_agg({n}) as {n}" for names in inputs for n in names])
+    batchSQL = f"SELECT {aggs} FROM {src} GROUP BY (grizzly_rn - 1) / {size}"
+
+    funcCalls = [f"unnest({SQLGenerator._batchFuncName(f.udf)}({','.join(f'{batches}.{n}' for n in names)})) as {f.alias}" for (f, names) in zip(calls, inputs)]
+    resultSQL = f"SELECT unnest({batches}.grizzly_rn) as grizzly_rn,{','.join(funcCalls)} FROM ({batchSQL}) {batches}"
+
+    aliases = set(f.alias for f in calls)
+    cols = ",".join(f"{results}.{c}" if c in aliases else f"{src}.{c}" for c in df.schema.typeDict)
+
+    qry = f"WITH {src} AS ({baseSQL}) SELECT {cols} FROM {src} JOIN ({resultSQL}) {results} ON {src}.grizzly_rn = {results}.grizzly_rn"
+    # the join does not keep the order of the rows, the row numbers follow the order of the input
+    if SQLGenerator._isOrdered(df.parents[0] if df.parents else None):
+      qry += f" ORDER BY {src}.grizzly_rn"
+    return (basePre + pre, qry)
+
+  @staticmethod
+  def _isOrdered(df) -> bool:
+    '''whether the rows of df are sorted, i.e. df or one of its parents before any filter or projection is an Ordering'''
+    while isinstance(df, (Filter, Projection, Limit)) and not isinstance(df, TopN):
+      df = df.parents[0]
+    return isinstance(df, (Ordering, TopN))
+
   @staticmethod
-  def _generateCreateFunc(udf: UDF, templates) -> str:
+  def udfInputName(i: int, j: int) -> str:
+    '''name of the column with the j-th input value of the i-th UDF, for UDFs evaluated in batches or locally'''
+    return f"grizzly_p{i}_{j}"
+
+  def _buildWithReplaced(self, df, replacedCols, addedCols) -> Tuple[List[str], str]:
+    '''_buildFrom with the given replaced computed columns and added projection columns'''
+    (prevReplaced, prevAdded) = (self._replacedCols, self._addedCols)
+    self._replacedCols = {**prevReplaced, **replacedCols}
+    self._addedCols = {**prevAdded, **addedCols}
+    try:
+      return self._buildFrom(df)
+    finally:
+      (self._replacedCols, self._addedCols) = (prevReplaced, prevAdded)
+
+  def generateFallbackInput(self, df, calls: List[FuncCall], needed: List[FuncCall] = None) -> Tuple[List[str], str]:
+    '''
+    The query for df with NULL for the given UDF calls, which are computed by df
+    or one of its parents. The input values of the calls in needed (default:
+    all) are selected as udfInputName(i, j) instead, where i is the index in
+    needed, so that the UDFs can be applied locally (see grizzly.fallback).
+    Projections between df and the calls pass the input values through
+    '''
+    if needed is None:
+      needed = calls
+
+    pre = []
+    replaced = {id(f): [f"NULL as {f.alias}"] for f in calls}
+    names = []
+    for (i, f) in enumerate(needed):
+      for (j, col) in enumerate(f.inputCols):
+        (p, c) = self._exprToSQL(col)
+        pre += p
+        names.append(SQLGenerator.udfInputName(i, j))
+        replaced[id(f)].append(f"{c} as {names[-1]}")
+
+    added = {}
+    ids = set(id(f) for f in calls)
+    current = df
+    while current is not None and not any(id(x) in ids for x in current.computedCols):
+      if isinstance(current, Projection) and current.columns:
+        added[id(current)] = names
+      current = current.parents[0] if current.parents else None
+
+    (basePre, qry) = self._buildWithReplaced(df, replaced, added)
+    return (SQLGenerator._makeUnique(basePre + pre), qry)
+
+  @staticmethod
+  def _batchFuncName(udf: UDF) -> str:
+    return f"{udf.name}_batch"
+
+  @staticmethod
+  def _generateCreateFunc(udf: UDF, templates, batched: bool = False) -> str:
+    '''
+    batched: create the variant of the function that gets arrays of input
+    values and returns an array of results (see _generateBatchedUDFs)
+    '''
     isVectorizedFunction = udf.name.startswith("vec_")
 
-    vectorsArePassed = templates["vectorized_udfs"] if "vectorized_udfs" in templates else False
-    template = templates[f"createfunction_{udf.lang}"]
+    vectorsArePassed = batched or (templates["vectorized_udfs"] if "vectorized_udfs" in templates else False)
+    template = templates["batch_udfs"]["createfunction"] if batched else templates[f"createfunction_{udf.lang}"]
+    funcName = SQLGenerator._batchFuncName(udf) if batched else udf.name
+
+    def mapType(t):
+      sqlType = SQLGenerator._mapTypes(t, templates['types'])
+      return templates['types']['list'].replace("$$datatype$$", sqlType) if batched else sqlType
 
     paramsStr = ""
 
@@ -479,28 +821,35 @@ class SQLGenerator:
       lines = udf.lines[1:]
 
     # e.g. MonetDB passes vectors to UDF. If the user expects scalar values we have to wrap it manually but maintain variable names!
-    if vectorsArePassed and not isVectorizedFunction: 
+    # The templates of model UDFs handle vectors themselves
+    if vectorsArePassed and (not isVectorizedFunction or batched) and not isinstance(udf, ModelUDF):
       paramNames = [f"_{p.name}" for p in udf.params ] # input param names
       paramNamesStr = ",".join(paramNames)
-      paramsStr = ",".join([f"{n} {SQLGenerator._mapTypes(p.type, templates['types'])}" for (n, p) in zip(paramNames, udf.params)]) # param declaration in signature
+      paramsStr = ",".join([f"{n} {mapType(p.type)}" for (n, p) in zip(paramNames, udf.params)]) # param declaration in signature
       varNames = [f"{p.name}" for p in udf.params ] # var names to use in loop
       varNamesStr = ",".join(varNames)
 
-      lines = [signature.replace(udf.name, "_"+udf.name)] + lines
+      lines = [signature.replace(f"def {udf.name}", f"def _{udf.name}", 1)] + lines
 
       loop = ""
 
-      if len(udf.params) > 1:
+      if isVectorizedFunction:
+        # batched: the function works on whole vectors, pass the arrays of the chunk as NumPy arrays
+        arrays = ",".join(f"numpy.asarray({n})" for n in paramNames)
+        loop = f"import numpy\nreturn numpy.asarray(_{udf.name}({arrays})).tolist()\n"
+      elif len(udf.params) > 1:
         # loop = f"for ({varNamesStr}) in zip({paramNamesStr}):\n"
         loop = f"return [ _{udf.name}({varNamesStr}) for ({varNamesStr}) in zip({paramNamesStr}) ]\n"
       else:
         loop = f"return [ _{udf.name}({varNamesStr}) for {varNamesStr} in {paramNamesStr} ]\n"
 
-      lines.append(loop)
+      # same indentation as the signature, the lines are unindented below
+      indent = signature[:len(signature) - len(signature.lstrip())]
+      lines += [indent + l + "\n" for l in loop.splitlines()]
     else:
-      paramsStr = ",".join([f"{p.name} {SQLGenerator._mapTypes(p.type, templates['types'])}" for p in udf.params])
+      paramsStr = ",".join([f"{p.name} {mapType(p.type)}" for p in udf.params])
 
-    returnType = SQLGenerator._mapTypes(udf.returnType, templates['types'])
+    returnType = mapType(udf.returnType)
     
     leadingSpaces = 0
     for line in template.split("\n"):
@@ -510,10 +859,19 @@ class SQLGenerator:
         break
 
     pre = ""
+    volatility = purity.VOLATILE
     if isinstance(udf, ModelUDF):
-      lines = templates[udf.modelType.name + "_code"]
+      lines = templates[udf.modelType.name + ("_batch_code" if batched else "_code")]
+      # models are loaded through a cache shared by all model UDFs of a DBMS process
+      maxModels = templates["model_cache"]["max_models"] if "model_cache" in templates else modelcache.MAX_MODELS
+      lines = lines.replace("$$modelcache$$", modelcache.source(maxModels))
       for key, value in udf.templace_replacement_dict.items():
-        lines = lines.replace(key, str(value))
+        if value is not None:
+          lines = lines.replace(key, str(value))
+
+      # rows passed to the model at once, if not given for the model
+      batchSize = templates["model_batch_size"] if "model_batch_size" in templates else 1
+      lines = lines.replace("$$batchsize$$", str(batchSize))
 
     else:
       
@@ -523,11 +881,12 @@ class SQLGenerator:
       lines = [" "*leadingSpaces + line for line in lines] 
 
       lines = "".join(lines) # put back together
+      volatility = purity.ofPython("".join(udf.lines))
 
       if udf.lang == "sql":
         try:
           # Try to compile code of udf and pass mapping template
-          pre, lines = udfcompiler.compile(lines, templates, udf.params)
+          pre, lines, volatility = udfcompiler.compile(lines, templates, udf.params)
         except Exception as e:
           logger.info(f'Compiling of UDF to "{udf.lang}" failed: {e}')
           # If compiling fails try fallbackmode with PL/PY translation if wanted
@@ -545,8 +904,12 @@ class SQLGenerator:
 
     # print(lines)
 
-    code = template.replace("$$name$$", udf.name)\
+    # IMMUTABLE, PARALLEL SAFE, ... depending on what the function does
+    attributes = templates["udf_attributes"].get(volatility, "") if "udf_attributes" in templates else ""
+
+    code = template.replace("$$name$$", funcName)\
       .replace("$$pre$$", pre)\
+      .replace("$$attributes$$", attributes)\
       .replace("$$inparams$$",paramsStr)\
       .replace("$$returntype$$",returnType)\
       .replace("$$code$$",lines)\
@@ -568,9 +931,195 @@ class SQLGenerator:
     # if we get here it's not a string and not a AggType --> error
     raise ExpressionException(f"invalid function value: {aggType}, expected string or AggregateType, but got {type(aggType)}")
 
+  def _generateSample(self, df: Sample, parentSQL: str, computedCols: str) -> Tuple[List[str], str]:
+    '''
+    Use (in this order) the dialect's TABLESAMPLE clause if a fraction of a
+    base table is sampled, a SAMPLE clause for the whole query or a filter on
+    / ordering by a random value
+    '''
+    if "sample" not in self.templates:
+      raise ValueError(f"Sampling is not supported for profile {self.profile}")
+    conf = self.templates["sample"]
+
+    proj = "*"
+    if computedCols:
+      proj += ","+computedCols
+
+    def seedSQL(key):
+      if df.seed is None:
+        return ""
+      if key not in conf:
+        raise ValueError(f"Seeded samples are not supported for profile {self.profile}")
+      return conf[key].replace("$$seed$$", str(int(df.seed)))
+
+    # the whole input, e.g. Oracle rejects SAMPLE(100)
+    if df.frac is not None and df.frac >= 1:
+      return ([], f"SELECT {proj} FROM ({parentSQL}) {df.alias}")
+
+    parent = df.parents[0]
+    methods = conf.get("methods", {})
+    if df.frac is not None and "tablesample" in conf and df.method in methods and isinstance(parent, Table) and not parent.computedCols:
+      fromSQL = conf["tablesample"].replace("$$table$$", parent.table).replace("$$alias$$", df.alias) \
+        .replace("$$method$$", methods[df.method]).replace("$$percent$$", str(round(df.frac * 100, 10))) \
+        .replace("$$seed$$", seedSQL("seed"))
+      return ([], f"SELECT {proj} FROM {fromSQL}")
+
+    size = df.frac if df.frac is not None else int(df.n)
+
+    if "clause" in conf:
+      qry = f"SELECT {proj} FROM ({parentSQL}) {df.alias} " + conf["clause"].replace("$$size$$", str(size)).replace("$$seed$$", seedSQL("seed"))
+      return ([], qry)
+
+    if "random" not in conf:
+      raise ValueError(f"No sampling method configured for profile {self.profile}")
+
+    if df.seed is None:
+      rand = conf["random"]
+    else:
+      rand = seedSQL("random_seed")
+
+    if df.frac is not None:
+      return ([], f"SELECT {proj} FROM ({parentSQL}) {df.alias} WHERE {rand} < {df.frac}")
+
+    # n rows: a top-n by a random key, which the DBMS computes in one pass with bounded memory
+    if "limit" not in self.templates:
+      raise ValueError(f"Samples of n rows are not supported for profile {self.profile}, it has no limit template")
+    limitClause = self.templates["limit"].lower()
+    if limitClause == "top":
+      return ([], f"SELECT TOP {size} {proj} FROM ({parentSQL}) {df.alias} ORDER BY {rand}")
+    elif limitClause == "limit":
+      return ([], f"SELECT {proj} FROM ({parentSQL}) {df.alias} ORDER BY {rand} LIMIT {size}")
+    else:
+      raise ValueError(f"Unknown keyword for LIMIT: {limitClause}")
+
+  def _orderBySQL(self, by, ascending, everyColumn: bool = False) -> Tuple[List[str], str]:
+    '''
+    everyColumn: a single direction applies to all columns (window functions). For
+    ORDER BY of a DataFrame it's only generated after the last column
+    '''
+    pre = []
+    cols = []
+    for attr in by:
+      (exprPre, exprSQL) = self._exprToSQL(attr)
+      pre += exprPre
+      cols.append(exprSQL)
+
+    # If ascending is not specified, default is ascending on all columns. If specifiec, it can 
+    # be a bool for the order on all columns or a list, specifying a columnwise order.
+    direction = ""
+    if isinstance(ascending, list):
+      cols = [i + " " + ("ASC" if j else "DESC") for i, j in zip(cols, ascending)]
+    elif everyColumn:
+      d = "ASC" if ascending is None or ascending else "DESC"
+      cols = [f"{i} {d}" for i in cols]
+    else:
+      direction = " ASC" if ascending is None or ascending else " DESC"
+
+    return (pre, ",".join(cols) + direction)
+
+  def _generateWindowFunc(self, f: WindowFunc) -> Tuple[List[str], str]:
+    if "window" not in self.templates:
+      raise ValueError(f"Window functions are not supported for profile {self.profile}")
+    windowConf = self.templates["window"]
+
+    fName = SQLGenerator._getSQLFuncName(f.funcName)
+    if fName.lower() not in windowConf.get("funcs", []):
+      raise ValueError(f"Window function {fName} is not supported for profile {self.profile}")
+    if f.frame is not None and not windowConf.get("frames", False):
+      raise ValueError(f"Window frames (cumulative or rolling aggregates) are not supported for profile {self.profile}")
+
+    pre = []
+    def toSQL(cols):
+      sqls = []
+      for c in cols:
+        (p, cSQL) = self._exprToSQL(c)
+        pre.extend(p)
+        sqls.append(cSQL)
+      return sqls
+
+    inCols = ",".join(toSQL(f.inputCols))
+
+    over = []
+    if f.partitionBy:
+      over.append("PARTITION BY " + ",".join(toSQL(f.partitionBy)))
+
+    if f.orderBy:
+      (oPre, by) = self._orderBySQL(f.orderBy, f.ascending, everyColumn=True)
+      pre.extend(oPre)
+      over.append("ORDER BY " + by)
+
+    if f.frame == "unbounded":
+      over.append("ROWS BETWEEN UNBOUNDED PRECEDING AND CURRENT ROW")
+    elif f.frame is not None:
+      over.append(f"ROWS BETWEEN {int(f.frame)} PRECEDING AND CURRENT ROW")
+
+    overSQL = " ".join(over)
+    return (pre, f"{fName}({inCols}) OVER ({overSQL}) as {f.alias}")
+
+  def hasNativeAggregate(self, funcName) -> bool:
+    '''whether the dialect has a function for the (approximate) aggregate'''
+    if not AggregateType.isApproximate(funcName):
+      return True
+    return "approx" in self.templates and SQLGenerator._approxKey(funcName) in self.templates["approx"]
+
+  @staticmethod
+  def _approxKey(funcName) -> str:
+    return "count_distinct" if funcName == AggregateType.APPROX_COUNT_DISTINCT else "quantile"
+
+  def _generateApproxAgg(self, f: FuncCall) -> Tuple[List[str], str]:
+    if not self.hasNativeAggregate(f.funcName):
+      raise ValueError(f"{AggregateType.getName(f.funcName)} is not supported in queries for profile {self.profile}")
+
+    (pre, col) = self._exprToSQL(f.inputCols[0])
+    code = self.templates["approx"][SQLGenerator._approxKey(f.funcName)].replace("$$col$$", col)
+    if f.funcName == AggregateType.APPROX_QUANTILE:
+      code = code.replace("$$q$$", str(f.inputCols[1].value))
+
+    if f.alias:
+      code += f" as {f.alias}"
+    return (pre, code)
+
+  def _inlineUDF(self, f: FuncCall):
+    '''
+    A UDF to be translated to SQL (lang='sql') that is simple enough to be
+    computed by an expression is embedded into the query instead of creating
+    a function. Returns None if that's not possible
+    '''
+    udf = f.udf
+    if not self.inlineUDFs or udf is None or isinstance(udf, ModelUDF) or udf.lang != "sql" or "inline" not in self.templates:
+      return None
+
+    key = udfcompiler._cacheKey("".join(udf.lines) + udf.returnType, self.templates, udf.params)
+    if key in self._inlined:
+      code = self._inlined[key]
+    else:
+      code = inline(udf.lines, self.templates, udf.params, udf.returnType)
+      self._inlined[key] = code
+    if code is None:
+      return None
+
+    pre = []
+    values = []
+    for col in f.inputCols:
+      (p, c) = self._exprToSQL(col)
+      pre += p
+      values.append(c)
+    code = substituteParams(code, values)
+
+    if f.alias:
+      code += f" as {f.alias}"
+    return (pre, code)
+
   def _generateFuncCall(self, f: FuncCall):
+    if AggregateType.isApproximate(f.funcName):
+      return self._generateApproxAgg(f)
+
+    inlined = self._inlineUDF(f)
+    if inlined is not None:
+      return inlined
+
     if f.udf:
-      pre = [SQLGenerator._generateCreateFunc(f.udf, self.templates)]
+      pre = DDLStatement.create(f"function {f.udf.name}", [SQLGenerator._generateCreateFunc(f.udf, self.templates)])
     else:
       pre = []
 
@@ -628,7 +1177,7 @@ class SQLGenerator:
         .replace("$$fdw_extension_name$$", tab.fdw_extension_name)
       queries.append(code)
     
-    return queries
+    return DDLStatement.create(f"table {tab.table}", queries)
 
   
   def _generateAggCode(self, df, f) -> Tuple[Set[str],str]:
@@ -656,6 +1205,25 @@ class SQLGenerator:
 
     return (preQueryCode, qryString)
 
+  def generateExplain(self, df, analyze = False) -> Tuple[List[str], str, str]:
+    '''
+    Wrap the query for df into the EXPLAIN statement of the profile.
+    Returns the pre-queries, the explain statement and the output format
+    '''
+    if "explain" not in self.templates:
+      raise ValueError(f"EXPLAIN is not supported for profile {self.profile}")
+
+    explainConf = self.templates["explain"]
+    key = "analyze" if analyze else "plan"
+    if key not in explainConf:
+      raise ValueError(f"EXPLAIN {'ANALYZE ' if analyze else ''}is not supported for profile {self.profile}")
+
+    (pre, qry) = self.generate(df)
+    explainSQL = explainConf[key].replace("$$query$$", qry)
+    fmt = explainConf.get("format", "text")
+
+    return (pre, explainSQL, fmt)
+
   def getTableSchema(self, tableName):
     
     qry = None
@@ -1,22 +1,119 @@
 # Top level compiler call for grizzly connection
+import collections
+import hashlib
+import json
+import logging
 import os
-from antlr4 import *
-from grizzly.udfcompiler.py_parser.Python3d3Lexer import Python3d3Lexer
-from grizzly.udfcompiler.py_parser.Python3d3Parser import Python3d3Parser
-from grizzly.udfcompiler.py_parser.Python3d3Visitor import Python3d3Visitor
+import tempfile
+from grizzly.udfcompiler import purity
 from grizzly.udfcompiler.udfcompiler_exceptions import UDFParseException
 
+logger = logging.getLogger(__name__)
+
+# Compiled UDFs are cached in memory and on disk, keyed by the source code, the
+# profile (and its templates) and the parameters. Set cacheDir to None to
+# disable the disk cache. Bump _CACHE_VERSION if the generated code changes
+cacheDir = os.environ.get("GRIZZLY_UDF_CACHE", os.path.join(os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "grizzly", "udfs"))
+maxCacheEntries = 256
+_CACHE_VERSION = 2
+_cache = collections.OrderedDict()
+
+# The ANTLR runtime and the generated parser are expensive to import. They are
+# only needed when a UDF is actually compiled (lang='sql'), so we load them on
+# first use and keep the modules here afterwards.
+_antlr = None
+
+def _loadParser():
+    global _antlr
+    if _antlr is None:
+        import antlr4
+        from grizzly.udfcompiler.py_parser.Python3d3Lexer import Python3d3Lexer
+        from grizzly.udfcompiler.py_parser.Python3d3Parser import Python3d3Parser
+        from grizzly.udfcompiler.py_parser.Python3d3Visitor import Python3d3Visitor
+        _antlr = (antlr4, Python3d3Lexer, Python3d3Parser, Python3d3Visitor)
+
+    return _antlr
+
+def clearCache():
+    _cache.clear()
+
+def _cacheKey(source, templates, params):
+    # the templates determine the generated code, so a changed grizzly.yml must not hit old entries
+    profile = getattr(templates, "profile", None)
+    config = getattr(templates, "config", templates)
+    h = hashlib.sha256()
+    for part in [str(_CACHE_VERSION), source, str(profile), repr(config)] + [f"{p.name}:{p.type}" for p in params]:
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+def _readDiskCache(key):
+    if not cacheDir:
+        return None
+    path = os.path.join(cacheDir, key + ".json")
+    try:
+        with open(path, "r") as f:
+            (pre, sql, volatility) = json.load(f)
+        return (pre, sql, volatility)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.debug(f"ignoring unreadable UDF cache entry {path}: {e}")
+        return None
+
+def _writeDiskCache(key, result):
+    if not cacheDir:
+        return
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        # write to a temp file first, concurrent processes must never read a partial entry
+        (fd, tmpPath) = tempfile.mkstemp(dir=cacheDir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(list(result), f)
+        os.replace(tmpPath, os.path.join(cacheDir, key + ".json"))
+    except OSError as e:
+        logger.debug(f"could not write UDF cache entry: {e}")
+
 def compile(input, templates, params):
+    '''
+    Compile the UDF to procedural SQL. Returns the statements to run before
+    creating the function, the function's code and its volatility (see purity)
+    '''
     # Check if passed argument is a file or a string
-    if os.path.isfile(input):
-        input_stream = FileStream(input)
+    isFile = os.path.isfile(input)
+    if isFile:
+        with open(input, "r") as f:
+            source = f.read()
     else:
-        input_stream = InputStream(input)
+        source = input
+
+    key = _cacheKey(source, templates, params)
+    result = _cache.get(key)
+    if result is None:
+        result = _readDiskCache(key)
+        if result is None:
+            result = _compile(input, isFile, templates, params)
+            _writeDiskCache(key, result)
+        _cache[key] = result
+        if len(_cache) > maxCacheEntries:
+            _cache.popitem(last=False)
+    else:
+        _cache.move_to_end(key)
+
+    return result
+
+def _compile(input, isFile, templates, params):
+    (antlr4, Python3d3Lexer, Python3d3Parser, Python3d3Visitor) = _loadParser()
+
+    if isFile:
+        input_stream = antlr4.FileStream(input)
+    else:
+        input_stream = antlr4.InputStream(input)
 
     # Create the lexer from the input
     lexer = Python3d3Lexer(input_stream)
     # Create the tokenstream from the lexer
-    stream = CommonTokenStream(lexer)
+    stream = antlr4.CommonTokenStream(lexer)
     # Create the parser with the tokenstream
     parser = Python3d3Parser(stream)
     # Create the syntax tree with the file_input as the first executed rule (node)
@@ -36,7 +133,7 @@ def compile(input, templates, params):
 
     # Add statements that should be queried before PL/SQL Block
     pre = ' '.join(line for line in visitor.pre)
-    
+
     sql = ''
 
     # Collect all exceptions in udf
@@ -52,8 +149,8 @@ def compile(input, templates, params):
     # Add cursors after variable declaration
     for line in visitor.cursor:
         sql += (f'{line};')
-    
+
     # Add Statements for BEGIN block
     sql += ' '.join(str(line) for line in visitor.statements)
-    
-    return pre, sql
+
+    return pre, sql, purity.ofCompiled(visitor)
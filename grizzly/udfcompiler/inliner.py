@@ -0,0 +1,310 @@
+# Translation of simple Python UDFs into a single SQL expression.
+#
+# A UDF that only consists of assignments, if/else and returns, and only uses
+# arithmetic, comparisons, boolean operators, string concatenation and the
+# functions mapped in the 'funcs' section of the profile, does not need a
+# procedural function: its result can be computed with an expression (CASE
+# WHEN for the branches) that is embedded in the query. The optimizer can
+# see through it and there is no function call overhead.
+#
+# Everything else is rejected, the UDF is then compiled to a procedural
+# function as before.
+import ast
+import logging
+import re
+import sys
+import textwrap
+
+logger = logging.getLogger(__name__)
+
+# generated expressions grow with every branch (the statements after an if
+# are inlined into both branches), very long ones are better off as function
+MAX_EXPRESSION_LENGTH = 10000
+# every if duplicates the statements after it, the number of branches grows
+# exponentially with sequential ifs. Stop early instead of building them all
+MAX_BRANCHES = 64
+
+_NUMERIC = ("int", "float")
+
+# before Python 3.8 the parser creates Num, Str and NameConstant nodes instead of Constant
+_LEGACY_CONSTANTS = (ast.Num, ast.Str, ast.NameConstant) if sys.version_info < (3, 8) else ()
+
+class NotInlinable(Exception):
+    pass
+
+def paramPlaceholder(i: int) -> str:
+    return f"$$param{i}$$"
+
+# string literals (quotes are doubled inside) or a parameter placeholder
+_PARAM_OR_LITERAL = re.compile(r"'(?:[^']|'')*'|\$\$param(\d+)\$\$")
+
+def substituteParams(sql: str, values) -> str:
+    '''
+    Replace the placeholders of the parameters in the inlined expression with
+    values[i]. Placeholder text in string literals of the UDF is kept as it is
+    '''
+    def replace(m):
+        return m.group(0) if m.group(1) is None else values[int(m.group(1))]
+    return _PARAM_OR_LITERAL.sub(replace, sql)
+
+def _isConstant(node) -> bool:
+    return isinstance(node, ast.Constant) or isinstance(node, _LEGACY_CONSTANTS)
+
+def _constantValue(node):
+    if isinstance(node, ast.Constant):
+        return node.value
+    elif isinstance(node, ast.Num):
+        return node.n
+    elif isinstance(node, ast.Str):
+        return node.s
+    return node.value # NameConstant
+
+def _dottedName(node) -> str:
+    '''the name of a called function, e.g. len or math.sqrt'''
+    if isinstance(node, ast.Name):
+        return node.id
+    elif isinstance(node, ast.Attribute):
+        return f"{_dottedName(node.value)}.{node.attr}"
+    raise NotInlinable(f"unsupported function call: {type(node).__name__}")
+
+def inline(lines, templates, params, returnType):
+    '''
+    Translate the UDF source (lines, including the signature) into an SQL
+    expression. Parameters are referenced as paramPlaceholder(i). Returns None
+    if the UDF cannot be inlined
+    '''
+    try:
+        tree = ast.parse(textwrap.dedent("".join(lines)))
+        funcs = [n for n in tree.body if isinstance(n, ast.FunctionDef)]
+        if len(funcs) != 1 or funcs[0].decorator_list:
+            raise NotInlinable("expected a single function definition")
+
+        inliner = _Inliner(templates, params)
+        (sql, sqlType) = inliner.block(funcs[0].body, {})
+
+        if sqlType != returnType:
+            if sqlType in _NUMERIC and returnType in _NUMERIC:
+                sql = f"CAST({sql} AS {inliner.mapType(returnType)})"
+            else:
+                raise NotInlinable(f"return type {sqlType} does not match declared type {returnType}")
+
+        if len(sql) > MAX_EXPRESSION_LENGTH:
+            raise NotInlinable("expression too long")
+        return sql
+    except (NotInlinable, SyntaxError, RecursionError) as e:
+        logger.debug(f"UDF cannot be inlined: {e}")
+        return None
+
+class _Inliner:
+    def __init__(self, templates, params):
+        self.inlineConf = templates["inline"]
+        self.types = templates["types"] if "types" in templates else {}
+        self.funcs = templates["funcs"] if "funcs" in templates else {}
+        self.params = {p.name: (paramPlaceholder(i), p.type) for (i, p) in enumerate(params)}
+        # CASE expressions generated by case(), to merge elif chains
+        self.cases = set()
+        self.branches = 0
+
+    def mapType(self, pyType):
+        return self.types.get(pyType, pyType)
+
+    def block(self, stmts, env):
+        '''the value returned by the list of statements: (sql, type)'''
+        env = dict(env)
+        for (i, stmt) in enumerate(stmts):
+            if isinstance(stmt, ast.Return):
+                if stmt.value is None:
+                    raise NotInlinable("return without value")
+                return self.expr(stmt.value, env)
+
+            elif isinstance(stmt, ast.Assign):
+                if len(stmt.targets) != 1 or not isinstance(stmt.targets[0], ast.Name):
+                    raise NotInlinable("only assignments to a single variable are supported")
+                env[stmt.targets[0].id] = self.expr(stmt.value, env)
+
+            elif isinstance(stmt, ast.AnnAssign):
+                if not isinstance(stmt.target, ast.Name) or stmt.value is None:
+                    raise NotInlinable("only assignments to a single variable are supported")
+                env[stmt.target.id] = self.expr(stmt.value, env)
+
+            elif isinstance(stmt, ast.AugAssign):
+                if not isinstance(stmt.target, ast.Name):
+                    raise NotInlinable("only assignments to a single variable are supported")
+                target = ast.Name(id=stmt.target.id, ctx=ast.Load())
+                env[stmt.target.id] = self.binOp(stmt.op, target, stmt.value, env)
+
+            elif isinstance(stmt, ast.If):
+                # the remaining statements are part of both branches
+                rest = stmts[i + 1:]
+                self.branches += 1
+                if self.branches > MAX_BRANCHES:
+                    raise NotInlinable("too many branches")
+                cond = self.condition(stmt.test, env)
+                (thenSQL, thenType) = self.block(stmt.body + rest, env)
+                (elseSQL, elseType) = self.block(stmt.orelse + rest, env)
+                return self.case(cond, (thenSQL, thenType), (elseSQL, elseType))
+
+            elif isinstance(stmt, ast.Pass) or (isinstance(stmt, ast.Expr) and _isConstant(stmt.value) and isinstance(_constantValue(stmt.value), str)):
+                continue # pass or docstring
+
+            else:
+                raise NotInlinable(f"unsupported statement: {type(stmt).__name__}")
+
+        raise NotInlinable("function may end without return")
+
+    def case(self, cond, then, otherwise):
+        (thenSQL, thenType) = then
+        (elseSQL, elseType) = otherwise
+        resultType = self.commonType(thenType, elseType)
+        if resultType == "bool":
+            raise NotInlinable("boolean values are not supported")
+
+        if elseSQL in self.cases:
+            # CASE WHEN a THEN x ELSE CASE WHEN b THEN y ELSE z END END -> CASE WHEN a THEN x WHEN b THEN y ELSE z END
+            sql = f"CASE WHEN {cond} THEN {thenSQL} {elseSQL[len('CASE '):]}"
+        else:
+            sql = f"CASE WHEN {cond} THEN {thenSQL} ELSE {elseSQL} END"
+        if len(sql) > MAX_EXPRESSION_LENGTH:
+            raise NotInlinable("expression too long")
+        self.cases.add(sql)
+        return (sql, resultType)
+
+    def commonType(self, a, b):
+        if a == b:
+            return a
+        if a in _NUMERIC and b in _NUMERIC:
+            return "float"
+        raise NotInlinable(f"incompatible types {a} and {b}")
+
+    def condition(self, node, env):
+        (sql, sqlType) = self.expr(node, env)
+        if sqlType != "bool":
+            raise NotInlinable("conditions must be comparisons or boolean expressions")
+        return sql
+
+    def expr(self, node, env):
+        '''SQL for the expression node: (sql, type)'''
+        if isinstance(node, ast.Name):
+            if node.id in env:
+                return env[node.id]
+            if node.id in self.params:
+                (placeholder, pType) = self.params[node.id]
+                return (f"({placeholder})", pType)
+            raise NotInlinable(f"unknown variable {node.id}")
+
+        elif _isConstant(node):
+            v = _constantValue(node)
+            if isinstance(v, bool) or v is None:
+                raise NotInlinable("boolean and None constants are not supported")
+            elif isinstance(v, int):
+                return (str(v), "int")
+            elif isinstance(v, float):
+                return (repr(v), "float")
+            elif isinstance(v, str):
+                return ("'" + v.replace("'", "''") + "'", "str")
+            raise NotInlinable(f"unsupported constant {v!r}")
+
+        elif isinstance(node, ast.BinOp):
+            return self.binOp(node.op, node.left, node.right, env)
+
+        elif isinstance(node, ast.UnaryOp):
+            (sql, sqlType) = self.expr(node.operand, env)
+            if isinstance(node.op, ast.Not) and sqlType == "bool":
+                return (f"NOT ({sql})", "bool")
+            elif isinstance(node.op, ast.USub) and sqlType in _NUMERIC:
+                return (f"(-{sql})", sqlType)
+            elif isinstance(node.op, ast.UAdd) and sqlType in _NUMERIC:
+                return (sql, sqlType)
+            raise NotInlinable(f"unsupported unary operation on {sqlType}")
+
+        elif isinstance(node, ast.BoolOp):
+            op = " AND " if isinstance(node.op, ast.And) else " OR "
+            return ("(" + op.join(self.condition(v, env) for v in node.values) + ")", "bool")
+
+        elif isinstance(node, ast.Compare):
+            terms = []
+            left = self.expr(node.left, env)
+            for (op, comparator) in zip(node.ops, node.comparators):
+                right = self.expr(comparator, env)
+                terms.append(self.compare(op, left, right))
+                left = right
+            if len(terms) == 1:
+                return (terms[0], "bool")
+            return ("(" + " AND ".join(terms) + ")", "bool")
+
+        elif isinstance(node, ast.IfExp):
+            cond = self.condition(node.test, env)
+            return self.case(cond, self.expr(node.body, env), self.expr(node.orelse, env))
+
+        elif isinstance(node, ast.Call):
+            return self.call(node, env)
+
+        raise NotInlinable(f"unsupported expression: {type(node).__name__}")
+
+    def binOp(self, op, leftNode, rightNode, env):
+        (left, lType) = self.expr(leftNode, env)
+        (right, rType) = self.expr(rightNode, env)
+
+        if isinstance(op, ast.Add) and lType == "str" and rType == "str":
+            return ("(" + self.inlineConf["concat"].replace("$$left$$", left).replace("$$right$$", right) + ")", "str")
+
+        if lType not in _NUMERIC or rType not in _NUMERIC:
+            raise NotInlinable(f"unsupported operation on {lType} and {rType}")
+        resultType = "float" if "float" in (lType, rType) else "int"
+
+        if isinstance(op, ast.Add):
+            return (f"({left} + {right})", resultType)
+        elif isinstance(op, ast.Sub):
+            return (f"({left} - {right})", resultType)
+        elif isinstance(op, ast.Mult):
+            return (f"({left} * {right})", resultType)
+        elif isinstance(op, ast.Div):
+            # / in Python is always a float division, in SQL it truncates integers
+            return (f"({left} * 1.0 / {right})", "float")
+        elif isinstance(op, ast.Mod) and resultType == "int":
+            # SQL truncates (the result has the sign of the left operand), Python floors (sign
+            # of the right operand): MOD(MOD(a, b) + b, b) is the same as a % b in Python
+            mod = self.inlineConf["mod"].replace("$$left$$", left).replace("$$right$$", right)
+            return ("(" + self.inlineConf["mod"].replace("$$left$$", f"({mod} + {right})").replace("$$right$$", right) + ")", "int")
+
+        raise NotInlinable(f"unsupported operator {type(op).__name__}")
+
+    def compare(self, op, left, right):
+        (lSQL, lType) = left
+        (rSQL, rType) = right
+        if lType == "bool" or rType == "bool":
+            raise NotInlinable("comparison of boolean values")
+        if lType != rType and not (lType in _NUMERIC and rType in _NUMERIC):
+            raise NotInlinable(f"comparison of {lType} and {rType}")
+
+        ops = {ast.Eq: "=", ast.NotEq: "<>", ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">="}
+        sqlOp = ops.get(type(op))
+        if sqlOp is None:
+            raise NotInlinable(f"unsupported comparison {type(op).__name__}")
+        return f"{lSQL} {sqlOp} {rSQL}"
+
+    def call(self, node, env):
+        if node.keywords:
+            raise NotInlinable("keyword arguments are not supported")
+
+        name = _dottedName(node.func)
+        if name not in self.funcs or name in ("print", "print_str", "print_var"):
+            raise NotInlinable(f"no SQL function for {name}")
+
+        args = [self.expr(a, env) for a in node.args]
+
+        if name == "len":
+            if len(args) != 1 or args[0][1] != "str":
+                raise NotInlinable("len is supported for strings only")
+            resultType = "int"
+        elif name == "abs":
+            if len(args) != 1 or args[0][1] not in _NUMERIC:
+                raise NotInlinable("abs requires a number")
+            resultType = args[0][1]
+        elif all(a[1] in _NUMERIC for a in args):
+            # math functions
+            resultType = "float"
+        else:
+            raise NotInlinable(f"unsupported arguments for {name}")
+
+        return (self.funcs[name].replace("$$params$$", ", ".join(a[0] for a in args)), resultType)
@@ -0,0 +1,99 @@
+# Volatility of UDFs.
+#
+# A function that only computes its result from its parameters may be
+# declared IMMUTABLE/DETERMINISTIC and PARALLEL SAFE: the DBMS may then
+# evaluate it in parallel workers and constant-fold or cache calls. Functions
+# that read tables (cursors, db references) are STABLE, everything with side
+# effects (print, database access from Python, global state, unknown
+# functions) stays VOLATILE, the default of the DBMS.
+#
+# The attributes to emit are configured per profile in the 'udf_attributes'
+# section of grizzly.yml.
+import ast
+import textwrap
+from typing import Set
+
+IMMUTABLE = "immutable"
+STABLE = "stable"
+VOLATILE = "volatile"
+
+# builtins that only depend on their arguments. hash() is not part of it, it's
+# randomized per process for strings
+_PURE_BUILTINS = {
+    "abs", "all", "any", "bin", "bool", "chr", "dict", "divmod", "enumerate", "filter", "float",
+    "format", "hex", "int", "isinstance", "len", "list", "map", "max", "min", "oct", "ord", "pow",
+    "range", "repr", "reversed", "round", "set", "sorted", "str", "sum", "tuple", "zip",
+    "True", "False", "None", "ValueError", "TypeError", "ZeroDivisionError"
+}
+
+_PURE_MODULES = {"math"}
+
+def ofCompiled(visitor) -> str:
+    '''volatility of a UDF compiled to procedural SQL, from the compiler's visitor'''
+    if visitor.contains_stmts['print'] or visitor.unmapped_calls:
+        # functions not mapped in the profile are passed through as they are, we don't know what they do
+        return VOLATILE
+    if visitor.contains_stmts['db_reference'] or visitor.cursor:
+        return STABLE
+    return IMMUTABLE
+
+def ofPython(source: str) -> str:
+    '''volatility of a Python UDF (source code including the signature)'''
+    try:
+        tree = ast.parse(textwrap.dedent(source))
+    except SyntaxError:
+        return VOLATILE
+
+    local = _localNames(tree)
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Global, ast.Nonlocal, ast.Yield, ast.YieldFrom, ast.Await)):
+            return VOLATILE
+
+        elif isinstance(node, ast.Import):
+            if any(a.name not in _PURE_MODULES for a in node.names):
+                return VOLATILE
+
+        elif isinstance(node, ast.ImportFrom):
+            if node.module not in _PURE_MODULES:
+                return VOLATILE
+
+        elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            # plpy, GD/SD, print, random, open, ... and whatever else is not defined in the function
+            if node.id not in local and node.id not in _PURE_BUILTINS and node.id not in _PURE_MODULES:
+                return VOLATILE
+
+        elif isinstance(node, ast.Attribute) and not isinstance(node.ctx, ast.Load):
+            # e.g. math.pi = 3, modifies state shared between calls
+            root = node.value
+            while isinstance(root, ast.Attribute):
+                root = root.value
+            if not isinstance(root, ast.Name) or root.id not in local or root.id in _PURE_MODULES:
+                return VOLATILE
+
+    return IMMUTABLE
+
+def freeNames(source: str) -> Set[str]:
+    '''
+    names a Python UDF (source code including the signature) reads but does not
+    define itself: builtins, globals, modules imported outside of the function,
+    variables of an enclosing function
+    '''
+    tree = ast.parse(textwrap.dedent(source))
+    local = _localNames(tree)
+    return {node.id for node in ast.walk(tree) if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in local}
+
+def _localNames(tree) -> Set[str]:
+    '''names assigned, imported or defined (parameters, nested functions) in the tree'''
+    local = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            local.add(node.id)
+        elif isinstance(node, ast.arg):
+            local.add(node.arg)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            local.add(node.name)
+        elif isinstance(node, ast.ExceptHandler) and node.name:
+            local.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            local.update((a.asname or a.name).split(".")[0] for a in node.names)
+    return local
@@ -31,8 +31,10 @@ class Python3d3Visitor(ParseTreeVisitor):
                                 'iterative': False,
                                 'exception': False,
                                 'print': False,
-                                'db-reference': False
+                                'db_reference': False
                                 }
+        # Functions that are not mapped in the template and passed through as they are
+        self.unmapped_calls = []
 
         # Parameters of the UDF need to be availiable for compiler to detect datatypes
         for param in params:
@@ -511,6 +513,7 @@ class Python3d3Visitor(ParseTreeVisitor):
         except (ValueError, KeyError):
             # If function is not mapped, just get whole funccall
             funccall = ctx.getText()
+            self.unmapped_calls.append(funcname)
         return funccall
 
     # Visit a parse tree produced by Python3d3Parser#grzly_expr.